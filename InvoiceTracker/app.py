@@ -1,20 +1,27 @@
 import os
-import threading
 from datetime import date, datetime, timedelta
-from flask import Flask, render_template, redirect, url_for, request, flash, session
+from flask import Flask, render_template, redirect, url_for, request, flash, session, jsonify, abort
+from sqlalchemy import select
 from dotenv import load_dotenv
 import logging
 
 # Modele bazy danych
-from .models import db, Invoice, NotificationLog, Case, SyncStatus
+from .models import db, Invoice, NotificationLog, Case, SyncStatus, SyncRun
 
 # Inne moduły
 from .send_email import send_email
 from .shipping_settings import NOTIFICATION_OFFSETS, SYNC_CONFIG
 from .mail_templates import MAIL_TEMPLATES
 from .scheduler import start_scheduler  # Scheduler uruchamiany w tle
-from .mail_utils import generate_email  # Funkcja generująca treść wiadomości
-from .update_db import run_full_sync, sync_new_invoices, update_existing_cases
+from .mail_utils import build_email  # Funkcja generująca treść wiadomości
+from .update_db import run_full_sync, sync_new_invoices, update_existing_cases, run_batch_sync
+from .job_runner import start_sync_job, run_exclusive, in_flight_run_id
+from .sync_metrics import summarize_trends
+from .migrations import run_migrations
+from .case_progress import log_notification, progress_percent, FINAL_STAGE
+from .case_listing import case_page, case_totals, stage_counts, list_filters, client_summary
+from .notification_store import render_log_body
+from .dashboard_summary import dashboard_totals, refresh_dashboard
 
 load_dotenv()
 
@@ -32,6 +39,12 @@ def map_stage(stage):
     }
     return mapping.get(stage, stage)
 
+# Statusy spraw zamkniętych (filtr listy /completed) -> etykieta
+CLOSED_STATUSES = {
+    "closed_oplacone": "Zamknięte – opłacone",
+    "closed_nieoplacone": "Zamknięte – nieopłacone",
+}
+
 STAGE_LABELS = {
     "Przypomnienie o zbliżającym się terminie płatności": "Przypomnienie o zbliżającym się terminie płatności",
     "Powiadomienie o upływie terminu płatności": "Powiadomienie o upływie terminu płatności",
@@ -41,7 +54,11 @@ STAGE_LABELS = {
     "Przekazanie sprawy do windykatora zewnętrznego": "Przekazanie sprawy do windykatora zewnętrznego"
 }
 
-def create_app():
+def create_app(config=None, start_background_jobs=True):
+    """
+    Tworzy aplikację. config nadpisuje domyślną konfigurację (np. SQLALCHEMY_DATABASE_URI
+    z lokalną bazą w benchmarkach), a start_background_jobs=False nie uruchamia schedulera.
+    """
     app = Flask(__name__)
     app.secret_key = os.getenv('SECRET_KEY', 'secret')
 
@@ -54,180 +71,88 @@ def create_app():
         f"postgresql+psycopg2://{db_user}:{db_password}@/{db_name}?host=/cloudsql/{instance_connection_name}"
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config.update(config or {})
 
     db.init_app(app)
 
-    # Tworzenie tabel bazy przy pierwszym uruchomieniu
+    # Tworzenie tabel bazy przy pierwszym uruchomieniu oraz migracje istniejących tabel (kolumny, indeksy)
     @app.before_first_request
     def create_tables():
         db.create_all()
+        run_migrations()
 
-    # Wymaganie zalogowania (z wyjątkiem login, static)
+    # Wymaganie zalogowania (z wyjątkiem login, static oraz zadań cron App Engine)
     @app.before_request
     def require_login():
+        # Nagłówek X-Appengine-Cron jest usuwany przez App Engine z żądań zewnętrznych
+        if request.endpoint == 'sync_db_batch' and request.headers.get('X-Appengine-Cron') == 'true':
+            return None
         if request.endpoint not in ('login', 'static'):
             if not session.get('logged_in'):
                 return redirect(url_for('login'))
 
-    # Widok spraw aktywnych ("/")
+    # Widok spraw aktywnych ("/") – jedna strona (PAGE_SIZE spraw) wyszukana, posortowana i stronicowana w SQL;
+    # liczby w nagłówku bez filtrów z podsumowania (DashboardSummary), z filtrami – jednym zapytaniem agregującym
     @app.route('/')
     def active_cases():
-        search_query = request.args.get('search', '').strip().lower()
         sort_by = request.args.get('sort_by', 'case_number')
         sort_order = request.args.get('sort_order', 'asc')
-
-        cases_query = Case.query.filter_by(status="active").all()
-        cases_list = []
-        for case_obj in cases_query:
-            inv = Invoice.query.filter_by(case_id=case_obj.id).first()
-            if inv:
-                # Pozostała kwota do zapłaty
-                left = inv.left_to_pay if inv.left_to_pay is not None else (inv.gross_price - (inv.paid_price or 0))
-                # days_diff -> ile dni po terminie (jeśli payment_due_date jest ustawiona)
-                day_diff = (date.today() - inv.payment_due_date).days if inv.payment_due_date else None
-
-                # Obliczanie etapu z logów NotificationLog
-                def stage_from_log_text(text):
-                    mapping = {
-                        "Przypomnienie o zbliżającym się terminie płatności": 1,
-                        "Powiadomienie o upływie terminu płatności": 2,
-                        "Wezwanie do zapłaty": 3,
-                        "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": 4,
-                        "Przekazanie sprawy do windykatora zewnętrznego": 5
-                    }
-                    return mapping.get(text, 0)
-
-                logs = NotificationLog.query.filter_by(invoice_number=inv.invoice_number).all()
-                max_stage = 0
-                for lg in logs:
-                    st = stage_from_log_text(lg.stage)
-                    if st > max_stage:
-                        max_stage = st
-                progress_val = int((max_stage / 5) * 100)
-
-                email_val = inv.client_email if inv.client_email else "Brak"
-                cases_list.append({
-                    'case_number': case_obj.case_number,
-                    'client_id': case_obj.client_id,
-                    'client_company_name': case_obj.client_company_name,
-                    'client_nip': case_obj.client_nip,
-                    'client_email': email_val,
-                    'total_debt': (left / 100.0) if left else 0.0,
-                    'days_diff': day_diff,
-                    'progress_percent': progress_val,
-                    'status': case_obj.status
-                })
-
-        # Sortowanie
-        if cases_list and sort_by in cases_list[0]:
-            try:
-                if isinstance(cases_list[0][sort_by], (int, float)):
-                    cases_list = sorted(
-                        cases_list,
-                        key=lambda x: x.get(sort_by, 0),
-                        reverse=(sort_order == "desc")
-                    )
-                else:
-                    cases_list = sorted(
-                        cases_list,
-                        key=lambda x: (x.get(sort_by) or "").lower(),
-                        reverse=(sort_order == "desc")
-                    )
-            except Exception as e:
-                print("Sortowanie error:", e)
-
-        total_debt_all = sum(c['total_debt'] for c in cases_list)
-        active_count = len(cases_list)
+        after = request.args.get('after', type=int)
+        before = request.args.get('before', type=int)
+
+        filters, filter_values = list_filters(request.args)
+        conditions = [Case.status == "active", *filters]
+        cases_list, next_after, prev_before = case_page(*conditions, sort_by=sort_by, sort_order=sort_order,
+                                                        after=after, before=before)
+        aging = None
+        summary = None if filters else dashboard_totals()
+        if summary is None:
+            active_count, total_debt_all = case_totals(*conditions)
+        else:
+            active_count, total_debt_all, aging = summary["active_count"], summary["total_debt"], summary["aging"]
 
         return render_template('cases.html',
                                cases=cases_list,
-                               search_query=search_query,
+                               search_query=filter_values["search"],
+                               filters=filter_values,
                                sort_by=sort_by,
                                sort_order=sort_order,
                                total_debt_all=total_debt_all,
-                               active_count=active_count)
+                               active_count=active_count,
+                               aging=aging,
+                               next_after=next_after,
+                               prev_before=prev_before)
 
-    # Widok spraw zakończonych ("/completed")
+    # Widok spraw zakończonych ("/completed") – jak lista aktywnych, z filtrem statusu zamknięcia
     @app.route('/completed')
     def completed_cases():
-        search_query = request.args.get('search', '').strip().lower()
         sort_by = request.args.get('sort_by', 'case_number')
         sort_order = request.args.get('sort_order', 'asc')
-
-        cases_query = Case.query.filter(Case.status != "active").all()
-        cases_list = []
-        for case_obj in cases_query:
-            inv = Invoice.query.filter_by(case_id=case_obj.id).first()
-            if inv:
-                left = inv.left_to_pay if inv.left_to_pay is not None else (inv.gross_price - (inv.paid_price or 0))
-                day_diff = (date.today() - inv.payment_due_date).days if inv.payment_due_date else None
-
-                def stage_from_log_text(text):
-                    mapping = {
-                        "Przypomnienie o zbliżającym się terminie płatności": 1,
-                        "Powiadomienie o upływie terminu płatności": 2,
-                        "Wezwanie do zapłaty": 3,
-                        "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": 4,
-                        "Przekazanie sprawy do windykatora zewnętrznego": 5
-                    }
-                    return mapping.get(text, 0)
-                logs = NotificationLog.query.filter_by(invoice_number=inv.invoice_number).all()
-                max_stage = 0
-                for lg in logs:
-                    st = stage_from_log_text(lg.stage)
-                    if st > max_stage:
-                        max_stage = st
-                progress_val = int((max_stage / 5) * 100)
-                email_val = inv.client_email if inv.client_email else "Brak"
-
-                cases_list.append({
-                    'case_number': case_obj.case_number,
-                    'client_id': case_obj.client_id,
-                    'client_company_name': case_obj.client_company_name,
-                    'client_nip': case_obj.client_nip,
-                    'client_email': email_val,
-                    'total_debt': (left / 100.0) if left else 0.0,
-                    'days_diff': day_diff,
-                    'progress_percent': progress_val,
-                    'status': case_obj.status
-                })
-
-        if search_query:
-            cases_list = [
-                c for c in cases_list
-                if search_query in (c.get('client_id') or '').lower()
-                or search_query in (c.get('client_nip') or '').lower()
-                or search_query in (c.get('client_company_name') or '').lower()
-                or search_query in (c.get('case_number') or '').lower()
-                or search_query in (c.get('client_email') or '').lower()
-            ]
-
-        if cases_list and 'case_number' in cases_list[0]:
-            try:
-                if isinstance(cases_list[0].get(sort_by), (int, float)):
-                    cases_list = sorted(
-                        cases_list,
-                        key=lambda x: x.get(sort_by, 0),
-                        reverse=(sort_order == "desc")
-                    )
-                else:
-                    cases_list = sorted(
-                        cases_list,
-                        key=lambda x: (x.get(sort_by) or "").lower(),
-                        reverse=(sort_order == "desc")
-                    )
-            except Exception as e:
-                print("Sortowanie error:", e)
-
-        completed_count = len(cases_list)
-        stage_counts = {i: 0 for i in range(1, 6)}
-        # Ewentualnie logika zliczania na jakim etapie sprawa zakończona
+        after = request.args.get('after', type=int)
+        before = request.args.get('before', type=int)
+
+        filters, filter_values = list_filters(request.args, statuses=CLOSED_STATUSES)
+        conditions = [Case.status != "active", *filters]
+        cases_list, next_after, prev_before = case_page(*conditions, sort_by=sort_by, sort_order=sort_order,
+                                                        after=after, before=before)
+        summary = None if filters else dashboard_totals()
+        if summary is None:
+            completed_count, _ = case_totals(*conditions)
+            completed_stages = stage_counts(*conditions)
+        else:
+            completed_count, completed_stages = summary["completed_count"], summary["stage_counts"]["completed"]
 
         return render_template('completed.html',
                                cases=cases_list,
-                               search_query=search_query,
+                               search_query=filter_values["search"],
+                               filters=filter_values,
+                               sort_by=sort_by,
+                               sort_order=sort_order,
                                completed_count=completed_count,
-                               stage_counts=stage_counts)
+                               stage_counts=completed_stages,
+                               closed_statuses=CLOSED_STATUSES,
+                               next_after=next_after,
+                               prev_before=prev_before)
 
     # Widok szczegółów sprawy ("/case/<case_number>")
     @app.route('/case/<path:case_number>')
@@ -238,31 +163,23 @@ def create_app():
         left = inv.left_to_pay if inv.left_to_pay is not None else (inv.gross_price - (inv.paid_price or 0))
         day_diff = (date.today() - inv.payment_due_date).days if inv.payment_due_date else None
 
-        def stage_from_log_text(text):
-            mapping = {
-                "Przypomnienie o zbliżającym się terminie płatności": 1,
-                "Powiadomienie o upływie terminu płatności": 2,
-                "Wezwanie do zapłaty": 3,
-                "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": 4,
-                "Przekazanie sprawy do windykatora zewnętrznego": 5
-            }
-            return mapping.get(text, 0)
-
-        logs = NotificationLog.query.filter_by(invoice_number=inv.invoice_number)\
-                                    .order_by(NotificationLog.sent_at.desc()).all()
+        # Bez treści (body) – pobiera ją przeglądarka z notification_body po otwarciu podglądu
+        logs = db.session.execute(
+            select(NotificationLog.id, NotificationLog.sent_at, NotificationLog.stage, NotificationLog.mode,
+                   NotificationLog.subject)
+            .where(NotificationLog.invoice_number == inv.invoice_number)
+            .order_by(NotificationLog.sent_at.desc())
+        ).all()
         modified_logs = []
         for log in logs:
             modified_logs.append({
+                "id": log.id,
                 "sent_at": log.sent_at,
                 "stage": f"{log.stage} ({log.mode})",
-                "subject": log.subject,
-                "body": log.body
+                "subject": log.subject
             })
 
-        progress_val = 0
-        if modified_logs:
-            max_stage = max([stage_from_log_text(log["stage"].split(" (")[0]) for log in modified_logs])
-            progress_val = int((max_stage / 5) * 100)
+        progress_val = progress_percent(case_obj.max_stage)
 
         return render_template('case_detail.html',
                                case=case_obj,
@@ -272,87 +189,66 @@ def create_app():
                                progress_percent=progress_val,
                                notifications=modified_logs)
 
-    # Widok spraw klienta ("/client/<client_id>")
+    # Treść wysłanego powiadomienia (podgląd w widoku sprawy). Wysłana treść się nie zmienia,
+    # więc przeglądarka może ją trzymać w pamięci podręcznej (ETag + Cache-Control immutable).
+    @app.route('/notification/<int:log_id>/body')
+    def notification_body(log_id):
+        etag = f"notification-{log_id}"
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            row = db.session.execute(
+                select(NotificationLog.body, NotificationLog.body_compressed,
+                       NotificationLog.template_version, NotificationLog.params)
+                .where(NotificationLog.id == log_id)
+            ).first()
+            if row is None:
+                abort(404)
+            # Jako tekst – podgląd pokazuje źródło HTML, tak jak wcześniej w <pre>
+            response = app.response_class(render_log_body(row), mimetype='text/plain')
+            response.headers['X-Content-Type-Options'] = 'nosniff'
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+    # Widok spraw klienta ("/client/<client_id>") – obie sekcje stronicowane osobno (active_/completed_after)
     @app.route('/client/<client_id>')
     def client_cases(client_id):
         current_date = date.today()
-        active_objs = Case.query.filter_by(client_id=client_id, status="active").all()
-        completed_objs = Case.query.filter(Case.client_id == client_id, Case.status != "active").all()
-        active_cases_list = []
-        completed_cases_list = []
-        total_debt_all = 0.0
-
-        def build_case_dict(case_obj):
-            inv = case_obj.invoice
-            if not inv:
-                return None
-            left = inv.left_to_pay if inv.left_to_pay is not None else (inv.gross_price - (inv.paid_price or 0))
-            total_debt = left / 100.0
-            days_diff = (current_date - inv.payment_due_date).days if inv.payment_due_date else None
-
-            logs = NotificationLog.query.filter_by(invoice_number=inv.invoice_number).all()
-            stage_mapping = {
-                "Przypomnienie o zbliżającym się terminie płatności": 1,
-                "Powiadomienie o upływie terminu płatności": 2,
-                "Wezwanie do zapłaty": 3,
-                "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": 4,
-                "Przekazanie sprawy do windykatora zewnętrznego": 5
-            }
-            max_stage = 0
-            for lg in logs:
-                s = stage_mapping.get(lg.stage, 0)
-                if s > max_stage:
-                    max_stage = s
-            progress_val = int((max_stage / 5) * 100)
-
-            return {
-                'case_number': case_obj.case_number,
-                'client_id': case_obj.client_id,
-                'client_company_name': case_obj.client_company_name,
-                'client_nip': case_obj.client_nip,
-                'client_email': inv.client_email if inv.client_email else "Brak",
-                'total_debt': total_debt,
-                'days_diff': days_diff,
-                'progress_percent': progress_val,
-                'status': case_obj.status
-            }
+        same_client = Case.client_id == client_id
+        active_cases_list, active_next, active_prev = case_page(
+            same_client, Case.status == "active", sort_by="days_diff", sort_order="desc",
+            after=request.args.get('active_after', type=int), before=request.args.get('active_before', type=int),
+            today=current_date)
+        completed_cases_list, completed_next, completed_prev = case_page(
+            same_client, Case.status != "active", sort_by="days_diff", sort_order="desc",
+            after=request.args.get('completed_after', type=int), before=request.args.get('completed_before', type=int),
+            today=current_date)
+        summary = client_summary(client_id)
 
-        for c in active_objs:
-            res = build_case_dict(c)
-            if res:
-                total_debt_all += res['total_debt']
-                active_cases_list.append(res)
-        for c in completed_objs:
-            res = build_case_dict(c)
-            if res:
-                completed_cases_list.append(res)
-
-        active_count = len(active_cases_list)
         client_details = {}
-        if active_cases_list:
-            first = active_cases_list[0]
+        first = (active_cases_list or completed_cases_list or [None])[0]
+        if first:
             client_details = {
                 'client_company_name': first['client_company_name'],
                 'client_nip': first['client_nip'],
                 'client_email': first['client_email'],
                 'client_address': ''  # można dodać, jeśli Invoice trzyma adres
             }
-        elif completed_cases_list:
-            first = completed_cases_list[0]
-            client_details = {
-                'client_company_name': first['client_company_name'],
-                'client_nip': first['client_nip'],
-                'client_email': first['client_email'],
-                'client_address': ''
-            }
 
         return render_template('client_cases.html',
                                active_cases=active_cases_list,
                                completed_cases=completed_cases_list,
                                client_id=client_id,
                                client_details=client_details,
-                               total_debt_all=total_debt_all,
-                               active_count=active_count,
+                               total_debt_all=summary["total_debt"],
+                               active_count=summary["active_count"],
+                               completed_count=summary["completed_count"],
+                               stage_counts=summary["stage_counts"],
+                               active_next=active_next,
+                               active_prev=active_prev,
+                               completed_next=completed_next,
+                               completed_prev=completed_prev,
                                current_date=current_date)
 
     # Oznaczenie faktury jako opłaconej
@@ -368,6 +264,7 @@ def create_app():
         if case_obj:
             case_obj.status = "closed_oplacone"
             db.session.add(case_obj)
+            refresh_dashboard([case_obj.id])
 
         db.session.commit()
         flash("Faktura została oznaczona jako opłacona, a sprawa zamknięta.", "success")
@@ -384,7 +281,7 @@ def create_app():
                 return redirect(url_for('active_cases'))
 
             mapped = map_stage(stage)
-            subject, body_html = generate_email(mapped, inv)
+            subject, body_html, template = build_email(mapped, inv)
             if not subject or not body_html:
                 flash("Błąd w generowaniu szablonu wiadomości.", "danger")
                 return redirect(url_for('case_detail', case_number=case_number))
@@ -396,39 +293,13 @@ def create_app():
             inv.debt_status = mapped
             db.session.add(inv)
 
-            new_log = NotificationLog(
-                client_id=inv.client_id,
-                invoice_number=inv.invoice_number,
-                email_to=inv.client_email,
-                subject=subject,
-                body=body_html,
-                stage=mapped,
-                mode="Manualne"
-            )
-            db.session.add(new_log)
-            db.session.commit()
+            log_notification(case_obj, inv, mapped, subject, body_html, mode="Manualne", template=template)
 
-            # Sprawdzamy, czy osiągnięto etap 5
-            logs = NotificationLog.query.filter_by(invoice_number=inv.invoice_number).all()
-            max_stage = 0
-            def stage_from_log_text(t):
-                mapping = {
-                    "Przypomnienie o zbliżającym się terminie płatności": 1,
-                    "Powiadomienie o upływie terminu płatności": 2,
-                    "Wezwanie do zapłaty": 3,
-                    "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": 4,
-                    "Przekazanie sprawy do windykatora zewnętrznego": 5
-                }
-                return mapping.get(t, 0)
-            for log in logs:
-                st = stage_from_log_text(log.stage)
-                if st > max_stage:
-                    max_stage = st
-
-            if max_stage >= 5:
+            # Osiągnięto etap 5 – zamykamy sprawę (w tej samej transakcji co wpis)
+            if case_obj.max_stage >= FINAL_STAGE:
                 case_obj.status = "closed_oplacone"
-                db.session.add(case_obj)
-                db.session.commit()
+            refresh_dashboard([case_obj.id])
+            db.session.commit()
 
             flash("Powiadomienie zostało wysłane.", "success")
         except Exception as e:
@@ -437,36 +308,47 @@ def create_app():
 
         return redirect(url_for('case_detail', case_number=inv.invoice_number if inv else case_number))
 
-    # Funkcja pomocnicza do uruchamiania synchronizacji w tle
-    def background_sync(app):
-        with app.app_context():
-            try:
-                start_time = datetime.utcnow()
-                new_processed = sync_new_invoices()
-                updated_processed = update_existing_cases()
-                total = new_processed + updated_processed
-                duration = (datetime.utcnow() - start_time).total_seconds()
-                # Zapis informacji w SyncStatus
-                record = SyncStatus(sync_type="full", processed=total, duration=duration)
-                db.session.add(record)
-                db.session.commit()
-            except Exception as e:
-                logging.error(f"Background sync error: {e}")
-
-    # Ręczna synchronizacja – uruchamiana w tle, aby uniknąć timeoutu
+    # Ręczna synchronizacja – uruchamiana w tle (job_runner), najwyżej jedna naraz
     @app.route('/manual_sync', methods=['GET'])
     def manual_sync():
-        # Uruchamiamy nowy wątek z kontekstem aplikacji
-        t = threading.Thread(target=background_sync, args=(app,))
-        t.start()
-        flash("Synchronizacja została uruchomiona w tle. Sprawdź panel statusu synchronizacji.", "info")
+        run_id, started = start_sync_job(app)
+        if started:
+            flash(f"Synchronizacja (przebieg #{run_id}) została uruchomiona w tle. Sprawdź panel statusu synchronizacji.", "info")
+        else:
+            flash(f"Synchronizacja jest już w toku (przebieg #{run_id}) – nie uruchomiono kolejnej. Sprawdź panel statusu synchronizacji.", "info")
         return redirect(url_for('active_cases'))
 
+    # Synchronizacja jednego zakresu faktur – wywoływana z cron.yaml co 15 minut.
+    # Pod wspólną blokadą synchronizacji (job:sync) – shardy wykonywane są po kolei i nie nakładają się
+    # na pełną synchronizację ani odświeżanie planowe, które zapisują te same faktury i sprawy.
+    @app.route('/sync_db_batch', methods=['GET'])
+    def sync_db_batch():
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = int(request.args.get('limit', SYNC_CONFIG["sync_limit"]))
+        except ValueError:
+            return jsonify({"error": "Nieprawidłowe parametry offset/limit"}), 400
+        try:
+            result = run_exclusive(app, f"sync_db_batch {offset}:{limit}", lambda: run_batch_sync(offset, limit))
+        except Exception as e:
+            logging.error(f"Batch sync error (offset={offset}, limit={limit}): {e}")
+            return jsonify({"error": str(e)}), 500
+        if result is None:
+            # Trwa inna synchronizacja – shard zostanie objęty przez nią albo przez kolejne wywołanie z crona
+            return jsonify({"shard": f"{offset}:{limit}", "claimed": False, "processed": 0,
+                            "in_flight_run": in_flight_run_id()})
+        return jsonify(result)
+
     # Panel statusu synchronizacji
     @app.route('/sync_status')
     def sync_status():
-        statuses = SyncStatus.query.order_by(SyncStatus.timestamp.desc()).limit(20).all()
-        return render_template('sync_status.html', statuses=statuses)
+        # Liczba ostatnich przebiegów do tabeli i trendów (?n=50)
+        limit = request.args.get('n', 20, type=int)
+        statuses = SyncStatus.query.order_by(SyncStatus.timestamp.desc()).limit(limit).all()
+        run_id = in_flight_run_id()
+        current_run = db.session.get(SyncRun, run_id) if run_id else None
+        return render_template('sync_status.html', statuses=statuses, current_run=current_run,
+                               trends=summarize_trends(statuses), limit=limit)
 
     # Ustawienia wysyłki ("/shipping_settings")
     @app.route('/shipping_settings', methods=['GET', 'POST'], endpoint='shipping_settings_view')
@@ -509,8 +391,9 @@ def create_app():
         return redirect(url_for('login'))
 
     # Scheduler w tle
-    with app.app_context():
-        start_scheduler(app)
+    if start_background_jobs:
+        with app.app_context():
+            start_scheduler(app)
 
     return app
 
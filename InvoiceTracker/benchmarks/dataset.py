@@ -0,0 +1,120 @@
+# benchmarks/dataset.py
+import json
+import random
+import uuid
+from datetime import date, datetime, timedelta
+
+INVOICE_STATUSES = ("sent", "printed", "paid", "draft")
+STATUS_WEIGHTS = (45, 15, 35, 5)
+CITIES = ("Warszawa", "Kraków", "Poznań", "Gdańsk", "Wrocław", "Łódź")
+STREETS = ("Długa", "Polna", "Leśna", "Słoneczna", "Krótka", "Ogrodowa")
+
+
+def generate_clients(clients, seed=1):
+    """
+    Klienci w formacie API inFakt (clients/<id>.json): client_id (str) -> dane.
+    """
+    rng = random.Random(seed)
+    client_rows = {}
+    for client_id in range(1, clients + 1):
+        client_rows[str(client_id)] = {
+            "id": client_id,
+            "company_name": f"Firma {client_id} Sp. z o.o.",
+            "email": f"klient{client_id}@example.com",
+            "nip": f"{rng.randrange(10 ** 9, 10 ** 10)}",
+            "street": rng.choice(STREETS),
+            "street_number": str(rng.randint(1, 120)),
+            "flat_number": str(rng.randint(1, 40)) if rng.random() < 0.3 else "",
+            "city": rng.choice(CITIES),
+            "postal_code": f"{rng.randint(10, 99)}-{rng.randint(100, 999)}",
+        }
+    return client_rows
+
+
+def iter_invoices(invoices, clients, seed=1, today=None):
+    """
+    Generator faktur w formacie API inFakt (invoices/<uuid>.json), po jednej –
+    dzięki temu duże zbiory (np. 1M) można zapisywać do bazy porcjami.
+    `clients` to słownik z generate_clients. Dla tego samego seed wynik jest identyczny.
+    """
+    rng = random.Random(seed + 1)
+    today = today or date.today()
+    for invoice_id in range(1, invoices + 1):
+        invoice_date = today - timedelta(days=rng.randint(0, 400))
+        payment_date = invoice_date + timedelta(days=rng.choice((7, 14, 21, 30)))
+        # Część faktur z terminem dokładnie za 2 dni (nowe sprawy)
+        if rng.random() < 0.05:
+            payment_date = today + timedelta(days=2)
+        status = rng.choices(INVOICE_STATUSES, STATUS_WEIGHTS)[0]
+        gross_price = rng.randint(100, 50000) * 100
+        paid_price = gross_price if status == "paid" else (gross_price // 2 if rng.random() < 0.05 else 0)
+        client = clients[str(rng.randint(1, len(clients)))]
+        # Ostatnia modyfikacja nie później niż początek dnia `today` (zmiany z mark_paid są zawsze nowsze)
+        updated_at = min(datetime.combine(invoice_date, datetime.min.time()) + timedelta(hours=rng.randint(8, 200)),
+                         datetime.combine(today, datetime.min.time()))
+        yield {
+            "id": invoice_id,
+            "uuid": str(uuid.UUID(int=rng.getrandbits(128))),
+            "number": f"{invoice_id}/{invoice_date.year}",
+            "invoice_date": invoice_date.isoformat(),
+            "sale_date": invoice_date.isoformat(),
+            "payment_date": payment_date.isoformat(),
+            "gross_price": gross_price,
+            "net_price": round(gross_price / 1.23),
+            "tax_price": gross_price - round(gross_price / 1.23),
+            "paid_price": paid_price,
+            "left_to_pay": gross_price - paid_price,
+            "status": status,
+            "currency": "PLN",
+            "payment_method": "transfer",
+            "client_id": client["id"],
+            "client_company_name": client["company_name"],
+            "client_nip": client["nip"],
+            "client_tax_code": client["nip"],
+            "updated_at": updated_at.strftime("%Y-%m-%dT%H:%M:%S.000+01:00"),
+        }
+
+
+def default_client_count(invoices):
+    return max(1, invoices // 8)
+
+
+def generate_dataset(invoices=1000, clients=None, seed=1, today=None):
+    """
+    Generuje deterministyczny (dla danego seed) zbiór danych w formacie API inFakt:
+    {"invoices": [...], "clients": {client_id: {...}}}. Terminy płatności rozkładają się
+    wokół `today` (także dokładnie za 2 dni – ścieżka tworzenia nowych spraw),
+    statusy i wpłaty odpowiadają mieszance faktur wysłanych, opłaconych i szkiców.
+    """
+    client_rows = generate_clients(clients or default_client_count(invoices), seed)
+    return {"invoices": list(iter_invoices(invoices, client_rows, seed, today)), "clients": client_rows}
+
+
+def save_dataset(dataset, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dataset, f, ensure_ascii=False)
+
+
+def load_dataset(path):
+    """
+    Wczytuje zapisany zbiór danych (fixtures) – ten sam plik daje powtarzalne przebiegi.
+    """
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def mark_paid(dataset, count, seed=2, now=None):
+    """
+    Oznacza `count` nieopłaconych faktur jako opłacone (zmiana statusu, wpłaty i updated_at),
+    aby zmierzyć synchronizację aktualizacji. Zwraca liczbę zmienionych faktur.
+    """
+    rng = random.Random(seed)
+    unpaid = [inv for inv in dataset["invoices"] if inv["status"] in ("sent", "printed")]
+    now = now or datetime.now()
+    changed = rng.sample(unpaid, min(count, len(unpaid)))
+    for inv in changed:
+        inv["status"] = "paid"
+        inv["paid_price"] = inv["gross_price"]
+        inv["left_to_pay"] = 0
+        inv["updated_at"] = now.strftime("%Y-%m-%dT%H:%M:%S.000+01:00")
+    return len(changed)
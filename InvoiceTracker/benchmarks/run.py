@@ -0,0 +1,225 @@
+# benchmarks/run.py
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime
+
+from sqlalchemy import func
+from werkzeug.test import Client
+
+from ..models import db, Invoice, Case, NotificationLog, SyncStatus
+from ..migrations import run_migrations, run_data_migrations
+from .dataset import generate_dataset, mark_paid
+from .seed import seed_database
+from .stand_in_server import StandInAPI
+
+SUITES = ("views", "mail", "sync")
+# Kolumny SyncStatus dołączane do wyników synchronizacji
+SYNC_METRICS = ("processed", "new_count", "updated_count", "unchanged_count", "closed_count", "api_calls",
+                "api_throttled", "pages_fetched", "pages_skipped", "bytes_downloaded", "db_statements",
+                "db_commits", "list_seconds", "detail_seconds", "client_seconds", "persist_seconds")
+
+
+class SinkMailer:
+    """
+    Zastępuje send_email w schedulerze – zlicza wiadomości zamiast wysyłać je przez SMTP.
+    """
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+
+    def __call__(self, to_email, subject, body, html=False):
+        self.sent += 1
+        self.bytes += len(body.encode("utf-8"))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(__file__)).decode().strip()
+    except Exception:
+        return None
+
+
+def timed_call(target, *args, **kwargs):
+    start = time.perf_counter()
+    result = target(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def last_sync_metrics(sync_type):
+    record = SyncStatus.query.filter_by(sync_type=sync_type).order_by(SyncStatus.id.desc()).first()
+    return {name: getattr(record, name) for name in SYNC_METRICS} if record else {}
+
+
+def bench_views(app, repeat):
+    """
+    Czasy odpowiedzi widoków /, /completed i /client/<id> (klient z największą liczbą spraw).
+    """
+    with app.app_context():
+        top_client = (db.session.query(Case.client_id, func.count(Case.id))
+                      .group_by(Case.client_id).order_by(func.count(Case.id).desc()).first())
+    views = [("/", "/"), ("/completed", "/completed")]
+    if top_client:
+        views.append(("/client/<id>", f"/client/{top_client[0]}"))
+
+    # Klient WSGI z Werkzeug z podpisanym ciasteczkiem sesji zalogowanego użytkownika
+    # (app.test_client z Flask 2.2 nie współpracuje z Werkzeug 3)
+    client = Client(app)
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'logged_in': True})
+    client.set_cookie(app.config.get('SESSION_COOKIE_NAME', 'session'), cookie)
+    results = []
+    for route, path in views:
+        timings = []
+        for _ in range(repeat):
+            seconds, response = timed_call(client.get, path)
+            timings.append(seconds)
+        results.append({
+            "name": f"view {route}",
+            "path": path,
+            "status": response.status_code,
+            "response_bytes": len(response.data),
+            "seconds": min(timings),
+            "median_seconds": statistics.median(timings),
+            "max_seconds": max(timings),
+            "repeat": repeat,
+        })
+    return results
+
+
+def bench_mail(app):
+    """
+    Czas scheduler.run_mail_with_context z wysyłką do SinkMailer (bez SMTP).
+    """
+    from .. import scheduler
+    sink = SinkMailer()
+    original = scheduler.send_email
+    scheduler.send_email = sink
+    try:
+        with app.app_context():
+            logs_before = NotificationLog.query.count()
+        seconds, _ = timed_call(scheduler.run_mail_with_context, app)
+        with app.app_context():
+            logs_after = NotificationLog.query.count()
+    finally:
+        scheduler.send_email = original
+    return [{
+        "name": "scheduler.run_mail_with_context",
+        "seconds": seconds,
+        "emails_sent": sink.sent,
+        "email_bytes": sink.bytes,
+        "notification_logs_added": logs_after - logs_before,
+    }]
+
+
+def bench_sync(app, invoices, seed, latency, changed):
+    """
+    Czasy sync_new_invoices i update_existing_cases (pełny przebieg, a potem przyrostowy
+    po zmianie `changed` faktur) względem serwera zastępczego z tym samym zbiorem danych co baza.
+    """
+    from ..update_db import sync_new_invoices, update_existing_cases
+    dataset = generate_dataset(invoices, seed=seed)
+    api = StandInAPI(dataset, latency=latency)
+    os.environ['INFAKT_API_URL'] = api.start()
+    results = []
+    try:
+        with app.app_context():
+            seconds, _ = timed_call(sync_new_invoices)
+            results.append({"name": "update_db.sync_new_invoices", "seconds": seconds, **last_sync_metrics("new")})
+
+            seconds, _ = timed_call(update_existing_cases, incremental=False)
+            results.append({"name": "update_db.update_existing_cases (full)", "seconds": seconds,
+                            **last_sync_metrics("update")})
+
+            mark_paid(dataset, changed)
+            seconds, _ = timed_call(update_existing_cases)
+            results.append({"name": "update_db.update_existing_cases (incremental)", "seconds": seconds,
+                            "changed_remote": changed, **last_sync_metrics("update")})
+    finally:
+        api.stop()
+    results.append({"name": "stand_in_server", "requests": api.stats["requests"],
+                    "bytes": api.stats["bytes"], "by_endpoint": api.stats["by_endpoint"]})
+    return results
+
+
+def run_benchmarks(database_url, invoices, suites=SUITES, seed=1, repeat=3, latency=0.0, changed=None, reuse=False):
+    """
+    Przygotowuje bazę (tabele + dane z seed_database) i uruchamia wybrane zestawy.
+    Zwraca słownik wyników gotowy do zapisu jako JSON.
+    """
+    # Klient API wymaga klucza; limiter musi przepuścić ruch do lokalnego serwera
+    os.environ.setdefault('INFAKT_API_KEY', 'benchmark')
+    os.environ.setdefault('INFAKT_RATE_LIMITS', '1000000/1')
+    from ..app import create_app
+    app = create_app({"SQLALCHEMY_DATABASE_URI": database_url}, start_background_jobs=False)
+
+    report = {
+        "meta": {
+            "invoices": invoices,
+            "seed": seed,
+            "database": database_url.split("://")[0],
+            "suites": list(suites),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "date": date.today().isoformat(),
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        },
+        "results": [],
+    }
+    with app.app_context():
+        if not reuse:
+            db.drop_all()
+        db.create_all()
+        run_migrations()
+        run_data_migrations()
+        if Invoice.query.count() == 0:
+            seconds, counts = timed_call(seed_database, invoices, seed)
+            report["seed"] = {"seconds": seconds, **counts}
+
+    if "views" in suites:
+        report["results"].extend(bench_views(app, repeat))
+    if "mail" in suites:
+        report["results"].extend(bench_mail(app))
+    if "sync" in suites:
+        report["results"].extend(bench_sync(app, invoices, seed, latency, changed or max(1, invoices // 100)))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarki InvoiceTracker (synchronizacja, wysyłka maili, widoki)")
+    parser.add_argument("--invoices", type=int, default=10000, help="liczba faktur (np. 10000, 100000, 1000000)")
+    parser.add_argument("--database", default="sqlite:////tmp/invoicetracker_bench.db",
+                        help="adres bazy SQLAlchemy (SQLite lub lokalny PostgreSQL)")
+    parser.add_argument("--suites", default=",".join(SUITES), help="zestawy: views,mail,sync")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="powtórzenia każdego widoku")
+    parser.add_argument("--latency", type=float, default=0.0, help="opóźnienie serwera zastępczego API (s)")
+    parser.add_argument("--changed", type=int, default=None, help="faktury zmienione przed synchronizacją przyrostową")
+    parser.add_argument("--reuse", action="store_true", help="nie czyść bazy (dane z poprzedniego przebiegu)")
+    parser.add_argument("--output", help="plik JSON z wynikami (domyślnie stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    suites = [name.strip() for name in args.suites.split(",") if name.strip()]
+    # Komunikaty synchronizacji na stderr – stdout zostaje dla JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmarks(args.database, args.invoices, suites, args.seed, args.repeat,
+                                args.latency, args.changed, args.reuse)
+    output = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"[benchmarks] Wyniki zapisane w {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# benchmarks/seed.py
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import text
+
+from ..models import db, Invoice, Case, NotificationLog
+from ..mail_utils import build_email
+from ..shipping_settings import NOTIFICATION_OFFSETS
+from ..sync_database import format_client_address
+from ..update_db import new_invoice_row, case_status_from
+from ..case_progress import stage_number, next_notification_date
+from ..case_search import search_text_for
+from ..notification_store import storage_fields
+from ..dashboard_summary import rebuild_dashboard
+from .dataset import generate_clients, iter_invoices, default_client_count
+
+# Liczba faktur zapisywanych w jednej transakcji
+SEED_CHUNK = 5000
+
+
+def invoice_db_row(inv, clients):
+    """
+    Wiersz tabeli Invoice dla faktury z generatora (jak po pełnej synchronizacji z danymi klienta).
+    """
+    row = new_invoice_row(inv)
+    client = clients[str(inv["client_id"])]
+    row.update({
+        "client_id": str(inv["client_id"]),
+        "client_email": client["email"],
+        "client_address": format_client_address(client),
+        "currency": inv["currency"],
+        "payment_method": inv["payment_method"],
+        "case_id": None,
+    })
+    return row
+
+
+def notification_rows(row, today):
+    """
+    Historia powiadomień sprawy: po jednym wpisie dla każdego etapu, którego termin już minął
+(treść zapisana tak jak przy wysyłce – NOTIFICATION_LOG_CONFIG["storage"]).
+    """
+    if not row["payment_due_date"]:
+        return []
+    days_past_due = (today - row["payment_due_date"]).days
+    invoice = SimpleNamespace(**row, client_city="", client_zip="")
+    logs = []
+    for stage, offset in NOTIFICATION_OFFSETS.items():
+        if offset >= days_past_due:
+            continue
+        subject, body, template = build_email(stage, invoice)
+        sent_at = datetime.combine(row["payment_due_date"] + timedelta(days=offset), datetime.min.time()) + timedelta(hours=17)
+        logs.append({
+            "sent_at": sent_at,
+            "client_id": row["client_id"],
+            "invoice_number": row["invoice_number"],
+            "email_to": row["client_email"],
+            "subject": subject,
+            "stage": stage,
+            "mode": "Automatyczne",
+            "scheduled_date": sent_at,
+            **storage_fields(body, template),
+        })
+    return logs
+
+
+def _insert_chunk(invoices, cases, logs):
+    if cases:
+        db.session.execute(Case.__table__.insert(), cases)
+    if invoices:
+        db.session.execute(Invoice.__table__.insert(), invoices)
+    if logs:
+        db.session.execute(NotificationLog.__table__.insert(), logs)
+    db.session.commit()
+
+
+def seed_database(invoices, seed=1, today=None, chunk=SEED_CHUNK):
+    """
+    Zapisuje w bazie N faktur z generatora (benchmarks.dataset) wraz ze sprawami
+    (aktywne dla nieopłaconych, zamknięte dla opłaconych) i historią powiadomień.
+    Dane zapisywane są porcjami po `chunk` faktur, więc 1M faktur nie trzyma się w pamięci.
+    Te same invoices/seed dają faktury zgodne z serwerem zastępczym (StandInAPI).
+    Wymaga kontekstu aplikacji i pustych tabel. Zwraca liczniki zapisanych wierszy.
+    """
+    today = today or date.today()
+    clients = generate_clients(default_client_count(invoices), seed)
+    counts = {"invoices": 0, "cases": 0, "notification_logs": 0}
+    invoice_rows, case_rows, log_rows = [], [], []
+    for inv in iter_invoices(invoices, clients, seed, today):
+        row = invoice_db_row(inv, clients)
+        if row["status"] != "draft":
+            # Sprawa ma to samo id co faktura – bez dodatkowego zapytania o klucz
+            row["case_id"] = row["id"]
+            case_rows.append({
+                "id": row["id"],
+                "case_number": row["invoice_number"],
+                "client_id": row["client_id"],
+                "client_nip": row["client_nip"],
+                "client_company_name": row["client_company_name"],
+                "status": case_status_from(row["status"], row["paid_price"], row["gross_price"]),
+                "created_at": datetime.combine(row["invoice_date"], datetime.min.time()),
+                "updated_at": datetime.utcnow(),
+            })
+            logs = notification_rows(row, today)
+            max_stage = max((stage_number(log["stage"]) for log in logs), default=0)
+            case_rows[-1].update({
+                "max_stage": max_stage,
+                "last_notified_at": max((log["sent_at"] for log in logs), default=None),
+                "next_notification_date": next_notification_date(row["payment_due_date"], max_stage),
+                "search_text": search_text_for(row["invoice_number"], row["client_id"], row["client_nip"],
+                                               row["client_company_name"], row["client_email"]),
+            })
+            log_rows.extend(logs)
+        invoice_rows.append(row)
+        if len(invoice_rows) >= chunk:
+            _insert_chunk(invoice_rows, case_rows, log_rows)
+            counts["invoices"] += len(invoice_rows)
+            counts["cases"] += len(case_rows)
+            counts["notification_logs"] += len(log_rows)
+            invoice_rows, case_rows, log_rows = [], [], []
+    _insert_chunk(invoice_rows, case_rows, log_rows)
+    counts["invoices"] += len(invoice_rows)
+    counts["cases"] += len(case_rows)
+    counts["notification_logs"] += len(log_rows)
+
+    # PostgreSQL: sekwencje id za jawnie wstawionymi kluczami
+    if db.session.get_bind().dialect.name == "postgresql":
+        for table in ("invoice", "case", "notification_log"):
+            db.session.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+                f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 1))"
+            ))
+        db.session.commit()
+    # Sprawy wstawione z pominięciem refresh_dashboard – podsumowanie list budujemy raz na końcu
+    rebuild_dashboard(as_of=today)
+    return counts
@@ -0,0 +1,243 @@
+# benchmarks/stand_in_server.py
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from .dataset import generate_dataset, load_dataset, save_dataset
+
+API_PREFIX = "/api/v3"
+
+# Operatory filtrów q[pole_operator] (składnia jak w API inFakt)
+FILTER_OPERATORS = {
+    "not_eq": lambda value, arg: value != arg,
+    "gteq": lambda value, arg: value >= arg,
+    "lteq": lambda value, arg: value <= arg,
+    "eq": lambda value, arg: value == arg,
+    "gt": lambda value, arg: value > arg,
+    "lt": lambda value, arg: value < arg,
+}
+
+
+def parse_filter(key):
+    """
+    Rozbija klucz "q[payment_date_eq]" na ("payment_date", "eq"). Zwraca None dla innych kluczy.
+    """
+    match = re.fullmatch(r"q\[(\w+)\]", key)
+    if not match:
+        return None
+    name = match.group(1)
+    for operator in FILTER_OPERATORS:
+        if name.endswith(f"_{operator}"):
+            return name[:-len(operator) - 1], operator
+    return None
+
+
+def filter_invoices(invoices, query):
+    for key, values in query.items():
+        parsed = parse_filter(key)
+        if not parsed:
+            continue
+        field, operator = parsed
+        check = FILTER_OPERATORS[operator]
+        invoices = [inv for inv in invoices if inv.get(field) is not None and check(str(inv[field]), values[0])]
+    return invoices
+
+
+def order_invoices(invoices, order):
+    """
+    Sortowanie wg parametru order, np. "invoice_date desc" (remis rozstrzyga id).
+    """
+    field, _, direction = (order or "id asc").partition(" ")
+    return sorted(invoices, key=lambda inv: (str(inv.get(field, "")), inv["id"]), reverse=direction.strip() == "desc")
+
+
+def select_fields(rows, fields):
+    if not fields:
+        return rows
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    return [{name: row.get(name) for name in names} for row in rows]
+
+
+class StandInAPI:
+    """
+    Lokalny serwer zastępczy API inFakt do powtarzalnych pomiarów synchronizacji.
+    Obsługuje invoices.json (offset/limit, fields, order, filtry q[...]), invoices/<uuid>.json,
+    clients.json i clients/<id>.json na podstawie zbioru danych z benchmarks.dataset.
+    Wstrzykiwane opóźnienia: latency (+ losowe jitter) sekund na zapytanie.
+    Wstrzykiwane 429: rate_limit "liczba/okno_s" (przekroczenie -> 429 z Retry-After)
+    i/lub throttle_every – co N-te zapytanie kończy się 429.
+    """
+    def __init__(self, dataset, latency=0.0, jitter=0.0, rate_limit=None, throttle_every=0, retry_after=1.0):
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = None
+        if rate_limit:
+            count, window = rate_limit.split("/")
+            self.rate_limit = (int(count), float(window))
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._server = None
+        self._uuid_index = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "throttled": 0, "bytes": 0, "by_endpoint": {}}
+
+    def _should_throttle(self):
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.throttle_every and self.stats["requests"] % self.throttle_every == 0:
+                self.stats["throttled"] += 1
+                return True
+            if self.rate_limit:
+                count, window = self.rate_limit
+                now = time.monotonic()
+                if now - self._window_start >= window:
+                    self._window_start = now
+                    self._window_count = 0
+                if self._window_count >= count:
+                    self.stats["throttled"] += 1
+                    return True
+                self._window_count += 1
+            return False
+
+    def _count(self, endpoint, nbytes):
+        with self._lock:
+            self.stats["bytes"] += nbytes
+            self.stats["by_endpoint"][endpoint] = self.stats["by_endpoint"].get(endpoint, 0) + 1
+
+    def handle(self, path, query):
+        """
+        Zwraca (status, body) dla ścieżki API (bez prefiksu /api/v3).
+        """
+        invoices = self.dataset["invoices"]
+        clients = self.dataset["clients"]
+        if path == "/invoices.json":
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["10"])[0])
+            rows = order_invoices(filter_invoices(invoices, query), query.get("order", [None])[0])
+            page = select_fields(rows[offset:offset + limit], query.get("fields", [None])[0])
+            return 200, {"metainfo": {"count": len(page), "total_count": len(rows)}, "entities": page}
+        if path == "/clients.json":
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["10"])[0])
+            rows = sorted(clients.values(), key=lambda c: c["id"])
+            return 200, {"metainfo": {"count": len(rows[offset:offset + limit]), "total_count": len(rows)},
+                         "entities": rows[offset:offset + limit]}
+        match = re.fullmatch(r"/invoices/([\w-]+)\.json", path)
+        if match:
+            invoice = self._invoices_by_uuid().get(match.group(1))
+            return (200, invoice) if invoice else (404, {"error": "not found"})
+        match = re.fullmatch(r"/clients/(\w+)\.json", path)
+        if match:
+            client = clients.get(match.group(1))
+            return (200, client) if client else (404, {"error": "not found"})
+        return 404, {"error": "not found"}
+
+    def _invoices_by_uuid(self):
+        # Indeks budowany przy pierwszym użyciu; faktury zmieniane przez mark_paid to te same obiekty
+        if self._uuid_index is None or len(self._uuid_index) != len(self.dataset["invoices"]):
+            self._uuid_index = {inv["uuid"]: inv for inv in self.dataset["invoices"]}
+        return self._uuid_index
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.startswith(API_PREFIX):
+                    return self._send(404, {"error": "not found"})
+                if not self.headers.get("X-inFakt-ApiKey"):
+                    return self._send(401, {"error": "missing api key"})
+                if api.latency or api.jitter:
+                    time.sleep(api.latency + random.uniform(0, api.jitter))
+                if api._should_throttle():
+                    return self._send(429, {"error": "too many requests"}, {"Retry-After": f"{api.retry_after:g}"})
+                path = url.path[len(API_PREFIX):]
+                status, body = api.handle(path, parse_qs(url.query))
+                nbytes = self._send(status, body)
+                api._count(re.sub(r"/[^/]+\.json$", "/<id>.json", path) if path.count("/") > 1 else path, nbytes)
+
+            def _send(self, status, body, headers=None):
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+                return len(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Uruchamia serwer w wątku w tle (port=0 – dowolny wolny port). Zwraca base_url dla INFAKT_API_URL.
+        """
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokalny serwer zastępczy API inFakt")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--invoices", type=int, default=1000, help="liczba faktur w wygenerowanym zbiorze")
+    parser.add_argument("--clients", type=int, default=None, help="liczba klientów (domyślnie faktury/8)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixtures", help="plik JSON ze zbiorem danych zamiast generowania")
+    parser.add_argument("--save", help="zapisz wygenerowany zbiór danych do pliku JSON")
+    parser.add_argument("--latency", type=float, default=0.0, help="opóźnienie odpowiedzi (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="losowe dodatkowe opóźnienie (s)")
+    parser.add_argument("--rate-limit", help='limit zapytań "liczba/okno_s", np. 100/60')
+    parser.add_argument("--throttle-every", type=int, default=0, help="co N-te zapytanie odpowiada 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    dataset = load_dataset(args.fixtures) if args.fixtures else generate_dataset(args.invoices, args.clients, args.seed)
+    if args.save:
+        save_dataset(dataset, args.save)
+        print(f"[stand_in_server] Zbiór danych zapisany w {args.save}")
+    api = StandInAPI(dataset, latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                     throttle_every=args.throttle_every, retry_after=args.retry_after)
+    base_url = api.start(args.host, args.port)
+    print(f"[stand_in_server] {len(dataset['invoices'])} faktur, {len(dataset['clients'])} klientów – INFAKT_API_URL={base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
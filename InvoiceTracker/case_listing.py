@@ -0,0 +1,202 @@
+# case_listing.py
+from datetime import date, timedelta
+
+from sqlalchemy import select, func, and_, or_
+
+from .models import db, Case, Invoice
+from .case_progress import progress_percent, FINAL_STAGE
+from .case_search import search_condition
+
+# Liczba spraw na stronie listy
+PAGE_SIZE = 100
+
+# Pozostała kwota do zapłaty (w groszach) – jak w widokach: left_to_pay albo brutto minus wpłaty
+remaining_debt = func.coalesce(Invoice.left_to_pay, Invoice.gross_price - func.coalesce(Invoice.paid_price, 0), 0)
+
+# Klucze sortowania z formularza -> (wyrażenie SQL, odwrócić kierunek?).
+# days_diff (dni po terminie) rośnie, gdy termin płatności maleje – sortujemy więc po terminie
+# w odwrotnym kierunku, bez liczenia różnicy dat w SQL. Wartości NULL zastępujemy stałą,
+# żeby porównania stronicowania (keyset) były jednoznaczne.
+SORT_COLUMNS = {
+    "case_number": (func.lower(func.coalesce(Case.case_number, "")), False),
+    "client_id": (func.lower(func.coalesce(Case.client_id, "")), False),
+    "client_company_name": (func.lower(func.coalesce(Case.client_company_name, "")), False),
+    "client_nip": (func.lower(func.coalesce(Case.client_nip, "")), False),
+    "client_email": (func.lower(func.coalesce(Invoice.client_email, "")), False),
+    "total_debt": (remaining_debt, False),
+    "days_diff": (func.coalesce(Invoice.payment_due_date, date(1900, 1, 1)), True),
+}
+
+
+def list_filters(args, statuses=(), today=None):
+    """
+    Warunki WHERE z parametrów formularza listy spraw:
+      - search: podciąg pól sprawy (case_search),
+      - min_days / max_days: zakres dni po terminie płatności,
+      - min_amount / max_amount: zakres pozostałej kwoty (zł),
+      - stage: najwyższy wysłany etap (0–5),
+      - status: jeden ze `statuses` (np. zamknięte opłacone / nieopłacone).
+    Zwraca (warunki, wartości filtrów do ponownego wypełnienia formularza).
+    """
+    today = today or date.today()
+    values = {
+        "search": args.get('search', '').strip(),
+        "min_days": args.get('min_days', type=int),
+        "max_days": args.get('max_days', type=int),
+        "min_amount": args.get('min_amount', type=float),
+        "max_amount": args.get('max_amount', type=float),
+        "stage": args.get('stage', type=int),
+        "status": args.get('status', '') if args.get('status', '') in statuses else '',
+    }
+    conditions = []
+    if values["search"]:
+        conditions.append(search_condition(values["search"]))
+    # days_diff = dziś - termin płatności, więc zakres dni to zakres terminów
+    if values["min_days"] is not None:
+        conditions.append(Invoice.payment_due_date <= today - timedelta(days=values["min_days"]))
+    if values["max_days"] is not None:
+        conditions.append(Invoice.payment_due_date >= today - timedelta(days=values["max_days"]))
+    if values["min_amount"] is not None:
+        conditions.append(remaining_debt >= round(values["min_amount"] * 100))
+    if values["max_amount"] is not None:
+        conditions.append(remaining_debt <= round(values["max_amount"] * 100))
+    if values["stage"] is not None:
+        conditions.append(func.coalesce(Case.max_stage, 0) == values["stage"])
+    if values["status"]:
+        conditions.append(Case.status == values["status"])
+    return conditions, values
+
+
+def _keyset_condition(sort_expr, descending, case_id):
+    """
+    Warunek "po wierszu sprawy case_id" w porządku (sort_expr, Case.id). Wartość sortowania
+    wiersza granicznego pobiera podzapytanie, więc kursor strony to samo id sprawy.
+    """
+    boundary = (select(sort_expr)
+                .select_from(Case)
+                .join(Invoice, Invoice.case_id == Case.id)
+                .where(Case.id == case_id)
+                .limit(1)
+                .scalar_subquery())
+    if descending:
+        return or_(sort_expr < boundary, and_(sort_expr == boundary, Case.id < case_id))
+    return or_(sort_expr > boundary, and_(sort_expr == boundary, Case.id > case_id))
+
+
+def case_row(row, today):
+    """
+    Słownik sprawy dla szablonów list (jak wcześniej budowany w widokach).
+    """
+    return {
+        'id': row.id,
+        'case_number': row.case_number,
+        'client_id': row.client_id,
+        'client_company_name': row.client_company_name,
+        'client_nip': row.client_nip,
+        'client_email': row.client_email if row.client_email else "Brak",
+        'total_debt': (row.debt / 100.0) if row.debt else 0.0,
+        'days_diff': (today - row.payment_due_date).days if row.payment_due_date else None,
+        'progress_percent': progress_percent(row.max_stage),
+        'status': row.status,
+    }
+
+
+def case_page(*filters, sort_by="case_number", sort_order="asc", after=None, before=None,
+              page_size=PAGE_SIZE, today=None):
+    """
+    Jedna strona listy spraw jednym zapytaniem (sprawa + faktura), posortowana w SQL (ORDER BY
+    sort_by, id) i stronicowana po kluczu: after – id ostatniej sprawy poprzedniej strony,
+    before – id pierwszej sprawy następnej strony (cofanie). filters – warunki WHERE, np. Case.status == "active".
+    Zwraca (sprawy, id_dla_następnej_strony, id_dla_poprzedniej_strony); id None, gdy strony nie ma.
+    """
+    today = today or date.today()
+    sort_expr, reverse = SORT_COLUMNS.get(sort_by, SORT_COLUMNS["case_number"])
+    descending = (sort_order == "desc") != reverse
+    # Cofanie: czytamy w odwrotnym porządku od sprawy `before`, a potem odwracamy wynik
+    backwards = before is not None and after is None
+    scan_descending = descending != backwards
+
+    query = (select(Case.id, Case.case_number, Case.client_id, Case.client_company_name, Case.client_nip,
+                    Case.status, Case.max_stage, Invoice.client_email, Invoice.payment_due_date,
+                    remaining_debt.label("debt"))
+             .join(Invoice, Invoice.case_id == Case.id)
+             .where(*filters))
+    if after is not None:
+        query = query.where(_keyset_condition(sort_expr, descending, after))
+    elif backwards:
+        query = query.where(_keyset_condition(sort_expr, not descending, before))
+    if scan_descending:
+        query = query.order_by(sort_expr.desc(), Case.id.desc())
+    else:
+        query = query.order_by(sort_expr.asc(), Case.id.asc())
+
+    # Jeden wiersz ponad stronę mówi, czy w tym kierunku jest kolejna strona
+    rows = db.session.execute(query.limit(page_size + 1)).all()
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+    cases = [case_row(row, today) for row in rows]
+    if not cases:
+        return cases, None, None
+
+    if backwards:
+        next_after = cases[-1]['id']
+        prev_before = cases[0]['id'] if more else None
+    else:
+        next_after = cases[-1]['id'] if more else None
+        prev_before = cases[0]['id'] if after is not None else None
+    return cases, next_after, prev_before
+
+
+def stage_counts(*filters):
+    """
+    Liczba spraw na każdym etapie 1–5 (Case.max_stage) – jedno zapytanie GROUP BY.
+    """
+    counts = {stage: 0 for stage in range(1, FINAL_STAGE + 1)}
+    for stage, count in db.session.execute(
+        select(Case.max_stage, func.count(Case.id))
+        .join(Invoice, Invoice.case_id == Case.id)
+        .where(*filters)
+        .group_by(Case.max_stage)
+    ):
+        if stage in counts:
+            counts[stage] = count
+    return counts
+
+
+def client_summary(client_id):
+    """
+    Podsumowanie spraw klienta jednym zapytaniem GROUP BY (aktywna/zamknięta, etap):
+    liczba spraw aktywnych i zamkniętych, łączna pozostała kwota spraw aktywnych (zł)
+    oraz liczba spraw na każdym etapie.
+    """
+    is_active = Case.status == "active"
+    summary = {"active_count": 0, "completed_count": 0, "total_debt": 0.0,
+               "stage_counts": {stage: 0 for stage in range(0, FINAL_STAGE + 1)}}
+    for active, stage, count, debt in db.session.execute(
+        select(is_active, func.coalesce(Case.max_stage, 0), func.count(Case.id), func.sum(remaining_debt))
+        .join(Invoice, Invoice.case_id == Case.id)
+        .where(Case.client_id == client_id)
+        .group_by(is_active, func.coalesce(Case.max_stage, 0))
+    ):
+        if active:
+            summary["active_count"] += count
+            summary["total_debt"] += (debt or 0) / 100.0
+        else:
+            summary["completed_count"] += count
+        if stage in summary["stage_counts"]:
+            summary["stage_counts"][stage] += count
+    return summary
+
+
+def case_totals(*filters):
+    """
+    Liczba spraw i łączna pozostała kwota (zł) dla warunków filters – jedno zapytanie agregujące.
+    """
+    count, debt = db.session.execute(
+        select(func.count(Case.id), func.coalesce(func.sum(remaining_debt), 0))
+        .join(Invoice, Invoice.case_id == Case.id)
+        .where(*filters)
+    ).one()
+    return count, (debt or 0) / 100.0
@@ -0,0 +1,145 @@
+# case_progress.py
+import argparse
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func
+
+from .models import db, Case, Invoice, NotificationLog
+from .persistence import update_rows, IN_CHUNK
+from .notification_store import storage_fields
+from .shipping_settings import NOTIFICATION_OFFSETS
+
+# Numer etapu (1–5) dla pełnej nazwy etapu – w kolejności NOTIFICATION_OFFSETS
+STAGE_NUMBERS = {stage: number for number, stage in enumerate(NOTIFICATION_OFFSETS, start=1)}
+STAGE_NAMES = {number: stage for stage, number in STAGE_NUMBERS.items()}
+FINAL_STAGE = len(STAGE_NUMBERS)
+
+
+def stage_number(stage):
+    """
+    Numer etapu dla NotificationLog.stage: pełna nazwa etapu albo numer
+    ("3" – wpisy ze starszego update_and_schedule). Nieznany etap -> 0.
+    """
+    if stage and stage.isdigit():
+        return int(stage)
+    return STAGE_NUMBERS.get(stage, 0)
+
+
+def progress_percent(max_stage):
+    return int(((max_stage or 0) / FINAL_STAGE) * 100)
+
+
+def next_notification_date(payment_due_date, max_stage):
+    """
+    Termin kolejnego etapu po max_stage (termin płatności + offset etapu).
+    None, gdy faktura nie ma terminu płatności albo wysłano już ostatni etap.
+    """
+    if not payment_due_date or (max_stage or 0) >= FINAL_STAGE:
+        return None
+    return payment_due_date + timedelta(days=NOTIFICATION_OFFSETS[STAGE_NAMES[(max_stage or 0) + 1]])
+
+
+def log_notification(case_obj, invoice, stage, subject, body, mode, email_to=None, scheduled_date=None,
+                     template=None):
+    """
+    Zapisuje NotificationLog i w tej samej transakcji uaktualnia postęp sprawy
+    (max_stage, last_notified_at, next_notification_date), więc widoki nie muszą
+    przeglądać historii powiadomień. template – (klucz, wersja, parametry) z mail_utils.build_email:
+    zapisywane zamiast pełnej treści (notification_store.storage_fields). Nie wykonuje commit. Zwraca nowy wpis.
+    """
+    sent_at = datetime.utcnow()
+    log = NotificationLog(
+        sent_at=sent_at,
+        client_id=invoice.client_id,
+        invoice_number=invoice.invoice_number,
+        email_to=email_to if email_to is not None else invoice.client_email,
+        subject=subject,
+        stage=stage,
+        mode=mode,
+        scheduled_date=scheduled_date,
+        **storage_fields(body, template)
+    )
+    db.session.add(log)
+    if case_obj is not None:
+        case_obj.max_stage = max(case_obj.max_stage or 0, stage_number(stage))
+        if not case_obj.last_notified_at or sent_at > case_obj.last_notified_at:
+            case_obj.last_notified_at = sent_at
+        case_obj.next_notification_date = next_notification_date(invoice.payment_due_date, case_obj.max_stage)
+        db.session.add(case_obj)
+    return log
+
+
+def backfill_case_progress(bind=None, batch_size=IN_CHUNK, start_id=0, on_batch=None):
+    """
+    Przelicza postęp wszystkich spraw z historii NotificationLog: sprawy po `batch_size`
+    (stronicowanie po id), jedno zapytanie GROUP BY o logi paczki i jeden UPDATE (executemany).
+    bind – połączenie; domyślnie db.session z commit po każdej paczce.
+    start_id – wznowienie od spraw o id większym; on_batch(last_id) – wywoływane przed commit paczki.
+    Zwraca liczbę przeliczonych spraw.
+    """
+    executor = bind if bind is not None else db.session
+    last_id = start_id
+    total = 0
+    while True:
+        cases = executor.execute(
+            select(Case.id, Case.case_number, Invoice.payment_due_date)
+            .outerjoin(Invoice, Invoice.case_id == Case.id)
+            .where(Case.id > last_id)
+            .order_by(Case.id)
+            .limit(batch_size)
+        ).all()
+        if not cases:
+            break
+        last_id = cases[-1].id
+
+        progress = {}
+        logs = executor.execute(
+            select(NotificationLog.invoice_number, NotificationLog.stage, func.max(NotificationLog.sent_at))
+            .where(NotificationLog.invoice_number.in_([c.case_number for c in cases]))
+            .group_by(NotificationLog.invoice_number, NotificationLog.stage)
+        ).all()
+        for invoice_number, stage, sent_at in logs:
+            max_stage, last_sent = progress.get(invoice_number, (0, None))
+            if sent_at and (last_sent is None or sent_at > last_sent):
+                last_sent = sent_at
+            progress[invoice_number] = (max(max_stage, stage_number(stage)), last_sent)
+
+        rows = []
+        for case_id, case_number, payment_due_date in cases:
+            max_stage, last_sent = progress.get(case_number, (0, None))
+            rows.append({
+                "id": case_id,
+                "max_stage": max_stage,
+                "last_notified_at": last_sent,
+                "next_notification_date": next_notification_date(payment_due_date, max_stage),
+            })
+        update_rows(Case, rows, "id", bind=bind)
+        if on_batch is not None:
+            on_batch(last_id)
+        if bind is None:
+            db.session.commit()
+        total += len(rows)
+    print(f"[case_progress] Przeliczono postęp {total} spraw")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Przeliczenie postępu powiadomień spraw z historii NotificationLog")
+    parser.add_argument("--batch-size", type=int, default=IN_CHUNK)
+    args = parser.parse_args()
+
+    from .app import create_app
+    from .migrations import run_migrations
+    from .dashboard_summary import rebuild_dashboard
+    app = create_app(start_background_jobs=False)
+    with app.app_context():
+        # Kolumny postępu dodaje migracja 0003 (pierwsze przeliczenie – jej krok danych)
+        db.create_all()
+        run_migrations()
+        backfill_case_progress(batch_size=args.batch_size)
+        # Etapy spraw zmienione poza log_notification – podsumowanie list od nowa
+        rebuild_dashboard()
+
+
+if __name__ == "__main__":
+    main()
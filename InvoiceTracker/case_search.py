@@ -0,0 +1,159 @@
+# case_search.py
+import re
+import sqlite3
+
+from sqlalchemy import select, text, inspect
+
+from .models import db, Case, Invoice
+from .persistence import update_rows, IN_CHUNK
+
+# Tabela FTS5 (tokenizer trigram) indeksująca Case.search_text w SQLite – utrzymywana triggerami
+SQLITE_FTS_TABLE = "case_search_fts"
+# Trigramy – indeks pomaga dopiero od 3 znaków
+MIN_INDEXED_QUERY = 3
+# Tokenizer trigram jest dostępny od SQLite 3.34
+SQLITE_HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+# Czy tabela FTS istnieje w danej bazie (url silnika -> bool) – sprawdzane raz na proces
+_fts_ready = {}
+
+
+def sqlite_fts_ready():
+    bind = db.session.get_bind()
+    key = str(bind.url)
+    if key not in _fts_ready:
+        _fts_ready[key] = inspect(bind).has_table(SQLITE_FTS_TABLE)
+    return _fts_ready[key]
+
+
+def normalize(value):
+    # Identyfikatory z API (np. client_id) przychodzą jako liczby
+    return re.sub(r"\s+", " ", ("" if value is None else str(value)).strip().lower())
+
+
+def search_text_for(case_number, client_id, client_nip, client_company_name, client_email):
+    """
+    Znormalizowany tekst wyszukiwania sprawy: pola z wyszukiwarki list (numer sprawy, ID klienta,
+    NIP, nazwa, e-mail) małymi literami; NIP dodatkowo bez myślników i spacji.
+    """
+    nip_digits = re.sub(r"[\s-]", "", client_nip or "")
+    parts = [case_number, client_id, client_nip, nip_digits, client_company_name,
+             client_email if client_email not in (None, "N/A") else ""]
+    return " ".join(normalize(part) for part in parts if part)
+
+
+def normalize_query(query):
+    """
+    Zapytanie z pola wyszukiwania w postaci porównywalnej z search_text ("123-456-32-18" -> "1234563218").
+    """
+    query = normalize(query)
+    if re.fullmatch(r"[\d\s-]+", query):
+        query = re.sub(r"[\s-]", "", query)
+    return query
+
+
+def search_condition(query):
+    """
+    Warunek WHERE dla wyszukiwania w listach spraw (podciąg search_text).
+    PostgreSQL: LIKE korzysta z indeksu GIN trigramów (pg_trgm). SQLite: zapytania od 3 znaków
+    trafiają do tabeli FTS5 z tokenizerem trigram, krótsze przeglądają kolumnę search_text.
+    """
+    query = normalize_query(query)
+    if db.session.get_bind().dialect.name == "sqlite" and len(query) >= MIN_INDEXED_QUERY \
+            and not any(ch in query for ch in "%_\"") and sqlite_fts_ready():
+        return Case.id.in_(
+            select(text("rowid")).select_from(text(SQLITE_FTS_TABLE))
+            .where(text(f"{SQLITE_FTS_TABLE}.search_text LIKE :search_pattern")
+                   .bindparams(search_pattern=f"%{query}%"))
+        )
+    return Case.search_text.contains(query, autoescape=True)
+
+
+def refresh_search_text(case_ids, bind=None):
+    """
+    Przelicza search_text wskazanych spraw z danych sprawy i jej faktury (e-mail klienta)
+    i zapisuje zmienione wartości jednym UPDATE na paczkę. Nie wykonuje commit.
+    bind – połączenie zamiast db.session (np. w migracji). Zwraca liczbę zmienionych spraw.
+    """
+    executor = bind if bind is not None else db.session
+    case_ids = [case_id for case_id in set(case_ids) if case_id is not None]
+    changed = 0
+    for i in range(0, len(case_ids), IN_CHUNK):
+        rows = executor.execute(
+            select(Case.id, Case.case_number, Case.client_id, Case.client_nip, Case.client_company_name,
+                   Invoice.client_email, Case.search_text)
+            .outerjoin(Invoice, Invoice.case_id == Case.id)
+            .where(Case.id.in_(case_ids[i:i + IN_CHUNK]))
+        ).all()
+        updates = []
+        for case_id, number, client_id, nip, company, email, current in rows:
+            value = search_text_for(number, client_id, nip, company, email)
+            if value != current:
+                updates.append({"id": case_id, "search_text": value})
+        update_rows(Case, updates, "id", bind=bind)
+        changed += len(updates)
+    return changed
+
+
+def backfill_search_text(bind=None, batch_size=IN_CHUNK, start_id=0, on_batch=None):
+    """
+    Uzupełnia search_text wszystkich spraw (stronicowanie po id). Zwraca liczbę zmienionych spraw.
+    start_id – wznowienie od spraw o id większym; on_batch(last_id) – wywoływane przed commit paczki.
+    """
+    executor = bind if bind is not None else db.session
+    last_id = start_id
+    changed = 0
+    while True:
+        ids = list(executor.execute(
+            select(Case.id).where(Case.id > last_id).order_by(Case.id).limit(batch_size)
+        ).scalars())
+        if not ids:
+            break
+        last_id = ids[-1]
+        changed += refresh_search_text(ids, bind=bind)
+        if on_batch is not None:
+            on_batch(last_id)
+        if bind is None:
+            db.session.commit()
+    return changed
+
+
+def create_search_index(conn):
+    """
+    Indeks wyszukiwania podciągów w search_text.
+    PostgreSQL: rozszerzenie pg_trgm i indeks GIN (gin_trgm_ops) – obsługuje LIKE '%...%'.
+    SQLite: tabela FTS5 z tokenizerem trigram (external content na tabeli case) i triggery,
+    które utrzymują ją przy każdym INSERT/UPDATE/DELETE sprawy.
+    Zwraca listę utworzonych obiektów.
+    """
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_case_search_text_trgm ON "case" USING gin (search_text gin_trgm_ops)'
+        ))
+        return ["pg_trgm", "ix_case_search_text_trgm"]
+    if dialect == "sqlite" and SQLITE_HAS_TRIGRAM:
+        fts = SQLITE_FTS_TABLE
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"search_text, content='case', content_rowid='id', tokenize='trigram')"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON \"case\" BEGIN "
+            f"INSERT INTO {fts}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON \"case\" BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF search_text ON \"case\" BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+            f"INSERT INTO {fts}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        ))
+        # Przebudowa z bieżącej zawartości tabeli case (np. po odtworzeniu tabel)
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+        _fts_ready.clear()
+        return [fts]
+    return []
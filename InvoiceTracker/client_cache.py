@@ -0,0 +1,107 @@
+# client_cache.py
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from .models import db, ClientCache
+from .shipping_settings import CLIENT_CACHE_CONFIG
+
+
+class ClientDetailsCache:
+    """
+    Dwupoziomowa pamięć podręczna danych klientów inFakt (klucz: client_id).
+    Poziom 1: LRU w pamięci procesu. Poziom 2: tabela ClientCache w bazie,
+    współdzielona przez wszystkie instancje i kolejne synchronizacje.
+    Wpisy starsze niż TTL są pomijane, więc każdy klient pobierany jest z API
+    najwyżej raz na TTL. Operacje na bazie wymagają kontekstu aplikacji.
+    """
+    def __init__(self, ttl_hours=None, max_size=None):
+        self.ttl = timedelta(hours=ttl_hours or CLIENT_CACHE_CONFIG["ttl_hours"])
+        self.max_size = max_size or CLIENT_CACHE_CONFIG["max_size"]
+        self._lru = OrderedDict()  # client_id -> (data, fetched_at)
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, fetched_at):
+        return fetched_at >= datetime.utcnow() - self.ttl
+
+    def _remember(self, client_id, data, fetched_at):
+        with self._lock:
+            self._lru[client_id] = (data, fetched_at)
+            self._lru.move_to_end(client_id)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def get(self, client_id):
+        return self.get_many([client_id]).get(str(client_id))
+
+    def get_many(self, client_ids):
+        """
+        Zwraca słownik client_id -> dane dla klientów z aktualnym wpisem w pamięci lub w bazie.
+        Brakujących (lub przeterminowanych) klientów nie ma w wyniku.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for cid in {str(c) for c in client_ids}:
+                entry = self._lru.get(cid)
+                if entry and self._is_fresh(entry[1]):
+                    self._lru.move_to_end(cid)
+                    found[cid] = entry[0]
+                else:
+                    missing.append(cid)
+
+        cutoff = datetime.utcnow() - self.ttl
+        for i in range(0, len(missing), 500):
+            rows = ClientCache.query.filter(
+                ClientCache.client_id.in_(missing[i:i + 500]),
+                ClientCache.fetched_at >= cutoff
+            ).all()
+            for row in rows:
+                data = json.loads(row.data)
+                found[row.client_id] = data
+                self._remember(row.client_id, data, row.fetched_at)
+        return found
+
+    def put(self, client_id, data):
+        self.put_many({client_id: data})
+
+    def put_many(self, clients):
+        """
+        Zapisuje dane klientów (client_id -> dane z API) w pamięci i w bazie (jeden commit).
+        """
+        if not clients:
+            return
+        now = datetime.utcnow()
+        clients = {str(cid): data for cid, data in clients.items()}
+        existing = {}
+        ids = list(clients)
+        for i in range(0, len(ids), 500):
+            for row in ClientCache.query.filter(ClientCache.client_id.in_(ids[i:i + 500])).all():
+                existing[row.client_id] = row
+        for cid, data in clients.items():
+            row = existing.get(cid) or ClientCache(client_id=cid)
+            row.data = json.dumps(data)
+            row.fetched_at = now
+            db.session.add(row)
+            self._remember(cid, data, now)
+        db.session.commit()
+
+    def invalidate(self, client_id=None):
+        """
+        Usuwa wpis klienta (lub wszystkie wpisy, gdy client_id=None) z pamięci i z bazy.
+        """
+        with self._lock:
+            if client_id is None:
+                self._lru.clear()
+            else:
+                self._lru.pop(str(client_id), None)
+        query = ClientCache.query
+        if client_id is not None:
+            query = query.filter_by(client_id=str(client_id))
+        query.delete(synchronize_session=False)
+        db.session.commit()
+
+
+# Wspólna instancja dla całego procesu
+client_cache = ClientDetailsCache()
@@ -0,0 +1,325 @@
+# dashboard_summary.py
+import argparse
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, Case, Invoice, DashboardSummary, DashboardSummaryState
+from .case_listing import remaining_debt
+from .case_progress import FINAL_STAGE
+from .persistence import update_rows, IN_CHUNK
+
+# Przedziały wiekowania spraw: (etykieta, od ilu dni po terminie płatności)
+AGING_BUCKETS = [
+    ("przed terminem", None),
+    ("1–30 dni", 1),
+    ("31–60 dni", 31),
+    ("61–90 dni", 61),
+    ("ponad 90 dni", 91),
+]
+AGING_BOUNDARIES = [start for _, start in AGING_BUCKETS[1:]]
+# Przedział spraw bez terminu płatności
+NO_DUE_DATE = -1
+# Dłuższa przerwa od ostatniego przesunięcia daty – pełna przebudowa zamiast przeliczania spraw na granicach przedziałów
+MAX_ROLLOVER_DAYS = 31
+# Jedyny wiersz DashboardSummaryState
+STATE_ID = 1
+
+_summary = DashboardSummary.__table__
+
+
+def _executor(bind):
+    return bind if bind is not None else db.session
+
+
+def _is_postgres(bind):
+    return (bind if bind is not None else db.session.get_bind()).dialect.name == "postgresql"
+
+
+def aging_bucket(payment_due_date, as_of):
+    if not payment_due_date:
+        return NO_DUE_DATE
+    return bisect_right(AGING_BOUNDARIES, (as_of - payment_due_date).days)
+
+
+def summary_key(status, max_stage, bucket):
+    return f"{status}|{max_stage or 0}|{bucket}"
+
+
+def _parse_key(key):
+    status, max_stage, bucket = key.rsplit("|", 2)
+    return status, int(max_stage), int(bucket)
+
+
+def _contribution_rows(executor, condition, limit=None, lock=False):
+    """
+    Sprawy spełniające `condition` z bieżącymi danymi (status, etap, termin, pozostała kwota)
+    i tym, jak są wliczone w podsumowanie. lock – PostgreSQL: wiersze spraw blokowane do końca transakcji.
+    """
+    query = (select(Case.id, Case.status, Case.max_stage, Invoice.payment_due_date, Invoice.id.label("invoice_id"),
+                    remaining_debt.label("debt"), Case.summary_key, Case.summary_debt)
+             .outerjoin(Invoice, Invoice.case_id == Case.id)
+             .where(condition)
+             .order_by(Case.id)
+             .limit(limit))
+    if lock:
+        query = query.with_for_update(of=Case)
+    return executor.execute(query).all()
+
+
+def _current_contribution(row, as_of):
+    # Sprawa bez faktury nie występuje w listach (join z Invoice), więc nie jest też liczona
+    if row.invoice_id is None:
+        return None, None
+    return summary_key(row.status, row.max_stage, aging_bucket(row.payment_due_date, as_of)), row.debt or 0
+
+
+def _apply_deltas(deltas, bind=None):
+    """
+    Dodaje różnice {klucz: [liczba spraw, kwota]} do wierszy DashboardSummary
+    (PostgreSQL: INSERT ... ON CONFLICT DO UPDATE; inne bazy: UPDATE count = count + ..., a dla nowego klucza INSERT).
+    """
+    executor = _executor(bind)
+    postgres = _is_postgres(bind)
+    for key, (count, debt) in deltas.items():
+        if not count and not debt:
+            continue
+        status, max_stage, bucket = _parse_key(key)
+        if postgres:
+            stmt = pg_insert(_summary).values(status=status, max_stage=max_stage, aging_bucket=bucket,
+                                              case_count=count, debt=debt)
+            executor.execute(stmt.on_conflict_do_update(
+                index_elements=["status", "max_stage", "aging_bucket"],
+                set_={"case_count": _summary.c.case_count + stmt.excluded.case_count,
+                      "debt": _summary.c.debt + stmt.excluded.debt}
+            ))
+            continue
+        result = executor.execute(
+            update(_summary)
+            .where(_summary.c.status == status, _summary.c.max_stage == max_stage, _summary.c.aging_bucket == bucket)
+            .values(case_count=_summary.c.case_count + count, debt=_summary.c.debt + debt)
+        )
+        if result.rowcount == 0:
+            executor.execute(_summary.insert().values(status=status, max_stage=max_stage, aging_bucket=bucket,
+                                                      case_count=count, debt=debt))
+
+
+def _summary_as_of(executor, lock=False):
+    query = select(DashboardSummaryState.as_of).where(DashboardSummaryState.id == STATE_ID)
+    if lock:
+        query = query.with_for_update()
+    return executor.execute(query).scalar()
+
+
+def refresh_dashboard(case_ids, bind=None):
+    """
+    Uaktualnia DashboardSummary po zmianie wskazanych spraw (status, etap, termin, kwoty faktury):
+    porównuje bieżący wkład sprawy z zapisanym w Case.summary_key / summary_debt i dodaje różnice.
+    Wywoływana przez zapisy synchronizacji i powiadomień po zmianach, przed commit; nie wykonuje commit.
+    Dopóki nie ma stanu podsumowania (rebuild_dashboard / build_dashboard), nic nie robi.
+    Zwraca liczbę spraw, których wkład się zmienił.
+    """
+    executor = _executor(bind)
+    case_ids = sorted({case_id for case_id in case_ids if case_id is not None})
+    if not case_ids:
+        return 0
+    as_of = _summary_as_of(executor)
+    if as_of is None:
+        return 0
+    changed = 0
+    for i in range(0, len(case_ids), IN_CHUNK):
+        deltas = {}
+        updates = []
+        for row in _contribution_rows(executor, Case.id.in_(case_ids[i:i + IN_CHUNK]), lock=True):
+            key, debt = _current_contribution(row, as_of)
+            if key == row.summary_key and debt == row.summary_debt:
+                continue
+            if row.summary_key is not None:
+                delta = deltas.setdefault(row.summary_key, [0, 0])
+                delta[0] -= 1
+                delta[1] -= row.summary_debt or 0
+            if key is not None:
+                delta = deltas.setdefault(key, [0, 0])
+                delta[0] += 1
+                delta[1] += debt
+            updates.append({"id": row.id, "summary_key": key, "summary_debt": debt})
+        update_rows(Case, updates, "id", bind=bind)
+        _apply_deltas(deltas, bind=bind)
+        changed += len(updates)
+    return changed
+
+
+def rebuild_dashboard(bind=None, as_of=None, batch_size=IN_CHUNK):
+    """
+    Przelicza całe podsumowanie od zera w jednej transakcji: wkład każdej sprawy (paczki po id)
+    i wiersze DashboardSummary względem dnia as_of (domyślnie dziś).
+    bind – połączenie (np. w migracji); domyślnie db.session z commit na końcu.
+    Zwraca liczbę spraw wliczonych w podsumowanie.
+    """
+    executor = _executor(bind)
+    as_of = as_of or date.today()
+    # PostgreSQL: blokada wiersza stanu – przebudowa i przesunięcie daty nie biegną równolegle
+    _summary_as_of(executor, lock=True)
+    totals = {}
+    counted = 0
+    last_id = 0
+    while True:
+        rows = _contribution_rows(executor, Case.id > last_id, limit=batch_size)
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            key, debt = _current_contribution(row, as_of)
+            if key is not None:
+                total = totals.setdefault(key, [0, 0])
+                total[0] += 1
+                total[1] += debt
+                counted += 1
+            if key != row.summary_key or debt != row.summary_debt:
+                updates.append({"id": row.id, "summary_key": key, "summary_debt": debt})
+        update_rows(Case, updates, "id", bind=bind)
+
+    executor.execute(delete(_summary))
+    if totals:
+        executor.execute(_summary.insert(), [
+            dict(zip(("status", "max_stage", "aging_bucket"), _parse_key(key)), case_count=count, debt=debt)
+            for key, (count, debt) in totals.items()
+        ])
+    state = DashboardSummaryState.__table__
+    values = {"as_of": as_of, "rebuilt_at": datetime.utcnow()}
+    if executor.execute(update(state).where(state.c.id == STATE_ID).values(values)).rowcount == 0:
+        executor.execute(state.insert().values(id=STATE_ID, **values))
+    if bind is None:
+        db.session.commit()
+    print(f"[dashboard_summary] Przebudowano podsumowanie ({counted} spraw, {len(totals)} wierszy) na dzień {as_of}")
+    return counted
+
+
+def build_dashboard(batch_size=IN_CHUNK, start_id=0, on_batch=None):
+    """
+    Buduje podsumowanie paczkami spraw z commit po każdej (krok danych migracji 0006), zamiast
+    jednej transakcji rebuild_dashboard. Najpierw zapisuje stan (dzień as_of, rebuilt_at = None –
+    w budowie): od tej chwili zapisy spraw uaktualniają podsumowanie przyrostowo, a każda paczka
+    dolicza wkład kolejnych spraw tym samym refresh_dashboard. Do zakończenia dashboard_totals
+    zwraca None. start_id, on_batch – wznowienie jak w backfill_case_progress.
+    Zwraca liczbę spraw, których wkład został zapisany.
+    """
+    state = DashboardSummaryState.__table__
+    if _summary_as_of(db.session, lock=True) is None:
+        # Bez stanu refresh_dashboard nic nie zapisywał – tabela i summary_key spraw są puste
+        db.session.execute(delete(_summary))
+        db.session.execute(state.insert().values(id=STATE_ID, as_of=date.today(), rebuilt_at=None))
+        db.session.commit()
+    counted = 0
+    last_id = start_id
+    while True:
+        case_ids = list(db.session.execute(
+            select(Case.id).where(Case.id > last_id).order_by(Case.id).limit(batch_size)
+        ).scalars())
+        if not case_ids:
+            break
+        last_id = case_ids[-1]
+        counted += refresh_dashboard(case_ids)
+        if on_batch is not None:
+            on_batch(last_id)
+        db.session.commit()
+    db.session.execute(update(state).where(state.c.id == STATE_ID).values(rebuilt_at=datetime.utcnow()))
+    db.session.commit()
+    print(f"[dashboard_summary] Zbudowano podsumowanie paczkami ({counted} spraw)")
+    return counted
+
+
+def roll_dashboard(today=None, bind=None):
+    """
+    Przesuwa dzień podsumowania na `today`. Przedział wiekowania zmienia się tylko sprawom,
+    których dni po terminie przekroczyły granicę przedziału (termin = dzień - granica),
+    więc przeliczane są tylko one. Przerwa dłuższa niż MAX_ROLLOVER_DAYS – pełna przebudowa.
+    Podsumowania jeszcze nie ma (krok danych migracji 0006 nie wykonany) – nic nie robi.
+    bind – jak w rebuild_dashboard. Zwraca liczbę przeliczonych spraw.
+    """
+    executor = _executor(bind)
+    today = today or date.today()
+    as_of = _summary_as_of(executor, lock=True)
+    if as_of is None or as_of >= today:
+        return 0
+    if (today - as_of).days > MAX_ROLLOVER_DAYS:
+        return rebuild_dashboard(bind=bind, as_of=today)
+
+    days = [as_of + timedelta(days=n) for n in range(1, (today - as_of).days + 1)]
+    crossing = sorted({day - timedelta(days=boundary) for day in days for boundary in AGING_BOUNDARIES})
+    case_ids = list(executor.execute(
+        select(Invoice.case_id).where(Invoice.payment_due_date.in_(crossing), Invoice.case_id.isnot(None))
+    ).scalars())
+    state = DashboardSummaryState.__table__
+    executor.execute(update(state).where(state.c.id == STATE_ID).values(as_of=today))
+    changed = refresh_dashboard(case_ids, bind=bind)
+    if bind is None:
+        db.session.commit()
+    print(f"[dashboard_summary] Dzień podsumowania {as_of} -> {today}, przeliczono {changed} spraw")
+    return changed
+
+
+def dashboard_totals(today=None):
+    """
+    Liczby do nagłówków list z DashboardSummary (kilkadziesiąt wierszy niezależnie od liczby spraw):
+      - active_count, total_debt (zł) – sprawy aktywne,
+      - completed_count – sprawy zamknięte,
+      - status_counts, status_debt – liczba spraw i kwota (zł) na status,
+      - stage_counts – etap -> liczba spraw, osobno "active" i "completed",
+      - aging – [(etykieta przedziału, liczba, kwota zł)] spraw aktywnych.
+    Tylko odczyt. None, dopóki podsumowanie nie jest zbudowane (build_dashboard) albo gdy jego dzień
+    nie jest dzisiejszy (przesuwa go zadanie schedulera o 00:05, roll_dashboard) – listy liczą wtedy
+    nagłówki zapytaniami.
+    """
+    today = today or date.today()
+    state = db.session.execute(
+        select(DashboardSummaryState.as_of, DashboardSummaryState.rebuilt_at)
+        .where(DashboardSummaryState.id == STATE_ID)
+    ).first()
+    if state is None or state.rebuilt_at is None or state.as_of != today:
+        return None
+    totals = {
+        "active_count": 0, "total_debt": 0.0, "completed_count": 0,
+        "status_counts": {}, "status_debt": {},
+        "stage_counts": {group: {stage: 0 for stage in range(0, FINAL_STAGE + 1)}
+                         for group in ("active", "completed")},
+    }
+    aging = {bucket: [0, 0] for bucket in [*range(len(AGING_BUCKETS)), NO_DUE_DATE]}
+    for row in db.session.execute(select(_summary)):
+        totals["status_counts"][row.status] = totals["status_counts"].get(row.status, 0) + row.case_count
+        totals["status_debt"][row.status] = totals["status_debt"].get(row.status, 0) + row.debt / 100.0
+        group = "active" if row.status == "active" else "completed"
+        if row.max_stage in totals["stage_counts"][group]:
+            totals["stage_counts"][group][row.max_stage] += row.case_count
+        if group == "active":
+            totals["active_count"] += row.case_count
+            totals["total_debt"] += row.debt / 100.0
+            aging[row.aging_bucket][0] += row.case_count
+            aging[row.aging_bucket][1] += row.debt / 100.0
+        else:
+            totals["completed_count"] += row.case_count
+    labels = [label for label, _ in AGING_BUCKETS] + ["bez terminu"]
+    totals["aging"] = [(label, count, debt) for label, (count, debt) in zip(labels, aging.values())]
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Przebudowa podsumowania spraw (DashboardSummary)")
+    parser.add_argument("--batch-size", type=int, default=IN_CHUNK)
+    args = parser.parse_args()
+
+    from .app import create_app
+    from .migrations import run_migrations
+    app = create_app(start_background_jobs=False)
+    with app.app_context():
+        # Tabele i kolumny dodaje migracja 0006
+        db.create_all()
+        run_migrations()
+        rebuild_dashboard(batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
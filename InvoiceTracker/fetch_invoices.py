@@ -3,13 +3,14 @@ import sys
 import asyncio
 import csv
 from datetime import datetime, date
-import aiohttp
 
 from .app import create_app
 from .models import db, Invoice, NotificationLog, Case
 from .send_email import send_email
 from .shipping_settings import NOTIFICATION_OFFSETS
-from .sync_database import sync_database
+from .sync_database import sync_database, resolve_invoice_details
+from .persistence import load_rows_by_key
+from .dashboard_summary import refresh_dashboard
 from .src.api.api_client import InFaktAPIClient
 from dotenv import load_dotenv
 
@@ -43,38 +44,6 @@ def export_invoices_to_csv(invoices, filename='invoices_with_due_dates.csv'):
             })
     print(f"[fetch_invoices] Faktury zapisane w pliku {filename}")
 
-async def fetch_invoice_detail(session, client, invoice_uuid):
-    """
-    Asynchronicznie pobiera szczegóły pojedynczej faktury.
-    """
-    url = f"{client.base_url}/invoices/{invoice_uuid}.json"
-    headers = client.headers
-    try:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                data = await response.json()
-                data['uuid'] = invoice_uuid
-                return data
-            else:
-                print(f"[fetch_invoices] Błąd pobierania faktury UUID={invoice_uuid}, kod HTTP={response.status}")
-                return None
-    except Exception as e:
-        print(f"[fetch_invoices] Błąd przy pobieraniu faktury UUID={invoice_uuid}: {e}")
-        return None
-
-async def fetch_all_details(client, invoices):
-    """
-    Asynchronicznie pobiera szczegóły dla listy faktur.
-    """
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for inv in invoices:
-            uuid_val = inv.get('uuid')
-            if uuid_val:
-                tasks.append(fetch_invoice_detail(session, client, uuid_val))
-        details = await asyncio.gather(*tasks)
-        return [d for d in details if d]
-
 def update_invoices_in_db():
     """
     Funkcja, która asynchronicznie pobiera tylko faktury o statusie 'sent' lub 'printed',
@@ -103,9 +72,11 @@ def update_invoices_in_db():
         print("[fetch_invoices] Nie znaleziono faktur z statusami 'sent' lub 'printed'.")
         return
 
-    # Pobieramy szczegóły asynchronicznie
-    details = asyncio.run(fetch_all_details(client, invoices_list))
-    details_map = {d['uuid']: d for d in details if 'uuid' in d}
+    # Szczegóły faktur pobieramy asynchronicznie, dane klientów z pamięci podręcznej
+    # (tabela ClientCache wymaga kontekstu aplikacji) lub z API
+    app = create_app()
+    with app.app_context():
+        details_map, clients_map = resolve_invoice_details(invoices_list, client)
 
     updated_invoices = []
     for inv in invoices_list:
@@ -126,39 +97,24 @@ def update_invoices_in_db():
         address_str = ''
         email_str = 'N/A'
         if client_id:
-            cdata = client.get_client_details(client_id)
-            if cdata:
-                email_str = cdata.get('email', 'N/A')
-                street = cdata.get('street', '')
-                street_no = cdata.get('street_number', '')
-                flat_no = cdata.get('flat_number', '')
-                city = cdata.get('city', '')
-                post_code = cdata.get('postal_code', '')
-                parts = []
-                if post_code:
-                    parts.append(post_code)
-                if street:
-                    s = street
-                    if street_no:
-                        s += f" {street_no}"
-                    if flat_no:
-                        s += f"/{flat_no}"
-                    parts.append(s)
-                if city:
-                    parts.append(city)
-                address_str = ", ".join(parts)
+            contact = clients_map.get(str(client_id))
+            if contact:
+                email_str = contact['email']
+                address_str = contact['address']
         inv['client_address'] = address_str
         inv['client_email'] = email_str
         updated_invoices.append(inv)
 
     # Zapis do bazy
-    app = create_app()
     with app.app_context():
+        # Istniejące faktury wczytujemy jednym zapytaniem IN (...)
+        local_invoices = load_rows_by_key(Invoice, "id", [inv['id'] for inv in updated_invoices])
         for inv in updated_invoices:
-            local_inv = Invoice.query.filter_by(id=inv['id']).first()
+            local_inv = local_invoices.get(inv['id'])
             if not local_inv:
                 local_inv = Invoice(id=inv['id'])
 
+            local_inv.uuid = inv.get('uuid') or local_inv.uuid
             local_inv.invoice_number = inv.get('number', '')
             d_str = inv.get('invoice_date')
             local_inv.invoice_date = None
@@ -188,8 +144,11 @@ def update_invoices_in_db():
             local_inv.currency = inv.get('currency', 'PLN')
             local_inv.paid_price = inv.get('paid_price', 0)
             local_inv.left_to_pay = inv.get('left_to_pay', 0)
+            # Odcisk update_existing_cases nie odpowiada już zapisanym polom – kolejna aktualizacja porówna fakturę od nowa
+            local_inv.remote_hash = None
 
             db.session.add(local_inv)
+        refresh_dashboard([local_inv.case_id for local_inv in local_invoices.values()])
         db.session.commit()
 
     export_invoices_to_csv(updated_invoices, 'invoices_with_due_dates.csv')
@@ -0,0 +1,112 @@
+# job_runner.py
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy import update
+
+from .models import db, SyncLease, SyncRun
+from .shipping_settings import SYNC_CONFIG
+from .sync_lease import lease_owner_id, claim_lease, release_lease, renew_lease
+from .sync_runs import open_run, run_resumable_sync
+
+# Wspólna blokada wszystkich synchronizacji z API (ręcznej, z harmonogramu i z crona)
+SYNC_LOCK = "job:sync"
+
+
+def in_flight_run_id():
+    """
+    Id przebiegu (SyncRun) trzymającego blokadę synchronizacji lub None,
+    gdy blokada jest wolna albo trzyma ją zadanie bez przebiegu (np. odświeżanie planowe).
+    """
+    lease = db.session.get(SyncLease, SYNC_LOCK)
+    if lease and lease.expires_at and lease.expires_at > datetime.utcnow():
+        return lease.run_id
+    return None
+
+
+class LeaseKeeper:
+    """
+    Przedłuża blokadę co 1/3 jej ważności, dopóki zadanie trwa – dzięki temu długa
+    synchronizacja nie traci blokady, a po awarii instancji blokada wygasa sama.
+    """
+    def __init__(self, app, shard, owner, ttl_seconds=None):
+        self.app = app
+        self.shard = shard
+        self.owner = owner
+        self.ttl_seconds = ttl_seconds or SYNC_CONFIG["lease_seconds"]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        with self.app.app_context():
+            while not self._stop.wait(self.ttl_seconds / 3):
+                try:
+                    renew_lease(self.shard, self.owner, self.ttl_seconds)
+                except Exception as e:
+                    logging.error(f"[job_runner] Błąd przedłużania blokady {self.shard}: {e}")
+                    db.session.rollback()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_exclusive(app, label, target):
+    """
+    Wykonuje target() pod blokadą synchronizacji (w bieżącym wątku i kontekście aplikacji).
+    Gdy trwa inna synchronizacja, zadanie jest pomijane. Zwraca wynik target() lub None.
+    """
+    owner = lease_owner_id()
+    if not claim_lease(SYNC_LOCK, owner):
+        print(f"[job_runner] {label}: trwa inna synchronizacja (przebieg {in_flight_run_id()}) – pomijam")
+        return None
+    try:
+        with LeaseKeeper(app, SYNC_LOCK, owner):
+            return target()
+    finally:
+        release_lease(SYNC_LOCK, owner)
+
+
+def _run_sync_job(app, owner, run_id):
+    with app.app_context():
+        try:
+            with LeaseKeeper(app, SYNC_LOCK, owner):
+                run_resumable_sync(run=db.session.get(SyncRun, run_id))
+        except Exception as e:
+            logging.error(f"Background sync error (przebieg {run_id}): {e}")
+            db.session.rollback()
+        finally:
+            release_lease(SYNC_LOCK, owner)
+
+
+def start_sync_job(app):
+    """
+    Uruchamia pełną synchronizację (run_resumable_sync) w tle – najwyżej jedną naraz.
+    Jeśli synchronizacja już trwa, nowe żądanie jest do niej dołączane zamiast uruchamiać kolejną.
+    Zwraca (run_id, started): id przebiegu (nowego lub trwającego) i czy uruchomiono nowy.
+    """
+    owner = lease_owner_id()
+    if not claim_lease(SYNC_LOCK, owner):
+        return in_flight_run_id(), False
+    try:
+        run = open_run()
+        if run is None:
+            # Przebieg bez blokady wciąż zapisuje punkty kontrolne (np. sprzed wdrożenia blokady)
+            current = SyncRun.query.filter_by(status="running").order_by(SyncRun.id.desc()).first()
+            release_lease(SYNC_LOCK, owner)
+            return (current.id if current else None), False
+        db.session.execute(
+            update(SyncLease).where(SyncLease.shard == SYNC_LOCK, SyncLease.owner == owner).values(run_id=run.id)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        release_lease(SYNC_LOCK, owner)
+        raise
+    threading.Thread(target=_run_sync_job, args=(app, owner, run.id), daemon=True).start()
+    return run.id, True
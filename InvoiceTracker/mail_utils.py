@@ -1,59 +1,87 @@
 # mail_utils.py
+import hashlib
 from datetime import timedelta
 from .mail_templates import MAIL_TEMPLATES
 
-def generate_email(stage, invoice):
+STAGE_TEMPLATE_KEYS = {
+    "Przypomnienie o zbliżającym się terminie płatności": "stage_1",
+    "Powiadomienie o upływie terminu płatności": "stage_2",
+    "Wezwanie do zapłaty": "stage_3",
+    "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": "stage_4",
+    "Przekazanie sprawy do windykatora zewnętrznego": "stage_5",
+}
+
+
+def template_key_for(stage):
     """
-    Funkcja generująca temat i treść e-maila (HTML) dla danego etapu 'stage' oraz faktury 'invoice'.
-    Zwraca krotkę: (subject, body_html).
+    Klucz szablonu dla etapu: "stage_2" bez zmian, pełna nazwa etapu -> "stage_1"... "stage_5",
+    numer etapu ("3" – wpisy update_and_schedule) -> "stage_3".
     """
-    stage_keys_map = {
-        "Przypomnienie o zbliżającym się terminie płatności": "stage_1",
-        "Powiadomienie o upływie terminu płatności": "stage_2",
-        "Wezwanie do zapłaty": "stage_3",
-        "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": "stage_4",
-        "Przekazanie sprawy do windykatora zewnętrznego": "stage_5",
-    }
-
     # Jeśli dostajemy np. "stage_2" to bierzemy od razu key=stage_2,
     # w innym przypadku mapujemy pełny tekst etapu na "stage_1"... "stage_5"
-    template_key = stage if stage.startswith("stage_") else stage_keys_map.get(stage, None)
+    if stage.startswith("stage_"):
+        return stage
+    if stage.isdigit():
+        return f"stage_{stage}"
+    return STAGE_TEMPLATE_KEYS.get(stage, None)
 
-    if not template_key:
-        return ("", "")
 
-    template = MAIL_TEMPLATES.get(template_key)
-    if not template:
-        return ("", "")
-
-    due_date_str = invoice.payment_due_date.strftime("%Y-%m-%d") if invoice.payment_due_date else "Brak"
-    debt_amount = f"{invoice.gross_price / 100:.2f}"
-
-    street_address = invoice.client_address or ""
-    # Domyślne wartości w razie braku
-    client_city = getattr(invoice, 'client_city', "") or ""
-    client_zip = getattr(invoice, 'client_zip', "") or ""
+def template_version(subject_template, body_template):
+    """
+    Wersja szablonu – skrót jego treści; zmiana tekstu szablonu daje nową wersję.
+    """
+    return hashlib.md5(f"{subject_template}\0{body_template}".encode("utf-8")).hexdigest()[:16]
 
-    subject = template["subject"].format(case_number=invoice.invoice_number)
 
+def email_params(invoice):
+    """
+    Wartości podstawiane do szablonów dla faktury (słownik gotowy do zapisu jako JSON).
+    """
     if invoice.payment_due_date:
         stage_3_date = (invoice.payment_due_date + timedelta(days=7)).strftime("%Y-%m-%d")
         stage_4_date = (invoice.payment_due_date + timedelta(days=14)).strftime("%Y-%m-%d")
         stage_5_date = (invoice.payment_due_date + timedelta(days=21)).strftime("%Y-%m-%d")
     else:
         stage_3_date = stage_4_date = stage_5_date = "Brak"
+    return {
+        "company_name": invoice.client_company_name or "",
+        "due_date": invoice.payment_due_date.strftime("%Y-%m-%d") if invoice.payment_due_date else "Brak",
+        "case_number": invoice.invoice_number,
+        "street_address": invoice.client_address or "",
+        # Domyślne wartości w razie braku
+        "postal_code": getattr(invoice, 'client_zip', "") or "",
+        "city": getattr(invoice, 'client_city', "") or "",
+        "nip": invoice.client_nip or "",
+        "debt_amount": f"{invoice.gross_price / 100:.2f}",
+        "stage_3_date": stage_3_date,
+        "stage_4_date": stage_4_date,
+        "stage_5_date": stage_5_date,
+    }
+
+
+def render_email(subject_template, body_template, params):
+    return subject_template.format(case_number=params["case_number"]), body_template.format(**params)
+
+
+def build_email(stage, invoice):
+    """
+    Jak generate_email, ale zwraca też dane do zapisu w NotificationLog zamiast gotowego HTML:
+    (subject, body_html, (template_key, version, params)). Dla nieznanego etapu ("", "", None).
+    """
+    template_key = template_key_for(stage)
+    template = MAIL_TEMPLATES.get(template_key) if template_key else None
+    if not template:
+        return ("", "", None)
+    params = email_params(invoice)
+    subject, body_html = render_email(template["subject"], template["body_html"], params)
+    version = template_version(template["subject"], template["body_html"])
+    return subject, body_html, (template_key, version, params)
+
 
-    body_html = template["body_html"].format(
-        company_name=invoice.client_company_name or "",
-        due_date=due_date_str,
-        case_number=invoice.invoice_number,
-        street_address=street_address,
-        postal_code=client_zip,
-        city=client_city,
-        nip=invoice.client_nip or "",
-        debt_amount=debt_amount,
-        stage_3_date=stage_3_date,
-        stage_4_date=stage_4_date,
-        stage_5_date=stage_5_date
-    )
-    return subject, body_html
\ No newline at end of file
+def generate_email(stage, invoice):
+    """
+    Funkcja generująca temat i treść e-maila (HTML) dla danego etapu 'stage' oraz faktury 'invoice'.
+    Zwraca krotkę: (subject, body_html).
+    """
+    subject, body_html, _ = build_email(stage, invoice)
+    return subject, body_html
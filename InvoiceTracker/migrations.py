@@ -0,0 +1,249 @@
+# migrations.py
+import argparse
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from .models import db, Case, Invoice, NotificationLog, SyncStatus, SyncLease, SyncRun, SchemaMigration, MailTemplateVersion, \
+    DashboardSummary, DashboardSummaryState, DataMigration
+from .case_progress import backfill_case_progress
+from .case_search import backfill_search_text, create_search_index
+from .notification_store import compact_notification_logs
+from .dashboard_summary import build_dashboard
+from .persistence import IN_CHUNK
+
+# Stałe blokad doradczych PostgreSQL – migracje schematu i kroki danych wykonuje tylko jedna instancja naraz
+MIGRATION_LOCK_ID = 74201801
+DATA_MIGRATION_LOCK_ID = 74201802
+
+
+def add_missing_columns(conn, models):
+    """
+    Dodaje do istniejących tabel kolumny zadeklarowane w modelach, których brakuje w bazie
+    (db.create_all() tworzy tylko brakujące tabele). Kolumny dodawane są jako NULL-owalne, bez domyślnej wartości.
+    Zwraca listę dodanych kolumn "tabela.kolumna".
+    """
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    added = []
+    for model in models:
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(column.name)} {column_type}"
+            ))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def create_missing_indexes(conn, models):
+    """
+    Tworzy indeksy zadeklarowane w modelach (index=True, __table_args__), których brakuje w bazie.
+    Zwraca listę utworzonych indeksów.
+    """
+    inspector = inspect(conn)
+    created = []
+    for model in models:
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda i: i.name):
+            if index.name in existing:
+                continue
+            index.create(bind=conn)
+            created.append(index.name)
+    return created
+
+
+def migration_0001(conn):
+    # Kolumny dodane w modelach po pierwszym wdrożeniu (uuid, remote_hash, metryki SyncStatus, run_id dzierżawy)
+    return add_missing_columns(conn, [Invoice, SyncStatus, SyncLease])
+
+
+def migration_0002(conn):
+    # Indeksy gorących zapytań: sprawy wg statusu/klienta, faktura sprawy, historia powiadomień, panel statusu
+    return create_missing_indexes(conn, [Case, Invoice, NotificationLog, SyncStatus])
+
+
+def migration_0003(conn):
+    # Postęp powiadomień na sprawie (max_stage, last_notified_at, next_notification_date); przeliczenie – krok danych
+    return add_missing_columns(conn, [Case])
+
+
+def migration_0004(conn):
+    # Kolumna wyszukiwania spraw i indeks trigramów (PostgreSQL) / FTS5 (SQLite); wypełnienie – krok danych
+    added = add_missing_columns(conn, [Case])
+    return added + create_search_index(conn)
+
+
+def migration_0005(conn):
+    # Zwarta historia powiadomień: szablon + wersja + parametry zamiast HTML; przepisanie wpisów – krok danych
+    MailTemplateVersion.__table__.create(bind=conn, checkfirst=True)
+    return add_missing_columns(conn, [NotificationLog])
+
+
+def migration_0006(conn):
+    # Podsumowanie list spraw (liczby, kwoty, etapy, wiekowanie) utrzymywane przyrostowo; zbudowanie – krok danych
+    DashboardSummary.__table__.create(bind=conn, checkfirst=True)
+    DashboardSummaryState.__table__.create(bind=conn, checkfirst=True)
+    return add_missing_columns(conn, [Case])
+
+
+def migration_0007(conn):
+    # Lista z API, do której odnosi się offset punktu kontrolnego przebiegu synchronizacji
+    return add_missing_columns(conn, [SyncRun])
+
+
+# (wersja, opis, funkcja) – nowe migracje dopisujemy na końcu listy, kolejność wersji jest stała
+MIGRATIONS = [
+    ("0001", "sync columns added after initial deploy", migration_0001),
+    ("0002", "hot lookup indexes", migration_0002),
+    ("0003", "case notification progress", migration_0003),
+    ("0004", "case search column and trigram index", migration_0004),
+    ("0005", "compact notification log bodies", migration_0005),
+    ("0006", "dashboard summary table", migration_0006),
+    ("0007", "sync run checkpoint list key", migration_0007),
+]
+
+
+# Kroki danych: wersja migracji schematu -> (opis, funkcja). Migracja planuje swój krok (wiersz data_migrations)
+# w tej samej transakcji; kroki wykonuje run_data_migrations paczkami z commit po każdej, poza startem aplikacji.
+# Funkcja przyjmuje batch_size, start_id (wznowienie) i on_batch(last_id) wywoływane przed commit paczki.
+DATA_MIGRATIONS = {
+    "0003": ("case notification progress backfill", backfill_case_progress),
+    "0004": ("case search text backfill", backfill_search_text),
+    "0005": ("notification log body compaction", compact_notification_logs),
+    "0006": ("dashboard summary build", build_dashboard),
+}
+
+
+def applied_versions():
+    return set(db.session.execute(db.select(SchemaMigration.version)).scalars())
+
+
+def pending_data_versions():
+    return list(db.session.execute(
+        db.select(DataMigration.version).where(DataMigration.completed_at.is_(None)).order_by(DataMigration.version)
+    ).scalars())
+
+
+def run_migrations():
+    """
+    Wykonuje migracje, których nie ma jeszcze w tabeli schema_migrations, każdą w osobnej transakcji
+    razem z wpisem o jej wykonaniu. Wymaga kontekstu aplikacji; wywoływana po db.create_all().
+    Migracje zmieniają tylko schemat – przepisanie danych planują w data_migrations (run_data_migrations).
+    Na nowej bazie migracje nie mają nic do zrobienia (create_all tworzy kolumny i indeksy), ale są zapisywane.
+    PostgreSQL: blokada doradcza – równolegle startujące instancje wykonują migracje po kolei.
+    Zwraca listę wykonanych wersji.
+    """
+    SchemaMigration.__table__.create(bind=db.engine, checkfirst=True)
+    DataMigration.__table__.create(bind=db.engine, checkfirst=True)
+    executed = []
+    with db.engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            conn.commit()
+        try:
+            for version, name, migrate in MIGRATIONS:
+                with conn.begin():
+                    done = conn.execute(
+                        db.select(SchemaMigration.version).where(SchemaMigration.version == version)
+                    ).first()
+                    if done:
+                        continue
+                    changes = migrate(conn)
+                    conn.execute(SchemaMigration.__table__.insert().values(
+                        version=version, name=name, applied_at=datetime.utcnow()
+                    ))
+                    if version in DATA_MIGRATIONS:
+                        conn.execute(DataMigration.__table__.insert().values(
+                            version=version, name=DATA_MIGRATIONS[version][0], last_id=0,
+                            scheduled_at=datetime.utcnow()
+                        ))
+                        changes = [*(changes or []), "zaplanowano krok danych"]
+                executed.append(version)
+                print(f"[migrations] {version} {name}: {', '.join(changes) if changes else 'bez zmian'}")
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+                conn.commit()
+    pending = pending_data_versions()
+    if pending:
+        print(f"[migrations] Oczekujące kroki danych: {', '.join(pending)} – "
+              f"uruchom python -m InvoiceTracker.migrations")
+    return executed
+
+
+def run_data_migrations(batch_size=IN_CHUNK):
+    """
+    Wykonuje zaplanowane kroki danych (DATA_MIGRATIONS) po kolei, paczkami po `batch_size` wierszy
+    z commit po każdej. Punkt wznowienia (last_id) zapisywany jest w tej samej transakcji co paczka,
+    więc przerwany krok kontynuuje od ostatniej zatwierdzonej paczki. Wymaga kontekstu aplikacji.
+    PostgreSQL: gdy kroki wykonuje już inna instancja, nic nie robi.
+    Zwraca listę zakończonych wersji.
+    """
+    completed = []
+    with db.engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": DATA_MIGRATION_LOCK_ID}).scalar()
+            conn.commit()
+            if not locked:
+                print("[migrations] Kroki danych wykonuje inna instancja – pomijam")
+                return completed
+        try:
+            for version in pending_data_versions():
+                step = db.session.get(DataMigration, version)
+                name, migrate = DATA_MIGRATIONS[version]
+                if step.last_id:
+                    print(f"[migrations] {version} {name}: wznawiam od id {step.last_id}")
+
+                def checkpoint(last_id, step=step):
+                    step.last_id = last_id
+
+                result = migrate(batch_size=batch_size, start_id=step.last_id or 0, on_batch=checkpoint)
+                step.completed_at = datetime.utcnow()
+                db.session.commit()
+                completed.append(version)
+                print(f"[migrations] {version} {name}: zakończono ({result})")
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": DATA_MIGRATION_LOCK_ID})
+                conn.commit()
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migracje schematu bazy InvoiceTracker i ich kroki danych")
+    parser.add_argument("--status", action="store_true", help="pokaż migracje wykonane i oczekujące")
+    parser.add_argument("--batch-size", type=int, default=IN_CHUNK, help="wiersze w paczce kroku danych")
+    args = parser.parse_args()
+
+    from .app import create_app
+    app = create_app(start_background_jobs=False)
+    with app.app_context():
+        db.create_all()
+        if args.status:
+            done = applied_versions()
+            pending = pending_data_versions()
+            for version, name, _ in MIGRATIONS:
+                print(f"{version} {'wykonana ' if version in done else 'oczekuje'} {name}")
+                if version in pending:
+                    print(f"     krok danych oczekuje: {DATA_MIGRATIONS[version][0]}")
+            return
+        executed = run_migrations()
+        print(f"[migrations] Wykonano {len(executed)} migracji")
+        completed = run_data_migrations(batch_size=args.batch_size)
+        print(f"[migrations] Zakończono {len(completed)} kroków danych")
+
+
+if __name__ == "__main__":
+    main()
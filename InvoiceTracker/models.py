@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import deferred
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -8,15 +9,34 @@ class Case(db.Model):
     Model Case – reprezentuje sprawę windykacyjną pojedynczej faktury.
     Numer sprawy to numer faktury.
     Status może być: "active", "closed_oplacone", "closed_nieoplacone".
+    Postęp powiadomień (uaktualniany przy zapisie NotificationLog – case_progress.log_notification):
+      - max_stage: najwyższy wysłany etap (0–5)
+      - last_notified_at: kiedy wysłano ostatnie powiadomienie
+      - next_notification_date: termin kolejnego etapu (None po ostatnim etapie)
+    search_text – znormalizowane pola wyszukiwarki list (case_search.search_text_for); indeks
+    trigramów tworzy migracja (PostgreSQL: GIN pg_trgm, SQLite: tabela FTS5).
+    summary_key, summary_debt – pod jakim kluczem (status|etap|przedział wiekowania) i z jaką kwotą
+    sprawa jest wliczona w DashboardSummary (dashboard_summary.refresh_dashboard liczy z nich różnice).
     """
+    # Listy spraw filtrują po statusie (i kliencie), widok klienta – po client_id
+    __table_args__ = (
+        db.Index('ix_case_status_client_id', 'status', 'client_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     case_number = db.Column(db.String(50), unique=True, nullable=False)
-    client_id = db.Column(db.String(50), nullable=False)
+    client_id = db.Column(db.String(50), nullable=False, index=True)
     client_nip = db.Column(db.String(50), nullable=True)
     client_company_name = db.Column(db.String(200), nullable=True)
     status = db.Column(db.String(50), default="active")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    max_stage = db.Column(db.Integer, default=0)
+    last_notified_at = db.Column(db.DateTime)
+    next_notification_date = db.Column(db.Date)
+    search_text = db.Column(db.Text)
+    summary_key = db.Column(db.String(80))
+    summary_debt = db.Column(db.BigInteger)
     
     # Relacja 1:1 – każda sprawa odpowiada jednej fakturze
     invoice = db.relationship('Invoice', backref='case', uselist=False)
@@ -30,7 +50,9 @@ class Invoice(db.Model):
     oraz dane klienta. Jest powiązany (1:1) ze sprawą windykacyjną (Case).
     """
     id = db.Column(db.Integer, primary_key=True)
-    invoice_number = db.Column(db.String(50))
+    uuid = db.Column(db.String(40))      # identyfikator faktury w API inFakt (invoices/<uuid>.json)
+    remote_hash = db.Column(db.String(32))  # odcisk pól z API (status, kwoty, termin) – wykrywanie zmian
+    invoice_number = db.Column(db.String(50), index=True)
     invoice_date = db.Column(db.Date)
     payment_due_date = db.Column(db.Date)
     gross_price = db.Column(db.Integer)  # wartość brutto w groszach
@@ -50,7 +72,7 @@ class Invoice(db.Model):
     net_price = db.Column(db.Integer)
     tax_price = db.Column(db.Integer)
     left_to_pay = db.Column(db.Integer)
-    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=True)
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=True, index=True)
 
     def __repr__(self):
         return f'<Invoice {self.invoice_number} for client {self.client_id}>'
@@ -58,14 +80,30 @@ class Invoice(db.Model):
 class NotificationLog(db.Model):
     """
     Model NotificationLog – zapisuje historię wysłanych powiadomień (e-maili).
+    Treść przechowywana jest w jednej z postaci (notification_store.render_log_body ją odtwarza):
+      - template_key, template_version, params – klucz szablonu, wersja (MailTemplateVersion)
+        i parametry podstawione do szablonu (JSON); treść renderowana przy odczycie,
+      - body – pełny HTML (tryb "html" i wpisy spoza szablonów),
+      - body_compressed – HTML skompresowany zlib (starsze wpisy po migracji 0005).
+    Kolumny treści są ładowane dopiero przy odczycie atrybutu – listy powiadomień ich nie
+    pobierają, a widok sprawy dociąga treść osobnym endpointem.
     """
+    # Historia faktury i sprawdzanie, czy etap został już wysłany (invoice_number, stage)
+    __table_args__ = (
+        db.Index('ix_notification_log_invoice_number_stage', 'invoice_number', 'stage'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
     client_id = db.Column(db.String(50))
     invoice_number = db.Column(db.String(50))
     email_to = db.Column(db.String(100))
     subject = db.Column(db.String(200))
-    body = db.Column(db.Text)
+    body = deferred(db.Column(db.Text))
+    body_compressed = deferred(db.Column(db.LargeBinary))
+    template_key = db.Column(db.String(20))
+    template_version = db.Column(db.String(16))
+    params = deferred(db.Column(db.Text))
     stage = db.Column(db.String(255))
     mode = db.Column(db.String(20))
     scheduled_date = db.Column(db.DateTime)
@@ -73,6 +111,58 @@ class NotificationLog(db.Model):
     def __repr__(self):
         return f'<NotificationLog {self.subject} to {self.email_to} at {self.sent_at}>'
 
+class MailTemplateVersion(db.Model):
+    """
+    Model MailTemplateVersion – treść szablonu e-maila (MAIL_TEMPLATES) w wersji użytej
+    przez powiadomienia; pozwala odtworzyć wysłaną treść także po zmianie szablonu.
+      - version: skrót treści szablonu (mail_utils.template_version)
+      - template_key: klucz szablonu, np. "stage_3"
+    """
+    __tablename__ = 'mail_template_version'
+
+    version = db.Column(db.String(16), primary_key=True)
+    template_key = db.Column(db.String(20), nullable=False)
+    subject = db.Column(db.Text, nullable=False)
+    body_html = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<MailTemplateVersion {self.template_key} {self.version}>'
+
+class DashboardSummary(db.Model):
+    """
+    Model DashboardSummary – podsumowanie spraw dla nagłówków list (dashboard_summary):
+    liczba spraw i pozostała kwota (grosze) na każdy klucz (status, etap, przedział wiekowania).
+    Utrzymywane przyrostowo przy zapisie spraw, faktur i powiadomień; wiersze liczone
+    względem daty DashboardSummaryState.as_of.
+      - aging_bucket: indeks przedziału dni po terminie (dashboard_summary.AGING_BUCKETS), -1 – brak terminu
+    """
+    __tablename__ = 'dashboard_summary'
+
+    status = db.Column(db.String(50), primary_key=True)
+    max_stage = db.Column(db.Integer, primary_key=True)
+    aging_bucket = db.Column(db.Integer, primary_key=True)
+    case_count = db.Column(db.Integer, nullable=False, default=0)
+    debt = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<DashboardSummary {self.status}/{self.max_stage}/{self.aging_bucket}: {self.case_count}>'
+
+class DashboardSummaryState(db.Model):
+    """
+    Model DashboardSummaryState – jeden wiersz (id=1): dzień, względem którego policzone są
+    przedziały wiekowania w DashboardSummary (as_of), i czas ostatniej pełnej przebudowy
+    (rebuilt_at; None – podsumowanie budowane paczkami, jeszcze niekompletne).
+    """
+    __tablename__ = 'dashboard_summary_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    as_of = db.Column(db.Date, nullable=False)
+    rebuilt_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<DashboardSummaryState as_of={self.as_of}>'
+
 class SyncStatus(db.Model):
     """
     Model SyncStatus – rejestruje informacje o przebiegu synchronizacji:
@@ -80,12 +170,177 @@ class SyncStatus(db.Model):
       - processed: liczba przetworzonych faktur
       - timestamp: data wykonania synchronizacji
       - duration: czas trwania operacji (w sekundach)
+      - pages_skipped: strony listy faktur pominięte dzięki wcześniejszemu zakończeniu stronicowania
+      - new_count / updated_count / unchanged_count: nowe, zaktualizowane i pominięte
+        (bez zmian w API – ten sam remote_hash) faktury
+      - closed_count: sprawy zamknięte w tym przebiegu
+      - api_calls, api_throttled, bytes_downloaded: zapytania do API, odpowiedzi 429, pobrane bajty
+        (przybliżone – przyrost liczników całego procesu w czasie przebiegu)
+      - pages_fetched: pobrane strony listy faktur
+      - db_statements, db_commits: zapytania SQL i commity wątku, który wykonał przebieg
+      - list/detail/client/persist_seconds: łączny czas etapów (lista faktur, szczegóły faktur,
+        dane klientów, zapis do bazy) – etapy potoku mogą się nakładać
     """
     id = db.Column(db.Integer, primary_key=True)
     sync_type = db.Column(db.String(50))
     processed = db.Column(db.Integer)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     duration = db.Column(db.Float)
+    pages_skipped = db.Column(db.Integer, default=0)
+    new_count = db.Column(db.Integer, default=0)
+    updated_count = db.Column(db.Integer, default=0)
+    unchanged_count = db.Column(db.Integer, default=0)
+    closed_count = db.Column(db.Integer, default=0)
+    api_calls = db.Column(db.Integer, default=0)
+    api_throttled = db.Column(db.Integer, default=0)
+    bytes_downloaded = db.Column(db.BigInteger, default=0)
+    pages_fetched = db.Column(db.Integer, default=0)
+    db_statements = db.Column(db.Integer, default=0)
+    db_commits = db.Column(db.Integer, default=0)
+    list_seconds = db.Column(db.Float, default=0)
+    detail_seconds = db.Column(db.Float, default=0)
+    client_seconds = db.Column(db.Float, default=0)
+    persist_seconds = db.Column(db.Float, default=0)
+
+    def __repr__(self):
+        return f'<SyncStatus {self.sync_type}: {self.processed} faktur, {self.duration:.2f}s>'
+
+class ClientCache(db.Model):
+    """
+    Model ClientCache – trwała pamięć podręczna danych klientów z API inFakt:
+      - client_id: identyfikator klienta w inFakt
+      - data: odpowiedź API (JSON) z danymi klienta
+      - fetched_at: moment pobrania danych (do wyliczania TTL)
+    """
+    client_id = db.Column(db.String(50), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ClientCache {self.client_id} z {self.fetched_at}>'
+
+class SyncWatermark(db.Model):
+    """
+    Model SyncWatermark – znacznik postępu synchronizacji przyrostowej (osobny dla każdego typu):
+      - sync_type: typ synchronizacji (np. "update")
+      - last_value: najpóźniejszy czas modyfikacji faktury (updated_at z inFakt) widziany w API
+      - last_full_sync: kiedy ostatnio wykonano pełną rekoncyliację (bez filtra)
+    """
+    sync_type = db.Column(db.String(50), primary_key=True)
+    last_value = db.Column(db.String(50))
+    last_full_sync = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SyncWatermark {self.sync_type}: {self.last_value}>'
+
+class SyncLease(db.Model):
+    """
+    Model SyncLease – dzierżawa zakresu offsetów synchronizacji (shardu /sync_db_batch)
+    lub blokada zadania (np. "job:sync" – jedna synchronizacja naraz):
+      - shard: klucz zakresu, np. "0:100" (offset:limit), lub nazwa blokady
+      - owner: identyfikator instancji, która aktualnie przetwarza zakres
+      - expires_at: koniec ważności dzierżawy – potem zakres może przejąć inna instancja
+      - acquired_at: kiedy dzierżawa została ostatnio przejęta
+      - run_id: przebieg (SyncRun) wykonywany pod dzierżawą – dla blokady "job:sync"
+    """
+    shard = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(200))
+    expires_at = db.Column(db.DateTime)
+    acquired_at = db.Column(db.DateTime)
+    run_id = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f'<SyncLease {self.shard} -> {self.owner} do {self.expires_at}>'
+
+class SyncRun(db.Model):
+    """
+    Model SyncRun – punkt kontrolny pełnej synchronizacji uruchamianej z /manual_sync,
+    zapisywany razem z każdą zatwierdzoną stroną:
+      - status: "running", "completed" lub "failed"
+      - phase: bieżący etap ("new", "update", "enrich")
+      - offset: pozycja w etapie (offset listy faktur; w etapie "enrich" – ostatnie id faktury)
+      - list_key: lista z API, do której odnosi się offset (np. "new:2024-05-20" – filtr terminu płatności,
+        "update:full" / "update:incremental:<znacznik>"); offset innej listy nie jest wznawiany
+      - new_count, updated_count, enriched_count: liczniki zatwierdzonych zmian
+      - heartbeat_at: ostatni zapis punktu kontrolnego (przebieg bez heartbeat uznajemy za przerwany)
+    Przerwany przebieg jest wznawiany od ostatniego punktu kontrolnego.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), default="running", nullable=False)
+    phase = db.Column(db.String(20), default="new", nullable=False)
+    offset = db.Column(db.Integer, default=0, nullable=False)
+    list_key = db.Column(db.String(100))
+    new_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_count = db.Column(db.Integer, default=0, nullable=False)
+    enriched_count = db.Column(db.Integer, default=0, nullable=False)
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def checkpoint(self, phase, offset, **counts):
+        """
+        Ustawia pozycję i liczniki przebiegu. Nie wykonuje commit – punkt kontrolny
+        zapisuje się w tej samej transakcji co strona, której dotyczy.
+        """
+        self.phase = phase
+        self.offset = offset
+        for name, value in counts.items():
+            setattr(self, name, value)
+        self.heartbeat_at = datetime.utcnow()
+
+    def align_offset(self, list_key, offset):
+        """
+        Offset wznawianego etapu dla listy list_key. Jeśli punkt kontrolny dotyczy innej listy
+        (wznowienie innego dnia, zmiana trybu lub znacznika), etap zaczyna się od 0.
+        Nie wykonuje commit. Zwraca offset, od którego należy zacząć.
+        """
+        if self.list_key != list_key:
+            self.list_key = list_key
+            self.offset = offset = 0
+        return offset
+
+    def fail(self, error):
+        self.status = "failed"
+        self.error = str(error)
+        self.heartbeat_at = datetime.utcnow()
+
+    def __repr__(self):
+        return f'<SyncRun {self.id} {self.status}: {self.phase}@{self.offset}>'
+
+class SchemaMigration(db.Model):
+    """
+    Model SchemaMigration – migracje schematu wykonane na bazie (moduł migrations):
+      - version: numer migracji, np. "0002"
+      - name: krótki opis migracji
+      - applied_at: kiedy migracja została wykonana
+    """
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(db.String(20), primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<SchemaMigration {self.version} {self.name}>'
+
+class DataMigration(db.Model):
+    """
+    Model DataMigration – przepisanie danych zaplanowane przez migrację schematu (moduł migrations),
+    wykonywane paczkami poza startem aplikacji:
+      - version: numer migracji schematu, która je zaplanowała
+      - name: krótki opis
+      - last_id: id ostatniego przetworzonego wiersza (punkt wznowienia, zapisywany z każdą paczką)
+      - scheduled_at, completed_at: kiedy zaplanowane i kiedy zakończone (None – oczekuje)
+    """
+    __tablename__ = 'data_migrations'
+
+    version = db.Column(db.String(20), primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    last_id = db.Column(db.Integer, default=0, nullable=False)
+    scheduled_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    completed_at = db.Column(db.DateTime)
 
     def __repr__(self):
-        return f'<SyncStatus {self.sync_type}: {self.processed} faktur, {self.duration:.2f}s>'
\ No newline at end of file
+        return f'<DataMigration {self.version} {self.name} @{self.last_id}>'
@@ -0,0 +1,218 @@
+# notification_store.py
+import argparse
+import json
+import zlib
+
+from sqlalchemy import select, event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from .models import db, Invoice, NotificationLog, MailTemplateVersion
+from .mail_templates import MAIL_TEMPLATES
+from .mail_utils import template_key_for, template_version, email_params, render_email
+from .persistence import update_rows, IN_CHUNK
+from .shipping_settings import NOTIFICATION_LOG_CONFIG
+
+# Wersje szablonów zapisane już w bazie (url silnika -> zbiór wersji) – sprawdzane raz na proces
+_stored_versions = {}
+# Klucz Session.info: wersje zapisane w bieżącej transakcji sesji, trafiają do _stored_versions po commit
+_PENDING_VERSIONS = "notification_store.pending_versions"
+# Treść szablonu dla wersji (wersja -> (subject, body_html)) – wersja się nie zmienia
+_template_sources = {}
+
+
+def _executor(bind):
+    return bind if bind is not None else db.session
+
+
+def current_templates():
+    """
+    Bieżące szablony z MAIL_TEMPLATES: klucz -> (wersja, subject, body_html).
+    """
+    return {key: (template_version(t["subject"], t["body_html"]), t["subject"], t["body_html"])
+            for key, t in MAIL_TEMPLATES.items()}
+
+
+def remember_template(template_key, version, bind=None):
+    """
+    Zapisuje w mail_template_version bieżącą treść szablonu `template_key` w wersji `version`,
+    jeśli jej tam jeszcze nie ma. Nie wykonuje commit. Przy zapisie przez db.session wersja
+    jest zapamiętywana w procesie dopiero po commit sesji (po wycofaniu – sprawdzana ponownie);
+    przy zapisie przez połączenie `bind` nie jest zapamiętywana.
+    """
+    executor = _executor(bind)
+    engine_bind = bind.engine if bind is not None else db.session.get_bind()
+    known = _stored_versions.setdefault(str(engine_bind.url), set())
+    if version in known:
+        return
+    exists = executor.execute(
+        select(MailTemplateVersion.version).where(MailTemplateVersion.version == version)
+    ).first()
+    if not exists:
+        template = MAIL_TEMPLATES[template_key]
+        row = {"version": version, "template_key": template_key,
+               "subject": template["subject"], "body_html": template["body_html"]}
+        if engine_bind.dialect.name == "postgresql":
+            # Równoległe instancje mogą zapisywać tę samą wersję
+            executor.execute(pg_insert(MailTemplateVersion.__table__).values(row)
+                             .on_conflict_do_nothing(index_elements=["version"]))
+        else:
+            executor.execute(MailTemplateVersion.__table__.insert().values(row))
+    if bind is None:
+        db.session.info.setdefault(_PENDING_VERSIONS, set()).add((str(engine_bind.url), version))
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_committed(session):
+    for url, version in session.info.pop(_PENDING_VERSIONS, ()):
+        _stored_versions.setdefault(url, set()).add(version)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session, previous_transaction):
+    # Także wycofany savepoint – wersje z transakcji zostaną sprawdzone w bazie jeszcze raz
+    session.info.pop(_PENDING_VERSIONS, None)
+
+
+def storage_fields(body, template=None, bind=None):
+    """
+    Kolumny treści nowego wpisu NotificationLog. template – (klucz, wersja, parametry)
+    z mail_utils.build_email; w trybie "template" zapisujemy je zamiast HTML (body = None).
+    Bez szablonu albo w trybie "html" – pełna treść w body.
+    """
+    fields = {"body": body, "body_compressed": None, "template_key": None,
+              "template_version": None, "params": None}
+    if template and NOTIFICATION_LOG_CONFIG.get("storage") == "template":
+        template_key, version, params = template
+        remember_template(template_key, version, bind=bind)
+        fields.update(body=None, template_key=template_key, template_version=version,
+                      params=json.dumps(params, ensure_ascii=False, sort_keys=True))
+    return fields
+
+
+def template_source(version):
+    """
+    (subject, body_html) szablonu w danej wersji – z mail_template_version,
+    a gdy wpisu brak, z bieżących MAIL_TEMPLATES o tej samej wersji. None, gdy nieznana.
+    """
+    if version not in _template_sources:
+        row = db.session.execute(
+            select(MailTemplateVersion.subject, MailTemplateVersion.body_html)
+            .where(MailTemplateVersion.version == version)
+        ).first()
+        if row is None:
+            current = {v: (subject, body) for v, subject, body in current_templates().values()}
+            if version not in current:
+                return None
+            _template_sources[version] = current[version]
+        else:
+            _template_sources[version] = (row.subject, row.body_html)
+    return _template_sources[version]
+
+
+def render_log_body(row):
+    """
+    Treść HTML wpisu NotificationLog (obiekt albo wiersz z kolumnami body, body_compressed,
+    template_version, params) – zapisana, rozpakowana albo wyrenderowana z szablonu.
+    """
+    if row.body is not None:
+        return row.body
+    if row.body_compressed is not None:
+        return zlib.decompress(row.body_compressed).decode("utf-8")
+    if row.template_version and row.params:
+        source = template_source(row.template_version)
+        if source is None:
+            return ""
+        return render_email(source[0], source[1], json.loads(row.params))[1]
+    return ""
+
+
+def compact_notification_logs(bind=None, batch_size=IN_CHUNK, start_id=0, on_batch=None):
+    """
+    Przepisuje wpisy NotificationLog z pełną treścią (body) na postać zwartą, paczkami po id:
+      - jeśli bieżący szablon etapu z parametrami faktury daje dokładnie zapisaną treść –
+        zapisujemy klucz, wersję i parametry,
+      - w przeciwnym razie (faktura zmieniona po wysyłce, starszy szablon, wpis spoza szablonów)
+        treść jest kompresowana (zlib) do body_compressed.
+    bind – połączenie; domyślnie db.session z commit po każdej paczce.
+    start_id – wznowienie od wpisów o id większym; on_batch(last_id) – wywoływane przed commit paczki.
+    Zwraca statystyki: liczby wpisów i bajty treści przed i po.
+    """
+    executor = _executor(bind)
+    templates = current_templates()
+    remembered = set()
+    stats = {"templated": 0, "compressed": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = start_id
+    while True:
+        logs = executor.execute(
+            select(NotificationLog.id, NotificationLog.invoice_number, NotificationLog.stage,
+                   NotificationLog.body)
+            .where(NotificationLog.id > last_id, NotificationLog.body.isnot(None))
+            .order_by(NotificationLog.id)
+            .limit(batch_size)
+        ).all()
+        if not logs:
+            break
+        last_id = logs[-1].id
+
+        invoices = {inv.invoice_number: inv for inv in executor.execute(
+            select(Invoice.invoice_number, Invoice.client_company_name, Invoice.payment_due_date,
+                   Invoice.client_address, Invoice.client_nip, Invoice.gross_price)
+            .where(Invoice.invoice_number.in_({log.invoice_number for log in logs}))
+        )}
+
+        rows = []
+        for log_id, invoice_number, stage, body in logs:
+            stats["bytes_before"] += len(body.encode("utf-8"))
+            row = {"id": log_id, "body": None, "body_compressed": None, "template_key": None,
+                   "template_version": None, "params": None}
+            template_key = template_key_for(stage or "")
+            invoice = invoices.get(invoice_number)
+            params = email_params(invoice) if invoice is not None and invoice.gross_price is not None else None
+            if template_key in templates and params is not None:
+                version, subject_template, body_template = templates[template_key]
+                if render_email(subject_template, body_template, params)[1] == body:
+                    if version not in remembered:
+                        remember_template(template_key, version, bind=bind)
+                        remembered.add(version)
+                    row.update(template_key=template_key, template_version=version,
+                               params=json.dumps(params, ensure_ascii=False, sort_keys=True))
+                    stats["templated"] += 1
+                    stats["bytes_after"] += len(row["params"].encode("utf-8"))
+            if row["params"] is None:
+                row["body_compressed"] = zlib.compress(body.encode("utf-8"), 9)
+                stats["compressed"] += 1
+                stats["bytes_after"] += len(row["body_compressed"])
+            rows.append(row)
+        update_rows(NotificationLog, rows, "id", bind=bind)
+        if on_batch is not None:
+            on_batch(last_id)
+        if bind is None:
+            db.session.commit()
+
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    print(f"[notification_store] Szablon+parametry: {stats['templated']}, skompresowane: {stats['compressed']}; "
+          f"treść {stats['bytes_before'] / 1e6:.1f} MB -> {stats['bytes_after'] / 1e6:.1f} MB "
+          f"(odzyskano {saved / 1e6:.1f} MB, miejsce na dysku zwalnia VACUUM)")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Przepisanie treści NotificationLog na szablon + parametry (albo kompresję zlib)"
+    )
+    parser.add_argument("--batch-size", type=int, default=IN_CHUNK)
+    args = parser.parse_args()
+
+    from .app import create_app
+    from .migrations import run_migrations
+    app = create_app(start_background_jobs=False)
+    with app.app_context():
+        # Kolumny dodaje migracja 0005 (pierwsze przepisanie wpisów – jej krok danych)
+        db.create_all()
+        run_migrations()
+        compact_notification_logs(batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
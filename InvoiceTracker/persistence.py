@@ -0,0 +1,123 @@
+# persistence.py
+from sqlalchemy import select, bindparam, literal_column
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .models import db, Case, Invoice
+
+# Maksymalna liczba wartości w jednym warunku IN (...)
+IN_CHUNK = 500
+
+
+def is_postgres():
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def existing_keys(model, key, values):
+    """
+    Zwraca zbiór wartości kolumny `key`, które już istnieją w tabeli modelu
+    (jedno zapytanie IN (...) na każde IN_CHUNK wartości).
+    """
+    column = model.__table__.c[key]
+    values = list(values)
+    found = set()
+    for i in range(0, len(values), IN_CHUNK):
+        found.update(db.session.execute(select(column).where(column.in_(values[i:i + IN_CHUNK]))).scalars())
+    return found
+
+
+def upsert_rows(model, rows, key, update_columns=()):
+    """
+    Zapisuje stronę wierszy (lista słowników o jednakowych kluczach) w ramach bieżącej transakcji.
+    PostgreSQL: jedno INSERT ... ON CONFLICT (key) DO NOTHING / DO UPDATE SET update_columns.
+    Inne bazy (SQLite): SELECT istniejących kluczy, INSERT nowych i UPDATE istniejących (executemany).
+    Nie wykonuje commit. Zwraca zbiór kluczy nowo wstawionych wierszy.
+    """
+    # Duplikaty klucza w jednej stronie – wygrywa ostatni wiersz
+    rows = list({row[key]: row for row in rows}.values())
+    if not rows:
+        return set()
+    table = model.__table__
+
+    if is_postgres():
+        stmt = pg_insert(table).values(rows)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[key],
+                set_={column: stmt.excluded[column] for column in update_columns}
+            )
+            # xmax = 0 oznacza wiersz wstawiony (a nie zaktualizowany) przez to zapytanie
+            stmt = stmt.returning(table.c[key], literal_column("xmax = 0"))
+            return {value for value, inserted in db.session.execute(stmt) if inserted}
+        stmt = stmt.on_conflict_do_nothing(index_elements=[key]).returning(table.c[key])
+        return set(db.session.execute(stmt).scalars())
+
+    existing = existing_keys(model, key, [row[key] for row in rows])
+    new_rows = [row for row in rows if row[key] not in existing]
+    if new_rows:
+        db.session.execute(table.insert(), new_rows)
+    if update_columns:
+        update_rows(model, [row for row in rows if row[key] in existing], key, update_columns)
+    return {row[key] for row in new_rows}
+
+
+def update_rows(model, rows, key, columns=None, bind=None):
+    """
+    Aktualizuje wiersze wskazane kluczem `key` jednym UPDATE ... WHERE key = ? (executemany).
+    Wiersze, których nie ma w bazie, są pomijane przez bazę. Nie wykonuje commit.
+    bind – połączenie zamiast db.session (np. w migracji).
+    """
+    if not rows:
+        return
+    table = model.__table__
+    columns = list(columns or [column for column in rows[0] if column != key])
+    stmt = (table.update()
+            .where(table.c[key] == bindparam('_key'))
+            .values({column: bindparam(f'_v_{column}') for column in columns}))
+    params = [{'_key': row[key], **{f'_v_{column}': row[column] for column in columns}} for row in rows]
+    (bind if bind is not None else db.session).execute(stmt, params)
+
+
+def load_rows_by_key(model, key, values):
+    """
+    Wczytuje obiekty modelu o podanych wartościach klucza (IN (...) w paczkach)
+    i zwraca słownik wartość_klucza -> obiekt. Zastępuje zapytania filter_by() per wiersz.
+    """
+    column = getattr(model, key)
+    values = list(values)
+    rows = {}
+    for i in range(0, len(values), IN_CHUNK):
+        for obj in model.query.filter(column.in_(values[i:i + IN_CHUNK])).all():
+            rows[getattr(obj, key)] = obj
+    return rows
+
+
+class PageIndex:
+    """
+    Indeks lokalnych danych dla jednej strony synchronizacji, ładowany
+    jednym zapytaniem IN (...) na tabelę:
+      - invoice_hashes: id faktury istniejącej w bazie -> remote_hash,
+      - invoice_ids: identyfikatory faktur istniejących w bazie,
+      - cases: case_number -> (id sprawy, status).
+    Na jego podstawie podejmowane są decyzje "pomiń istniejącą" i "zamknij sprawę"
+    bez zapytań o pojedyncze wiersze.
+    """
+    def __init__(self, invoice_hashes, cases):
+        self.invoice_hashes = invoice_hashes
+        self.invoice_ids = set(invoice_hashes)
+        self.cases = cases
+
+    @classmethod
+    def load(cls, invoice_ids=(), case_numbers=()):
+        invoice_ids = list(invoice_ids)
+        invoice_hashes = {}
+        for i in range(0, len(invoice_ids), IN_CHUNK):
+            query = select(Invoice.id, Invoice.remote_hash).where(Invoice.id.in_(invoice_ids[i:i + IN_CHUNK]))
+            invoice_hashes.update(db.session.execute(query).all())
+        case_numbers = list(case_numbers)
+        cases = {}
+        for i in range(0, len(case_numbers), IN_CHUNK):
+            query = select(Case.case_number, Case.id, Case.status).where(
+                Case.case_number.in_(case_numbers[i:i + IN_CHUNK]))
+            for number, case_id, status in db.session.execute(query):
+                cases[number] = (case_id, status)
+        return cls(invoice_hashes, cases)
@@ -0,0 +1,73 @@
+# refresh_planner.py
+import asyncio
+from datetime import datetime, date, timedelta
+
+from .models import db, Invoice, Case, SyncStatus
+from .shipping_settings import REFRESH_THRESHOLDS
+from .src.api.api_client import AsyncInFaktAPIClient
+from .update_db import apply_remote_invoice, case_status_for
+from .sync_metrics import SyncMetrics, timed
+from .dashboard_summary import refresh_dashboard
+
+
+def plan_refresh(today=None):
+    """
+    Wybiera aktywne sprawy, które dziś przypadają na jeden z dni REFRESH_THRESHOLDS
+    (liczba dni od terminu płatności) – czyli te, które wkrótce dostaną kolejne powiadomienie.
+    Zwraca listę krotek (Invoice, Case).
+    """
+    today = today or date.today()
+    due_dates = [today - timedelta(days=days) for days in REFRESH_THRESHOLDS]
+    return (db.session.query(Invoice, Case)
+            .join(Case, Invoice.case_id == Case.id)
+            .filter(Case.status == "active", Invoice.payment_due_date.in_(due_dates))
+            .all())
+
+
+async def fetch_planned_details(invoice_uuids, max_in_flight=None):
+    async with AsyncInFaktAPIClient(max_in_flight=max_in_flight) as api:
+        return await api.get_invoices_details(invoice_uuids)
+
+
+def refresh_due_cases(today=None, max_in_flight=None):
+    """
+    Odświeża z API tylko faktury wybrane przez plan_refresh (pobieranie po UUID,
+    z ograniczoną liczbą równoległych zapytań), aktualizuje je i zamyka opłacone sprawy.
+    Liczba zapytań rośnie więc z liczbą wysyłanych powiadomień, a nie wszystkich faktur.
+    Zwraca liczbę odświeżonych faktur.
+    """
+    start_time = datetime.utcnow()
+    metrics = SyncMetrics.start()
+    try:
+        planned = plan_refresh(today)
+        with_uuid = [(inv, case_obj) for inv, case_obj in planned if inv.uuid]
+        if len(with_uuid) < len(planned):
+            print(f"[refresh_planner] Pominięto {len(planned) - len(with_uuid)} faktur bez UUID "
+                  f"(zostaną uzupełnione przy najbliższej synchronizacji)")
+
+        details_map = {}
+        if with_uuid:
+            with timed("detail"):
+                details_map = asyncio.run(fetch_planned_details([inv.uuid for inv, _ in with_uuid], max_in_flight))
+
+        refreshed = 0
+        closed = 0
+        for inv, case_obj in with_uuid:
+            det = details_map.get(inv.uuid)
+            if not det:
+                continue
+            apply_remote_invoice(inv, det, tag="refresh_planner")
+            case_obj.status = case_status_for(inv)
+            if case_obj.status != "active":
+                closed += 1
+            refreshed += 1
+        refresh_dashboard([case_obj.id for _, case_obj in with_uuid])
+
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        db.session.add(metrics.apply(SyncStatus(sync_type="refresh", processed=refreshed, duration=duration,
+                                                updated_count=refreshed, closed_count=closed)))
+        db.session.commit()
+        print(f"[refresh_planner] Zaplanowano {len(planned)}, odświeżono {refreshed}, zamknięto {closed} spraw w {duration:.2f}s")
+        return refreshed
+    finally:
+        metrics.stop()
@@ -2,6 +2,7 @@
 from datetime import datetime, timedelta, date
 import time
 from apscheduler.schedulers.background import BackgroundScheduler
+from sqlalchemy.orm import contains_eager
 from dotenv import load_dotenv
 
 # Usunięto import do update_database:
@@ -11,27 +12,26 @@ from .models import db, Invoice, NotificationLog, Case
 from .shipping_settings import NOTIFICATION_OFFSETS
 from .mail_templates import MAIL_TEMPLATES
 from .send_email import send_email
-from .mail_utils import generate_email
+from .mail_utils import build_email
+from .refresh_planner import refresh_due_cases
+from .job_runner import run_exclusive
+from .case_progress import log_notification, FINAL_STAGE
+from .dashboard_summary import refresh_dashboard, roll_dashboard
 
 load_dotenv()
 
-def stage_to_number(text):
-    mapping = {
-        "Przypomnienie o zbliżającym się terminie płatności": 1,
-        "Powiadomienie o upływie terminu płatności": 2,
-        "Wezwanie do zapłaty": 3,
-        "Powiadomienie o zamiarze skierowania sprawy do windykatora zewnętrznego i publikacji na giełdzie wierzytelności": 4,
-        "Przekazanie sprawy do windykatora zewnętrznego": 5
-    }
-    return mapping.get(text, 0)
-
 def run_sync_with_context(app):
     """
-    Usuwamy starą funkcję update_database, więc nic tu nie robimy,
-    albo usuwamy tę funkcję całkowicie z harmonogramu.
+    Przed wysyłką maili odświeża z API tylko te aktywne sprawy,
+    które przypadają na dzień z REFRESH_THRESHOLDS (refresh_planner).
     """
     with app.app_context():
-        print("[scheduler] run_sync_with_context() – brak starej logiki")
+        print("[scheduler] Odświeżanie spraw przed wysyłką powiadomień")
+        try:
+            # Pod wspólną blokadą – nie nakłada się na synchronizację ręczną ani z crona
+            run_exclusive(app, "refresh_due_cases", refresh_due_cases)
+        except Exception as e:
+            print(f"[scheduler] Błąd odświeżania spraw: {e}")
 
 def run_mail_with_context(app):
     """
@@ -47,6 +47,7 @@ def run_mail_with_context(app):
         while True:
             active_invoices = (Invoice.query.join(Case, Invoice.case_id == Case.id)
                                .filter(Case.status == "active")
+                               .options(contains_eager(Invoice.case))
                                .order_by(Invoice.invoice_date.desc())
                                .offset(offset)
                                .limit(batch_size)
@@ -68,7 +69,7 @@ def run_mail_with_context(app):
                         if existing_log:
                             continue
 
-                        subject, body_html = generate_email(stage_name, inv)
+                        subject, body_html, template = build_email(stage_name, inv)
                         if not subject or not body_html:
                             print(f"[scheduler] Brak szablonu dla {stage_name}, pomijam.")
                             continue
@@ -84,27 +85,19 @@ def run_mail_with_context(app):
                                     print(f"[scheduler] Błąd wysyłki maila do {email} (próba {attempt+1}): {e}")
                                     time.sleep(5)
 
-                        new_log = NotificationLog(
-                            client_id=inv.client_id,
-                            invoice_number=inv.invoice_number,
-                            email_to=inv.client_email,
-                            subject=subject,
-                            body=body_html,
-                            stage=stage_name,
-                            mode="Automatyczne"
-                        )
-                        db.session.add(new_log)
+                        log_notification(inv.case, inv, stage_name, subject, body_html, mode="Automatyczne",
+                                         template=template)
+                        refresh_dashboard([inv.case.id])
                         db.session.commit()
                         print(f"[scheduler] Wysłano mail dla {inv.invoice_number}, etap={stage_name}")
 
-                # Jeśli wysłano etap 5 => zamykamy sprawę
-                logs = NotificationLog.query.filter_by(invoice_number=inv.invoice_number).all()
-                stage5_sent = any(log.stage == "Przekazanie sprawy do windykatora zewnętrznego" for log in logs)
-                if stage5_sent:
-                    case_obj = Case.query.filter_by(case_number=inv.invoice_number).first()
-                    if case_obj and case_obj.status != "closed_oplacone":
+                # Jeśli wysłano etap 5 => zamykamy sprawę (etap zapisany na sprawie – bez przeglądania logów)
+                case_obj = inv.case
+                if case_obj and (case_obj.max_stage or 0) >= FINAL_STAGE:
+                    if case_obj.status != "closed_oplacone":
                         case_obj.status = "closed_oplacone"
                         db.session.add(case_obj)
+                        refresh_dashboard([case_obj.id])
                         db.session.commit()
                         print(f"[scheduler] Zamknięto sprawę {inv.invoice_number} (wysłano etap 5)")
 
@@ -112,14 +105,27 @@ def run_mail_with_context(app):
 
         print("[scheduler] Zakończono automatyczną wysyłkę maili")
 
+def run_dashboard_rollover_with_context(app):
+    """
+    Po północy przesuwa dzień podsumowania list (przedziały wiekowania spraw),
+    żeby nie robiło tego pierwsze wyświetlenie listy.
+    """
+    with app.app_context():
+        try:
+            roll_dashboard()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[scheduler] Błąd przesunięcia podsumowania spraw: {e}")
+
 def start_scheduler(app):
     """
     Inicjuje scheduler.
-    - run_sync_with_context() jest teraz pusty albo do usunięcia, 
-      bo nie mamy update_database.
+    - run_dashboard_rollover_with_context() przesuwa dzień podsumowania list.
+    - run_sync_with_context() odświeża sprawy zbliżające się do kolejnego powiadomienia.
     - run_mail_with_context() wysyła powiadomienia.
     """
     scheduler = BackgroundScheduler()
+    scheduler.add_job(lambda: run_dashboard_rollover_with_context(app), 'cron', hour=0, minute=5)
     scheduler.add_job(lambda: run_sync_with_context(app), 'cron', hour=16, minute=55)
     scheduler.add_job(lambda: run_mail_with_context(app), 'cron', hour=17, minute=0)
     scheduler.start()
@@ -13,7 +13,33 @@ NOTIFICATION_OFFSETS = {
 REFRESH_THRESHOLDS = [-2, 6, 13, 20, 29]
 
 # Konfiguracja synchronizacji – używana przez endpoint /manual_sync
+# full_reconcile_hours – co ile godzin aktualizacja przyrostowa (tylko faktury zmienione
+# od ostatniego znacznika) jest zastępowana pełnym przejściem po wszystkich fakturach.
+# lease_seconds – ważność dzierżawy shardu /sync_db_batch (po awarii instancji zakres
+# może przejąć inna instancja po tym czasie).
 SYNC_CONFIG = {
     "sync_offset": 0,
-    "sync_limit": 100
-}
\ No newline at end of file
+    "sync_limit": 100,
+    "full_reconcile_hours": 168,
+    "lease_seconds": 900,
+    # Przebieg bez zapisu punktu kontrolnego dłużej niż tyle minut uznajemy za przerwany (do wznowienia)
+    "run_stale_minutes": 15
+}
+
+# Pamięć podręczna danych klientów (client_cache.py):
+# ttl_hours – po ilu godzinach dane klienta są pobierane ponownie z API,
+# max_size – liczba klientów trzymanych w pamięci procesu (LRU),
+# directory_threshold – od ilu brakujących klientów pobieramy cały katalog (clients.json)
+# zamiast pytać o każdego klienta osobno.
+CLIENT_CACHE_CONFIG = {
+    "ttl_hours": 24,
+    "max_size": 2000,
+    "directory_threshold": 20
+}
+
+# Zapis treści powiadomień w NotificationLog (notification_store.py):
+# storage – "template": klucz szablonu, wersja i parametry (treść renderowana przy podglądzie),
+#           "html": pełna treść HTML w każdym wpisie (jak wcześniej).
+NOTIFICATION_LOG_CONFIG = {
+    "storage": "template"
+}
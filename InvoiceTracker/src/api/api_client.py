@@ -1,25 +1,183 @@
 # src/api/api_client.py
 import os
+import time
+import asyncio
+import threading
 import requests
+import aiohttp
 import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 # Wczytanie zmiennych środowiskowych z pliku .env
 load_dotenv()
 
+# Budżety zapytań w formacie "liczba/okno_w_sekundach", rozdzielone przecinkami,
+# np. "100/60,3000/3600" – 100 zapytań na minutę i 3000 na godzinę.
+DEFAULT_RATE_LIMITS = "100/60"
+DEFAULT_MAX_RETRIES = 5
+# Maksymalna liczba równoległych zapytań klienta asynchronicznego
+DEFAULT_MAX_IN_FLIGHT = 10
+# Adres API; INFAKT_API_URL pozwala wskazać np. lokalny serwer zastępczy (benchmarks.stand_in_server)
+DEFAULT_API_URL = "https://api.infakt.pl/api/v3"
+
+
+def parse_rate_limits(spec):
+    """
+    Zamienia tekst "100/60,3000/3600" na listę krotek (liczba_zapytań, okno_s).
+    """
+    budgets = []
+    for part in (spec or "").split(','):
+        part = part.strip()
+        if not part:
+            continue
+        count, window = part.split('/')
+        budgets.append((int(count), float(window)))
+    return budgets
+
+
+def parse_retry_after(value):
+    """
+    Zwraca liczbę sekund z nagłówka Retry-After (liczba sekund lub data HTTP).
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
+def backoff_delay(headers, attempt):
+    """
+    Czas oczekiwania po odpowiedzi 429: Retry-After, a gdy go brak – 2^attempt sekund.
+    """
+    retry_after = parse_retry_after(headers.get('Retry-After'))
+    return retry_after if retry_after is not None else float(2 ** attempt)
+
+
+def load_api_settings():
+    """
+    Wczytuje klucz API i adres API (INFAKT_API_URL) ze zmiennych środowiskowych
+    i zwraca (base_url, headers).
+    """
+    api_key = os.getenv('INFAKT_API_KEY')
+    if not api_key or api_key == "YOUR_INFAKT_API_KEY":
+        raise ValueError("Klucz API inFakt nie został ustawiony. Sprawdź plik .env!")
+    headers = {
+        'X-inFakt-ApiKey': api_key,
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+    }
+    base_url = os.getenv('INFAKT_API_URL', DEFAULT_API_URL).rstrip('/')
+    return base_url, headers
+
+
+class RateLimiter:
+    """
+    Limiter typu token bucket współdzielony przez wszystkie klienty API w procesie.
+    Każdy budżet (liczba zapytań na okno czasowe) to osobny kubełek – zapytanie
+    musi pobrać żeton ze wszystkich. Po odpowiedzi 429 limiter wstrzymuje
+    wszystkie zapytania do czasu wskazanego w Retry-After.
+    Ten sam obiekt obsługuje ścieżkę synchroniczną (acquire) i asynchroniczną (acquire_async).
+    """
+    def __init__(self, budgets):
+        self._lock = threading.Lock()
+        # [pojemność, dostępne żetony, żetony na sekundę]
+        self._buckets = [[float(count), float(count), count / window] for count, window in budgets]
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self.calls = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self.downloaded = 0
+
+    def _reserve(self):
+        """
+        Rezerwuje żeton i zwraca liczbę sekund, którą trzeba odczekać przed wysłaniem zapytania.
+        Żetony mogą spaść poniżej zera – kolejne zapytania ustawiają się wtedy w kolejce.
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last_refill
+            self._last_refill = now
+            wait = max(0.0, self._blocked_until - now)
+            for bucket in self._buckets:
+                capacity, tokens, rate = bucket
+                tokens = min(capacity, tokens + elapsed * rate) - 1
+                bucket[1] = tokens
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+            self.calls += 1
+            self.waited += wait
+            return wait
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def throttle(self, retry_after):
+        """
+        Rejestruje odpowiedź 429 i wstrzymuje zapytania na retry_after sekund.
+        """
+        with self._lock:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def record_download(self, nbytes):
+        """
+        Dolicza rozmiar pobranej odpowiedzi do statystyk (bajty).
+        """
+        with self._lock:
+            self.downloaded += nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "waited": round(self.waited, 3),
+                "downloaded": self.downloaded
+            }
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    Zwraca limiter współdzielony przez cały proces (tworzony przy pierwszym użyciu).
+    Budżety konfiguruje zmienna środowiskowa INFAKT_RATE_LIMITS.
+    """
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            budgets = parse_rate_limits(os.getenv('INFAKT_RATE_LIMITS', DEFAULT_RATE_LIMITS))
+            _shared_limiter = RateLimiter(budgets)
+        return _shared_limiter
+
+
 class InFaktAPIClient:
-    def __init__(self):
-        self.api_key = os.getenv('INFAKT_API_KEY')
-        self.base_url = "https://api.infakt.pl/api/v3"
-        if not self.api_key or self.api_key == "YOUR_INFAKT_API_KEY":
-            raise ValueError("Klucz API inFakt nie został ustawiony. Sprawdź plik .env!")
-        self.headers = {
-            'X-inFakt-ApiKey': self.api_key,
-            'Accept': 'application/json',
-            'Content-Type': 'application/json'
-        }
+    def __init__(self, rate_limiter=None):
+        self.base_url, self.headers = load_api_settings()
+        self.api_key = self.headers['X-inFakt-ApiKey']
         # Utwórz obiekt Session do ponownego użycia połączeń HTTP
         self._session = requests.Session()
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.max_retries = int(os.getenv('INFAKT_MAX_RETRIES', DEFAULT_MAX_RETRIES))
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s:%(levelname)s:%(message)s'
@@ -28,6 +186,30 @@ class InFaktAPIClient:
     def test(self):
         print("InFaktAPIClient jest poprawnie skonfigurowany!")
 
+    def get(self, url, params=None):
+        """
+        Wysyła zapytanie GET przez współdzielony limiter.
+        Przy odpowiedzi 429 czeka (Retry-After lub wykładniczo) i ponawia – maksymalnie max_retries razy.
+        Zwraca obiekt Response (wywołujący sam sprawdza raise_for_status).
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            response = self._session.get(url, headers=self.headers, params=params)
+            self.rate_limiter.record_download(len(response.content))
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            delay = backoff_delay(response.headers, attempt)
+            self.rate_limiter.throttle(delay)
+            logging.warning(f"Limit API (429) dla {url}, ponowienie za {delay:.1f}s")
+            attempt += 1
+
+    def rate_limit_stats(self):
+        """
+        Liczniki współdzielonego limitera: wykonane zapytania, odpowiedzi 429, łączny czas oczekiwania.
+        """
+        return self.rate_limiter.stats()
+
     def list_invoices(self, offset=0, limit=10, fields=None, order=None):
         """
         Pobiera faktury bez dodatkowego filtrowania.
@@ -39,7 +221,7 @@ class InFaktAPIClient:
         if order:
             params['order'] = order
         try:
-            response = self._session.get(url, headers=self.headers, params=params)
+            response = self.get(url, params=params)
             response.raise_for_status()
             data = response.json()
             logging.info(f"Pobrano listę faktur: offset={offset}, limit={limit}")
@@ -64,14 +246,14 @@ class InFaktAPIClient:
             "order": order or "invoice_date desc"
         }
         try:
-            response = self._session.get(url, headers=self.headers, params=params)
+            response = self.get(url, params=params)
             response.raise_for_status()
             data = response.json()
             logging.info(f"Pobrano aktywne faktury: offset={offset}, limit={limit}")
             invoices_sent = data.get('entities', [])
             # Dodatkowo pobieramy faktury o statusie 'printed'
             params["q[status_eq]"] = "printed"
-            response_printed = self._session.get(url, headers=self.headers, params=params)
+            response_printed = self.get(url, params=params)
             response_printed.raise_for_status()
             data_printed = response_printed.json()
             invoices_printed = data_printed.get('entities', [])
@@ -86,7 +268,7 @@ class InFaktAPIClient:
         url = f"{self.base_url}/clients.json"
         params = {"offset": offset, "limit": limit}
         try:
-            response = self._session.get(url, headers=self.headers, params=params)
+            response = self.get(url, params=params)
             response.raise_for_status()
             data = response.json()
             logging.info(f"Pobrano listę klientów: offset={offset}, limit={limit}")
@@ -100,7 +282,7 @@ class InFaktAPIClient:
     def get_client_details(self, client_id):
         url = f"{self.base_url}/clients/{client_id}.json"
         try:
-            response = self._session.get(url, headers=self.headers)
+            response = self.get(url)
             response.raise_for_status()
             client = response.json()
             logging.info(f"Pobrano szczegóły klienta: {client_id}")
@@ -109,4 +291,129 @@ class InFaktAPIClient:
             logging.error(f"HTTP error przy pobieraniu danych klienta {client_id}: {http_err}")
         except Exception as err:
             logging.error(f"Inny błąd przy pobieraniu danych klienta {client_id}: {err}")
-        return None
\ No newline at end of file
+        return None
+
+
+class AsyncInFaktAPIClient:
+    """
+    Asynchroniczny klient API inFakt.
+    Korzysta z jednej, długożyjącej puli połączeń aiohttp, ogranicza liczbę
+    równoległych zapytań semaforem (max_in_flight) i dzieli limiter zapytań
+    z InFaktAPIClient. Użycie:
+
+        async with AsyncInFaktAPIClient(max_in_flight=10) as api:
+            details = await api.get_invoices_details(uuids)
+    """
+    def __init__(self, max_in_flight=None, rate_limiter=None):
+        self.base_url, self.headers = load_api_settings()
+        self.max_in_flight = max_in_flight or int(os.getenv('INFAKT_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT))
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.max_retries = int(os.getenv('INFAKT_MAX_RETRIES', DEFAULT_MAX_RETRIES))
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        self._open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _open(self):
+        # Sesję i semafor tworzymy wewnątrz działającej pętli zdarzeń
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            self._session = aiohttp.ClientSession(headers=self.headers, connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def rate_limit_stats(self):
+        return self.rate_limiter.stats()
+
+    async def get_json(self, url, params=None):
+        """
+        Wysyła zapytanie GET (semafor + limiter, ponawianie po 429) i zwraca zdekodowany JSON.
+        Rzuca aiohttp.ClientResponseError przy innych błędach HTTP.
+        """
+        self._open()
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                await self.rate_limiter.acquire_async()
+                async with self._session.get(url, params=params) as response:
+                    self.rate_limiter.record_download(len(await response.read()))
+                    if response.status != 429 or attempt >= self.max_retries:
+                        response.raise_for_status()
+                        return await response.json()
+                    delay = backoff_delay(response.headers, attempt)
+                self.rate_limiter.throttle(delay)
+                logging.warning(f"Limit API (429) dla {url}, ponowienie za {delay:.1f}s")
+                attempt += 1
+
+    async def list_invoices(self, offset=0, limit=10, fields=None, order=None):
+        """
+        Asynchroniczny odpowiednik InFaktAPIClient.list_invoices.
+        """
+        url = f"{self.base_url}/invoices.json"
+        params = {"offset": offset, "limit": limit}
+        if fields:
+            params['fields'] = ','.join(fields)
+        if order:
+            params['order'] = order
+        try:
+            data = await self.get_json(url, params=params)
+            logging.info(f"Pobrano listę faktur: offset={offset}, limit={limit}")
+            return data.get('entities', [])
+        except aiohttp.ClientResponseError as http_err:
+            logging.error(f"HTTP error przy pobieraniu faktur: {http_err}")
+        except Exception as err:
+            logging.error(f"Inny błąd przy pobieraniu faktur: {err}")
+        return None
+
+    async def get_invoice_details(self, invoice_uuid):
+        """
+        Pobiera szczegóły pojedynczej faktury (payment_date, paid_price, left_to_pay...).
+        Zwrócony słownik zawiera klucz 'uuid'.
+        """
+        url = f"{self.base_url}/invoices/{invoice_uuid}.json"
+        try:
+            data = await self.get_json(url)
+            data['uuid'] = invoice_uuid
+            return data
+        except aiohttp.ClientResponseError as http_err:
+            logging.error(f"HTTP error przy pobieraniu faktury {invoice_uuid}: {http_err.status}")
+        except Exception as err:
+            logging.error(f"Inny błąd przy pobieraniu faktury {invoice_uuid}: {err}")
+        return None
+
+    async def get_client_details(self, client_id):
+        url = f"{self.base_url}/clients/{client_id}.json"
+        try:
+            client = await self.get_json(url)
+            logging.info(f"Pobrano szczegóły klienta: {client_id}")
+            return client
+        except aiohttp.ClientResponseError as http_err:
+            logging.error(f"HTTP error przy pobieraniu danych klienta {client_id}: {http_err.status}")
+        except Exception as err:
+            logging.error(f"Inny błąd przy pobieraniu danych klienta {client_id}: {err}")
+        return None
+
+    async def get_invoices_details(self, invoice_uuids):
+        """
+        Równolegle (w granicach max_in_flight) pobiera szczegóły wielu faktur.
+        Zwraca słownik uuid -> szczegóły; faktury z błędem są pomijane.
+        """
+        details = await asyncio.gather(*(self.get_invoice_details(u) for u in invoice_uuids))
+        return {d['uuid']: d for d in details if d}
+
+    async def get_clients_details(self, client_ids):
+        """
+        Równolegle pobiera dane wielu klientów. Zwraca słownik client_id -> dane.
+        """
+        client_ids = list(client_ids)
+        results = await asyncio.gather(*(self.get_client_details(cid) for cid in client_ids))
+        return {cid: data for cid, data in zip(client_ids, results) if data}
@@ -3,25 +3,33 @@ import sys
 import asyncio
 import csv
 from datetime import datetime, date
-import aiohttp
 
 from .models import db, Invoice, Case
-from .src.api.api_client import InFaktAPIClient
+from .client_cache import client_cache
+from .persistence import load_rows_by_key
+from .shipping_settings import CLIENT_CACHE_CONFIG
+from .sync_pipeline import SyncPipeline, DetailsEnricher
+from .sync_metrics import timed
+from .case_search import refresh_search_text
+from .dashboard_summary import refresh_dashboard
+from .src.api.api_client import InFaktAPIClient, AsyncInFaktAPIClient
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def export_invoices_to_csv(invoices, filename='/tmp/sync_database_export.csv'):
+def export_invoices_to_csv(invoices, filename='/tmp/sync_database_export.csv', append=False):
     """
     Eksportuje dane faktur do pliku CSV w celu weryfikacji.
+    append=True dopisuje wiersze (bez nagłówka) – eksport strona po stronie.
     """
     headers = [
         'ID', 'UUID', 'Numer', 'Data Wystawienia', 'Termin Płatności',
         'Kwota (zł)', 'Status', 'NIP', 'Nazwa Klienta', 'Email', 'Adres'
     ]
-    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+    with open(filename, 'a' if append else 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=headers)
-        writer.writeheader()
+        if not append:
+            writer.writeheader()
         for inv in invoices:
             writer.writerow({
                 'ID': inv.get('id', ''),
@@ -36,147 +44,305 @@ def export_invoices_to_csv(invoices, filename='/tmp/sync_database_export.csv'):
                 'Email': inv.get('client_email', ''),
                 'Adres': inv.get('client_address', '')
             })
-    print(f"[sync_database] Dane faktur zapisane w pliku {filename}")
+    if not append:
+        print(f"[sync_database] Dane faktur zapisane w pliku {filename}")
 
-async def fetch_invoice_detail(session, client, invoice_uuid):
+def format_client_address(cdata):
     """
-    Asynchronicznie pobiera szczegóły pojedynczej faktury.
+    Składa adres klienta z danych inFakt w formacie "kod, ulica nr/lokal, miasto".
     """
-    url = f"{client.base_url}/invoices/{invoice_uuid}.json"
-    headers = client.headers
-    try:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                data = await response.json()
-                data['uuid'] = invoice_uuid
-                return data
-            else:
-                print(f"[sync_database] Błąd pobierania faktury UUID={invoice_uuid}, HTTP={response.status}")
-                return None
-    except Exception as e:
-        print(f"[sync_database] Błąd przy pobieraniu faktury UUID={invoice_uuid}: {e}")
-        return None
-
-async def fetch_all_details(client, invoices):
-    """
-    Asynchronicznie pobiera szczegóły (payment_date, currency, paid_price, left_to_pay) dla listy faktur.
-    """
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for inv in invoices:
-            uuid_val = inv.get('uuid')
-            if uuid_val:
-                tasks.append(fetch_invoice_detail(session, client, uuid_val))
-        details = await asyncio.gather(*tasks)
-        return [d for d in details if d is not None]
+    parts = []
+    post_code = cdata.get('postal_code','')
+    street = cdata.get('street','')
+    street_no = cdata.get('street_number','')
+    flat_no = cdata.get('flat_number','')
+    city = cdata.get('city','')
+    if post_code:
+        parts.append(post_code)
+    if street:
+        s = street
+        if street_no:
+            s+=f" {street_no}"
+        if flat_no:
+            s+=f"/{flat_no}"
+        parts.append(s)
+    if city:
+        parts.append(city)
+    return ", ".join(parts)
 
-def sync_database():
+async def fetch_all_details(invoices, client_ids=None, max_in_flight=None):
     """
-    Przykładowa funkcja do synchronizacji bazy – pobiera tylko faktury o statusie 'sent' i 'printed'
-    (pomijamy 'paid'), następnie zapisuje/aktualizuje je w bazie.
+    Asynchronicznie pobiera szczegóły faktur (payment_date, currency, paid_price, left_to_pay)
+    oraz dane klientów – wszystko w jednej puli połączeń z ograniczoną liczbą
+    równoległych zapytań. Każdy klient pobierany jest tylko raz; client_ids pozwala
+    ograniczyć pobieranie do klientów spoza pamięci podręcznej.
+    Zwraca krotkę (details_map: uuid -> szczegóły, clients_map: client_id -> dane klienta).
+    """
+    uuids = [inv['uuid'] for inv in invoices if inv.get('uuid')]
+    if client_ids is None:
+        client_ids = {str(inv['client_id']) for inv in invoices if inv.get('client_id')}
+    async with AsyncInFaktAPIClient(max_in_flight=max_in_flight) as api:
+        details_map, clients_map = await asyncio.gather(
+            api.get_invoices_details(uuids),
+            api.get_clients_details(client_ids)
+        )
+    return details_map, clients_map
+
+def client_contact(cdata):
+    """
+    Zwraca dane kontaktowe klienta używane przy fakturach: {'email': ..., 'address': ...}.
     """
-    client = InFaktAPIClient()
+    return {'email': cdata.get('email','N/A'), 'address': format_client_address(cdata)}
 
-    # Pobieramy wszystkie faktury (paginacja w razie potrzeby)
-    all_invoices = []
+def fetch_client_directory(client, limit=100):
+    """
+    Etap "katalog klientów": stronicuje clients.json po `limit` klientów
+    i zwraca słownik client_id -> dane klienta. Kilkuset klientów to kilka zapytań
+    zamiast osobnego zapytania dla każdego klienta.
+    """
+    directory = {}
     offset = 0
-    limit = 100
     while True:
-        data_batch = client.list_invoices(offset=offset, limit=limit, fields=["id","uuid","number","invoice_date","gross_price","status","client_id"], order="invoice_date desc")
-        if not data_batch:
+        batch = client.list_clients(offset=offset, limit=limit)
+        if not batch:
             break
-        if len(data_batch) == 0:
+        for cdata in batch:
+            if cdata.get('id') is not None:
+                directory[str(cdata['id'])] = cdata
+        if len(batch) < limit:
             break
-        # Pomijamy 'paid'
-        filtered = [inv for inv in data_batch if inv.get('status') in ('sent','printed')]
-        all_invoices.extend(filtered)
         offset += limit
+    print(f"[sync_database] Katalog klientów: {len(directory)} klientów w {offset // limit + 1} zapytaniach")
+    return directory
+
+def resolve_clients(client_ids, fetch_clients, client=None, use_directory=True):
+    """
+    Dane kontaktowe klientów client_ids, brane kolejno z: pamięci podręcznej (client_cache),
+    katalogu klientów (gdy use_directory i brakuje co najmniej CLIENT_CACHE_CONFIG["directory_threshold"]
+    klientów), a dopiero na końcu z API – fetch_clients(ids) zwraca client_id -> dane klienta.
+    Wymaga kontekstu aplikacji.
+    Zwraca (clients_map: client_id -> {'email', 'address'}, czy pobrano katalog klientów).
+    """
+    clients_data = client_cache.get_many(client_ids)
+    from_cache = len(clients_data)
+    missing = client_ids - clients_data.keys()
+
+    from_directory = 0
+    directory_loaded = False
+    if use_directory and len(missing) >= CLIENT_CACHE_CONFIG["directory_threshold"]:
+        directory = fetch_client_directory(client or InFaktAPIClient())
+        client_cache.put_many(directory)
+        found = {cid: directory[cid] for cid in missing if cid in directory}
+        clients_data.update(found)
+        from_directory = len(found)
+        missing -= found.keys()
+        directory_loaded = True
+
+    fetched = fetch_clients(missing)
+    client_cache.put_many(fetched)
+    clients_data.update(fetched)
+    print(f"[sync_database] Klienci: {len(client_ids)} (z pamięci podręcznej: {from_cache}, "
+          f"z katalogu: {from_directory}, pobrano pojedynczo: {len(fetched)})")
+    clients_map = {cid: client_contact(cdata) for cid, cdata in clients_data.items()}
+    return clients_map, directory_loaded
+
+def resolve_invoice_details(invoices, client=None):
+    """
+    Pobiera szczegóły faktur i dane kontaktowe ich klientów (resolve_clients) – jednorazowo,
+    we własnej pętli zdarzeń; szczegóły i brakujący klienci w jednej puli połączeń.
+    Wymaga kontekstu aplikacji.
+    Zwraca (details_map: uuid -> szczegóły, clients_map: client_id -> {'email', 'address'}).
+    """
+    details_map = {}
+
+    def fetch_clients(missing):
+        nonlocal details_map
+        details_map, fetched = asyncio.run(fetch_all_details(invoices, client_ids=missing))
+        return fetched
+
+    client_ids = {str(inv['client_id']) for inv in invoices if inv.get('client_id')}
+    clients_map, _ = resolve_clients(client_ids, fetch_clients, client=client)
+    return details_map, clients_map
+
+class ClientResolver:
+    """
+    Etap potoku: dane kontaktowe klientów strony (page.clients) przez resolve_clients.
+    Jak DetailsEnricher utrzymuje jedną pętlę zdarzeń i pulę połączeń aiohttp przez cały
+    przebieg (close() – po zakończeniu etapu), a katalog klientów pobiera najwyżej raz
+    na przebieg; jego klienci trafiają do pamięci podręcznej, więc kolejne strony ich nie szukają.
+    """
+    def __init__(self, max_in_flight=None, client=None):
+        self.max_in_flight = max_in_flight
+        self.client = client
+        self._loop = None
+        self._api = None
+        self._directory_loaded = False
+
+    def _fetch_clients(self, client_ids):
+        if not client_ids:
+            return {}
+        # Pętla zdarzeń i pula połączeń powstają w wątku etapu
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._api = AsyncInFaktAPIClient(max_in_flight=self.max_in_flight)
+        return self._loop.run_until_complete(self._api.get_clients_details(client_ids))
+
+    def resolve(self, client_ids):
+        clients_map, directory_loaded = resolve_clients(client_ids, self._fetch_clients, client=self.client,
+                                                        use_directory=not self._directory_loaded)
+        self._directory_loaded = self._directory_loaded or directory_loaded
+        return clients_map
+
+    def __call__(self, page):
+        page.clients = self.resolve({str(inv['client_id']) for inv in page.invoices if inv.get('client_id')})
+        return page
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.run_until_complete(self._api.close())
+            self._loop.close()
+            self._loop = None
+
+def enrich_client_contacts(after_id=0, batch_size=100, run=None):
+    """
+    Etap "enrich": uzupełnia e-mail i adres klienta w fakturach, które ich nie mają
+    (np. utworzonych przez sync_new_invoices), korzystając z ClientResolver
+    (pamięć podręczna, katalog klientów, API – jedna pula połączeń na cały etap).
+    Faktury przeglądane są po id (keyset), a punkt kontrolny (ostatnie id) zapisywany jest razem z każdą paczką.
+    Wymaga kontekstu aplikacji. Zwraca liczbę uzupełnionych faktur.
+    """
+    enriched = 0
+    resolver = ClientResolver()
+    try:
+        while True:
+            invoices = (Invoice.query
+                        .filter(Invoice.id > after_id,
+                                Invoice.client_id.isnot(None), Invoice.client_id != '',
+                                (Invoice.client_email.is_(None)) | (Invoice.client_address.is_(None)))
+                        .order_by(Invoice.id)
+                        .limit(batch_size)
+                        .all())
+            if not invoices:
+                break
+            with timed("client"):
+                clients_map = resolver.resolve({str(inv.client_id) for inv in invoices})
+            page_enriched = 0
+            enriched_cases = []
+            for inv in invoices:
+                contact = clients_map.get(str(inv.client_id))
+                if not contact:
+                    continue
+                inv.client_email = contact['email']
+                inv.client_address = contact['address']
+                enriched_cases.append(inv.case_id)
+                page_enriched += 1
+            # E-mail klienta jest częścią tekstu wyszukiwania sprawy
+            refresh_search_text(enriched_cases)
+            after_id = invoices[-1].id
+            if run:
+                run.checkpoint("enrich", after_id, enriched_count=run.enriched_count + page_enriched)
+            db.session.commit()
+            enriched += page_enriched
+    finally:
+        resolver.close()
+    print(f"[sync_database] Uzupełniono dane kontaktowe {enriched} faktur (do id={after_id})")
+    return enriched
+
+def sync_database(limit=100, filename='/tmp/sync_database_export.csv'):
+    """
+    Przykładowa funkcja do synchronizacji bazy – pobiera tylko faktury o statusie 'sent' i 'printed'
+    (pomijamy 'paid'), następnie zapisuje/aktualizuje je w bazie.
+    Działa jako SyncPipeline: pobieranie stron -> szczegóły faktur -> dane klientów -> zapis strony,
+    więc w pamięci jest tylko kilka stron naraz. Zwraca liczbę zapisanych faktur.
+    """
+    pipeline = SyncPipeline(
+        params={"fields": "id,uuid,number,invoice_date,gross_price,status,client_id", "order": "invoice_date desc"},
+        limit=limit,
+        # Pomijamy 'paid'
+        statuses=('sent', 'printed'),
+        stages=[("detail", DetailsEnricher()), ("client", ClientResolver())]
+    )
+    saved = 0
+    export_invoices_to_csv([], filename)
+
+    def write_page(page):
+        nonlocal saved
+        details_map, clients_map = page.details, page.clients
+        processed_invoices = []
+        for inv_data in page.invoices:
+            inv_uuid = inv_data.get('uuid')
+            if not inv_uuid:
+                continue
+            inv_data['payment_due_date'] = 'N/A'
+            inv_data['currency'] = 'PLN'
+            inv_data['paid_price'] = 0
+            inv_data['left_to_pay'] = 0
+            if inv_uuid in details_map:
+                det = details_map[inv_uuid]
+                inv_data['payment_due_date'] = det.get('payment_date','N/A')
+                inv_data['currency'] = det.get('currency','PLN')
+                inv_data['paid_price'] = det.get('paid_price',0)
+                inv_data['left_to_pay'] = det.get('left_to_pay',0)
+                inv_data['client_nip'] = det.get('client_tax_code','')
+                inv_data['client_company_name'] = det.get('client_company_name','')
+
+            # Klient
+            client_id = inv_data.get('client_id')
+            inv_data['client_address'] = ''
+            inv_data['client_email'] = 'N/A'
+            if client_id:
+                contact = clients_map.get(str(client_id))
+                if contact:
+                    inv_data['client_email'] = contact['email']
+                    inv_data['client_address'] = contact['address']
+            processed_invoices.append(inv_data)
+
+        # Zapis strony – istniejące faktury wczytujemy jednym zapytaniem IN (...)
+        local_invoices = load_rows_by_key(Invoice, "id", [inv['id'] for inv in processed_invoices])
+        for inv in processed_invoices:
+            local_inv = local_invoices.get(inv['id'])
+            if not local_inv:
+                local_inv = Invoice(id=inv['id'])
+            local_inv.uuid = inv.get('uuid') or local_inv.uuid
+            local_inv.invoice_number = inv.get('number','')
+            try:
+                if inv.get('invoice_date','N/A')!='N/A':
+                    local_inv.invoice_date = datetime.strptime(inv['invoice_date'],'%Y-%m-%d').date()
+            except:
+                pass
+            try:
+                if inv.get('payment_due_date','N/A')!='N/A':
+                    local_inv.payment_due_date = datetime.strptime(inv['payment_due_date'],'%Y-%m-%d').date()
+            except:
+                pass
+            local_inv.gross_price = inv.get('gross_price',0)
+            local_inv.status = inv.get('status','')
+            local_inv.paid_price = inv.get('paid_price',0)
+            local_inv.client_id = inv.get('client_id','')
+            local_inv.client_nip = inv.get('client_nip','')
+            local_inv.client_company_name = inv.get('client_company_name','')
+            local_inv.client_email = inv.get('client_email','N/A')
+            local_inv.client_address = inv.get('client_address','')
+            local_inv.currency = inv.get('currency','PLN')
+            local_inv.left_to_pay = inv.get('left_to_pay',0)
+            # Pola zdalne zapisane z innego źródła (szczegóły faktury) niż odcisk update_existing_cases –
+            # kasujemy odcisk, żeby kolejna aktualizacja porównała fakturę od nowa
+            local_inv.remote_hash = None
+            db.session.add(local_inv)
+        refresh_search_text([local_inv.case_id for local_inv in local_invoices.values()])
+        refresh_dashboard([local_inv.case_id for local_inv in local_invoices.values()])
+        db.session.commit()
+        export_invoices_to_csv(processed_invoices, filename, append=True)
+        saved += len(processed_invoices)
 
-    if not all_invoices:
+    pipeline.run(write_page)
+    if pipeline.failure:
+        print(f"[sync_database] Błąd synchronizacji {pipeline.failure}")
+    if not saved:
         print("[sync_database] Brak faktur do przetworzenia (status sent/printed).")
-        return
-
-    # Pobieramy szczegóły asynchronicznie
-    details = asyncio.run(fetch_all_details(client, all_invoices))
-    details_map = {d['uuid']: d for d in details}
-
-    processed_invoices = []
-    for inv_data in all_invoices:
-        inv_uuid = inv_data.get('uuid')
-        if not inv_uuid:
-            continue
-        inv_data['payment_due_date'] = 'N/A'
-        inv_data['currency'] = 'PLN'
-        inv_data['paid_price'] = 0
-        inv_data['left_to_pay'] = 0
-        if inv_uuid in details_map:
-            det = details_map[inv_uuid]
-            inv_data['payment_due_date'] = det.get('payment_date','N/A')
-            inv_data['currency'] = det.get('currency','PLN')
-            inv_data['paid_price'] = det.get('paid_price',0)
-            inv_data['left_to_pay'] = det.get('left_to_pay',0)
-            inv_data['client_nip'] = det.get('client_tax_code','')
-            inv_data['client_company_name'] = det.get('client_company_name','')
-
-        # Klient
-        client_id = inv_data.get('client_id')
-        inv_data['client_address'] = ''
-        inv_data['client_email'] = 'N/A'
-        if client_id:
-            cdata = client.get_client_details(client_id)
-            if cdata:
-                inv_data['client_email'] = cdata.get('email','N/A')
-                parts = []
-                post_code = cdata.get('postal_code','')
-                street = cdata.get('street','')
-                street_no = cdata.get('street_number','')
-                flat_no = cdata.get('flat_number','')
-                city = cdata.get('city','')
-                if post_code:
-                    parts.append(post_code)
-                if street:
-                    s = street
-                    if street_no:
-                        s+=f" {street_no}"
-                    if flat_no:
-                        s+=f"/{flat_no}"
-                    parts.append(s)
-                if city:
-                    parts.append(city)
-                inv_data['client_address'] = ", ".join(parts)
-        processed_invoices.append(inv_data)
-
-    # Zapis do bazy
-    for inv in processed_invoices:
-        local_inv = Invoice.query.filter_by(id=inv['id']).first()
-        if not local_inv:
-            local_inv = Invoice(id=inv['id'])
-        local_inv.invoice_number = inv.get('number','')
-        try:
-            if inv.get('invoice_date','N/A')!='N/A':
-                local_inv.invoice_date = datetime.strptime(inv['invoice_date'],'%Y-%m-%d').date()
-        except:
-            pass
-        try:
-            if inv.get('payment_due_date','N/A')!='N/A':
-                local_inv.payment_due_date = datetime.strptime(inv['payment_due_date'],'%Y-%m-%d').date()
-        except:
-            pass
-        local_inv.gross_price = inv.get('gross_price',0)
-        local_inv.status = inv.get('status','')
-        local_inv.paid_price = inv.get('paid_price',0)
-        local_inv.client_id = inv.get('client_id','')
-        local_inv.client_nip = inv.get('client_nip','')
-        local_inv.client_company_name = inv.get('client_company_name','')
-        local_inv.client_email = inv.get('client_email','N/A')
-        local_inv.client_address = inv.get('client_address','')
-        local_inv.currency = inv.get('currency','PLN')
-        local_inv.left_to_pay = inv.get('left_to_pay',0)
-        db.session.add(local_inv)
-    db.session.commit()
-
-    export_invoices_to_csv(processed_invoices, '/tmp/sync_database_export.csv')
-    print("[sync_database] Synchronizacja zakończona.")
+        return saved
+    print(f"[sync_database] Synchronizacja zakończona ({saved} faktur, {pipeline.pages} stron).")
+    return saved
 
 if __name__=="__main__":
     from .app import create_app
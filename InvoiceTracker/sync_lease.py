@@ -0,0 +1,82 @@
+# sync_lease.py
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, or_
+
+from .models import db, SyncLease
+from .persistence import is_postgres, upsert_rows
+from .shipping_settings import SYNC_CONFIG
+
+
+def lease_owner_id():
+    """
+    Identyfikator bieżącej instancji (App Engine: GAE_INSTANCE) i wątku – właściciel dzierżawy.
+    """
+    instance = os.getenv('GAE_INSTANCE') or socket.gethostname()
+    return f"{instance}:{os.getpid()}:{threading.get_ident()}"
+
+
+def claim_lease(shard, owner, ttl_seconds=None):
+    """
+    Próbuje przejąć dzierżawę shardu. Udaje się, gdy dzierżawa nie istnieje, wygasła
+    lub została zwolniona. PostgreSQL: SELECT ... FOR UPDATE SKIP LOCKED – instancja,
+    która trafi na zablokowany wiersz, od razu rezygnuje zamiast czekać.
+    Inne bazy: warunkowy UPDATE (atomowe porównaj-i-ustaw).
+    Zwraca True, jeśli dzierżawa należy teraz do `owner`.
+    """
+    ttl = timedelta(seconds=ttl_seconds or SYNC_CONFIG["lease_seconds"])
+    upsert_rows(SyncLease, [{"shard": shard, "owner": None, "expires_at": None, "acquired_at": None}], "shard")
+    db.session.commit()
+
+    now = datetime.utcnow()
+    claimable = or_(SyncLease.expires_at.is_(None), SyncLease.expires_at < now)
+    if is_postgres():
+        lease = db.session.execute(
+            select(SyncLease).where(SyncLease.shard == shard, claimable).with_for_update(skip_locked=True)
+        ).scalar_one_or_none()
+        if not lease:
+            db.session.rollback()
+            return False
+        lease.owner = owner
+        lease.expires_at = now + ttl
+        lease.acquired_at = now
+        lease.run_id = None
+        db.session.commit()
+        return True
+
+    result = db.session.execute(
+        update(SyncLease)
+        .where(SyncLease.shard == shard, claimable)
+        .values(owner=owner, expires_at=now + ttl, acquired_at=now, run_id=None)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def release_lease(shard, owner):
+    """
+    Zwalnia dzierżawę (tylko jeśli nadal należy do `owner`).
+    """
+    db.session.execute(
+        update(SyncLease)
+        .where(SyncLease.shard == shard, SyncLease.owner == owner)
+        .values(expires_at=None)
+    )
+    db.session.commit()
+
+
+def renew_lease(shard, owner, ttl_seconds=None):
+    """
+    Przedłuża dzierżawę należącą do `owner`. Zwraca False, jeśli dzierżawa została utracona.
+    """
+    ttl = timedelta(seconds=ttl_seconds or SYNC_CONFIG["lease_seconds"])
+    result = db.session.execute(
+        update(SyncLease)
+        .where(SyncLease.shard == shard, SyncLease.owner == owner, SyncLease.expires_at.isnot(None))
+        .values(expires_at=datetime.utcnow() + ttl)
+    )
+    db.session.commit()
+    return result.rowcount == 1
@@ -0,0 +1,148 @@
+# sync_metrics.py
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .src.api.api_client import get_rate_limiter
+
+# Etapy, dla których mierzony jest czas (kolumny <etap>_seconds w SyncStatus)
+PHASES = ("list", "detail", "client", "persist")
+
+# Liczniki bazy danych osobno dla każdego wątku – przebieg liczy tylko zapytania wątku,
+# który go uruchomił (bez żądań WWW i odnawiania blokady w innych wątkach)
+_db_counters = threading.local()
+_lock = threading.Lock()
+# Aktywne kolektory – czasy etapów trafiają do każdego z nich (np. "new" i obejmujący go "full")
+_active = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    _db_counters.statements = getattr(_db_counters, "statements", 0) + 1
+
+
+@event.listens_for(Session, "after_commit")
+def _count_commit(session):
+    _db_counters.commits = getattr(_db_counters, "commits", 0) + 1
+
+
+def _snapshot():
+    api = get_rate_limiter().stats()
+    return {
+        "api_calls": api["calls"],
+        "api_throttled": api["throttled"],
+        "bytes_downloaded": api["downloaded"],
+        "db_statements": getattr(_db_counters, "statements", 0),
+        "db_commits": getattr(_db_counters, "commits", 0),
+    }
+
+
+def record_time(phase, seconds):
+    """
+    Dolicza czas etapu (list, detail, client, persist) do wszystkich aktywnych kolektorów.
+    Bezpieczne do wywołania z wątków etapów SyncPipeline.
+    """
+    with _lock:
+        for metrics in _active:
+            metrics.timings[phase] = metrics.timings.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_time(phase, time.monotonic() - start)
+
+
+def record_pages(count=1):
+    with _lock:
+        for metrics in _active:
+            metrics.pages_fetched += count
+
+
+class SyncMetrics:
+    """
+    Zbiera metryki jednego przebiegu synchronizacji: zapytania do API, odpowiedzi 429,
+    pobrane bajty, strony, zapytania i commity bazy oraz czasy etapów.
+    Zapytania i commity bazy liczone są w wątku, który uruchomił pomiar (start i apply
+    wywołuje ten sam wątek). Liczniki API są wspólne dla procesu (zapytania wysyłają wątki
+    etapów SyncPipeline), więc są przybliżone – obejmują też inne zapytania do API w procesie
+    w czasie przebiegu. Pomiar trzeba zakończyć także przy błędzie:
+
+        metrics = SyncMetrics.start()
+        try:
+            ...
+            metrics.apply(sync_record)   # uzupełnia kolumny SyncStatus
+        finally:
+            metrics.stop()
+    """
+    def __init__(self):
+        self.baseline = _snapshot()
+        self.timings = {}
+        self.pages_fetched = 0
+
+    @classmethod
+    def start(cls):
+        metrics = cls()
+        with _lock:
+            _active.append(metrics)
+        return metrics
+
+    def stop(self):
+        # Wielokrotne wywołanie (apply, a potem finally) jest bezpieczne
+        with _lock:
+            if self in _active:
+                _active.remove(self)
+
+    def apply(self, record):
+        """
+        Kończy pomiar i zapisuje metryki w wierszu SyncStatus (przed jego commitem,
+        więc sam zapis wiersza nie jest liczony).
+        """
+        self.stop()
+        current = _snapshot()
+        for name, value in current.items():
+            setattr(record, name, value - self.baseline[name])
+        record.pages_fetched = self.pages_fetched
+        for phase in PHASES:
+            setattr(record, f"{phase}_seconds", round(self.timings.get(phase, 0.0), 3))
+        return record
+
+
+def summarize_trends(records):
+    """
+    Trendy dla panelu statusu: dla każdego typu synchronizacji (wiersze "batch ..." łącznie)
+    średnie z podanych przebiegów oraz zmiana czasu trwania ostatniego przebiegu względem średniej.
+    records – wiersze SyncStatus od najnowszego.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault((record.sync_type or "").split(" ")[0], []).append(record)
+
+    def avg(rows, column):
+        return sum(getattr(r, column) or 0 for r in rows) / len(rows)
+
+    trends = []
+    for sync_type, rows in groups.items():
+        avg_duration = avg(rows, "duration")
+        latest = rows[0].duration or 0
+        trends.append({
+            "sync_type": sync_type,
+            "runs": len(rows),
+            "avg_duration": avg_duration,
+            "latest_duration": latest,
+            "duration_change": ((latest - avg_duration) / avg_duration * 100) if avg_duration else 0.0,
+            "avg_api_calls": avg(rows, "api_calls"),
+            "throttled": sum(r.api_throttled or 0 for r in rows),
+            "avg_kb": avg(rows, "bytes_downloaded") / 1024,
+            "avg_db_statements": avg(rows, "db_statements"),
+            "avg_db_commits": avg(rows, "db_commits"),
+            "avg_phases": {phase: avg(rows, f"{phase}_seconds") for phase in PHASES},
+        })
+    return trends
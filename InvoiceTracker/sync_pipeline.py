@@ -0,0 +1,204 @@
+# sync_pipeline.py
+import asyncio
+import queue
+import threading
+
+from flask import current_app, has_app_context
+
+from .src.api.api_client import InFaktAPIClient, AsyncInFaktAPIClient
+from .sync_metrics import timed, record_pages
+
+# Znacznik końca strumienia stron
+_END = object()
+
+
+class PageFailure:
+    """
+    Błąd etapu potoku (np. pobierania strony) przekazywany dalej zamiast strony.
+    """
+    def __init__(self, offset, error):
+        self.offset = offset
+        self.error = error
+
+    def __str__(self):
+        return f"offset={self.offset}: {self.error}"
+
+
+class Page:
+    """
+    Strona synchronizacji przekazywana między etapami potoku:
+      - offset: offset strony w liście invoices.json
+      - data: surowa odpowiedź API (entities, metainfo)
+      - invoices: faktury strony po filtrze statusów
+      - details: uuid -> szczegóły faktury (etap DetailsEnricher)
+      - clients: client_id -> {'email', 'address'} (etap rozwiązywania klientów)
+    """
+    def __init__(self, offset, data, invoices):
+        self.offset = offset
+        self.data = data
+        self.invoices = invoices
+        self.details = {}
+        self.clients = {}
+
+
+class DetailsEnricher:
+    """
+    Etap potoku: pobiera szczegóły faktur strony (invoices/<uuid>.json) równolegle,
+    w jednej puli połączeń aiohttp utrzymywanej przez cały przebieg.
+    """
+    def __init__(self, max_in_flight=None):
+        self.max_in_flight = max_in_flight
+        self._loop = None
+        self._api = None
+
+    def __call__(self, page):
+        # Pętla zdarzeń i pula połączeń powstają w wątku etapu
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._api = AsyncInFaktAPIClient(max_in_flight=self.max_in_flight)
+        uuids = [inv['uuid'] for inv in page.invoices if inv.get('uuid')]
+        page.details = self._loop.run_until_complete(self._api.get_invoices_details(uuids))
+        return page
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.run_until_complete(self._api.close())
+            self._loop.close()
+            self._loop = None
+
+
+class SyncPipeline:
+    """
+    Strumieniowy potok synchronizacji: pobieranie stron invoices.json (z wyprzedzeniem
+    `prefetch` stron) -> kolejne etapy (np. szczegóły faktur, dane klientów) -> zapis do bazy.
+    Każdy etap działa w osobnym wątku, a etapy łączą kolejki o ograniczonym rozmiarze,
+    więc zapytania HTTP kolejnych stron nakładają się na zapis bieżącej, a w pamięci
+    jest najwyżej kilka stron niezależnie od liczby faktur.
+
+    stages to lista par (etap, funkcja strony), np. ("detail", DetailsEnricher());
+    nazwa etapu służy do pomiaru czasu (sync_metrics), obok "list" (pobieranie stron)
+    i "persist" (zapis).
+    Zapis (write_page) wykonywany jest w wątku wywołującym, po kolei dla każdej strony;
+    zwrócenie False kończy przebieg (np. wcześniejsze zakończenie stronicowania).
+    Etapy dostają własny kontekst aplikacji, jeśli potok uruchomiono w kontekście.
+    Po przebiegu: pages – liczba zapisanych stron, failure – PageFailure lub None,
+    reached_max_pages – czy przebieg przerwał limit max_pages.
+    """
+    def __init__(self, params, start_offset=0, limit=100, max_pages=None, statuses=None,
+                 stages=(), prefetch=2, client=None):
+        self.params = params
+        self.start_offset = start_offset
+        self.limit = limit
+        self.max_pages = max_pages
+        self.statuses = statuses
+        self.stages = list(stages)
+        self.prefetch = prefetch
+        self.client = client or InFaktAPIClient()
+        self.pages = 0
+        self.failure = None
+        self.reached_max_pages = False
+        self._stop = threading.Event()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _END
+
+    def _fetch(self, out_q):
+        url = f"{self.client.base_url}/invoices.json"
+        offset = self.start_offset
+        while not self._stop.is_set():
+            if self.max_pages and offset - self.start_offset >= self.max_pages * self.limit:
+                self.reached_max_pages = True
+                break
+            # Każdy błąd strony (HTTP, nieoczekiwany JSON) trafia dalej jako PageFailure – inaczej
+            # wątek kończyłby się bez _END, a zapis czekałby na kolejną stronę bez końca
+            try:
+                params = dict(self.params, offset=offset, limit=self.limit)
+                with timed("list"):
+                    response = self.client.get(url, params=params)
+                    response.raise_for_status()
+                    data = response.json()
+                record_pages()
+                entities = data.get("entities", [])
+                invoices = [inv for inv in entities if self.statuses is None or inv.get('status') in self.statuses]
+            except Exception as e:
+                self._put(out_q, PageFailure(offset, e))
+                return
+            if not entities:
+                break
+            if not self._put(out_q, Page(offset, data, invoices)):
+                return
+            offset += self.limit
+        self._put(out_q, _END)
+
+    def _transform(self, phase, stage, in_q, out_q):
+        try:
+            while True:
+                item = self._get(in_q)
+                if item is _END or isinstance(item, PageFailure):
+                    self._put(out_q, item)
+                    return
+                try:
+                    with timed(phase):
+                        item = stage(item)
+                except Exception as e:
+                    self._put(out_q, PageFailure(item.offset, e))
+                    return
+                if not self._put(out_q, item):
+                    return
+        finally:
+            if hasattr(stage, "close"):
+                stage.close()
+
+    def _thread(self, target, *args):
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def runner():
+            if app is None:
+                target(*args)
+                return
+            with app.app_context():
+                target(*args)
+        thread = threading.Thread(target=runner, daemon=True)
+        thread.start()
+        return thread
+
+    def run(self, write_page):
+        """
+        Uruchamia potok i zapisuje strony funkcją write_page(page). Zwraca liczbę zapisanych stron.
+        """
+        queues = [queue.Queue(maxsize=self.prefetch) for _ in range(len(self.stages) + 1)]
+        threads = [self._thread(self._fetch, queues[0])]
+        for i, (phase, stage) in enumerate(self.stages):
+            threads.append(self._thread(self._transform, phase, stage, queues[i], queues[i + 1]))
+        try:
+            while True:
+                item = self._get(queues[-1])
+                if item is _END:
+                    break
+                if isinstance(item, PageFailure):
+                    self.failure = item
+                    break
+                self.pages += 1
+                with timed("persist"):
+                    keep_going = write_page(item)
+                if keep_going is False:
+                    break
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+        return self.pages
@@ -0,0 +1,91 @@
+# sync_runs.py
+from datetime import datetime, timedelta
+
+from .models import db, SyncRun, SyncStatus
+from .shipping_settings import SYNC_CONFIG
+from .update_db import sync_new_invoices, update_existing_cases
+from .sync_database import enrich_client_contacts
+from .sync_metrics import SyncMetrics
+
+# Kolejność etapów pełnej synchronizacji
+PHASES = ("new", "update", "enrich")
+
+
+def open_run(now=None):
+    """
+    Zwraca przebieg do wykonania: ostatni niedokończony (przerwany lub zakończony błędem)
+    albo nowy, zaczynający od etapu "new" i offsetu 0. Jeśli niedokończony przebieg
+    wciąż zapisuje punkty kontrolne (heartbeat młodszy niż SYNC_CONFIG["run_stale_minutes"]),
+    zwraca None – synchronizacja trwa w innym wątku lub instancji.
+    """
+    now = now or datetime.utcnow()
+    run = (SyncRun.query
+           .filter(SyncRun.status.in_(("running", "failed")))
+           .order_by(SyncRun.id.desc())
+           .first())
+    if run and run.status == "running" and run.heartbeat_at \
+            and now - run.heartbeat_at < timedelta(minutes=SYNC_CONFIG["run_stale_minutes"]):
+        return None
+    if run:
+        print(f"[sync_runs] Wznawiam przebieg {run.id} od etapu {run.phase}, offset={run.offset}")
+        run.status = "running"
+        run.error = None
+        run.heartbeat_at = now
+    else:
+        run = SyncRun(status="running", phase=PHASES[0], offset=0, started_at=now, heartbeat_at=now)
+        db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def run_resumable_sync(limit=None, run=None):
+    """
+    Pełna synchronizacja (nowe faktury, aktualizacja spraw, uzupełnienie danych klientów)
+    z punktem kontrolnym po każdej zatwierdzonej stronie. Przebieg przerwany przez restart
+    instancji lub błąd API jest przy kolejnym uruchomieniu kontynuowany od miejsca,
+    w którym się zatrzymał, a nie od offsetu 0.
+    run – przebieg otwarty wcześniej przez open_run (np. przez job_runner); domyślnie otwierany tutaj.
+    Zwraca SyncRun (None, gdy inny przebieg jest w toku).
+    """
+    limit = limit or SYNC_CONFIG["sync_limit"]
+    run = run or open_run()
+    if run is None:
+        print("[sync_runs] Synchronizacja jest już w toku – pomijam")
+        return None
+
+    start_time = datetime.utcnow()
+    metrics = SyncMetrics.start()
+    try:
+        try:
+            for phase in PHASES[PHASES.index(run.phase):]:
+                offset = run.offset if phase == run.phase else 0
+                run.checkpoint(phase, offset)
+                db.session.commit()
+                if phase == "new":
+                    sync_new_invoices(start_offset=offset, limit=limit, run=run)
+                elif phase == "update":
+                    update_existing_cases(start_offset=offset, limit=limit, run=run)
+                else:
+                    enrich_client_contacts(after_id=offset, batch_size=limit, run=run)
+                if run.status == "failed":
+                    db.session.commit()
+                    print(f"[sync_runs] Przebieg {run.id} przerwany: {run.error}")
+                    return run
+        except Exception as e:
+            db.session.rollback()
+            run.fail(e)
+            db.session.commit()
+            raise
+
+        run.status = "completed"
+        run.finished_at = datetime.utcnow()
+        duration = (run.finished_at - start_time).total_seconds()
+        db.session.add(metrics.apply(SyncStatus(sync_type="full", processed=run.new_count + run.updated_count,
+                                                duration=duration, new_count=run.new_count,
+                                                updated_count=run.updated_count)))
+        db.session.commit()
+        print(f"[sync_runs] Przebieg {run.id} zakończony: nowe {run.new_count}, aktualizacje {run.updated_count}, "
+              f"uzupełnione dane klientów {run.enriched_count} w {duration:.2f}s")
+        return run
+    finally:
+        metrics.stop()
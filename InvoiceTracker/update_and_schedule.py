@@ -11,6 +11,8 @@ from .models import db, NotificationLog, Invoice, Case
 from .send_email import send_email
 from .mail_templates import MAIL_TEMPLATES
 from .update_db import update_invoices_in_db_batch as update_database
+from .case_progress import log_notification
+from .dashboard_summary import refresh_dashboard
 
 load_dotenv()
 
@@ -79,17 +81,11 @@ def run_daily_notifications():
             recipient = invoice.client_email
             if recipient and recipient != "N/A":
                 send_email(recipient, subject, body_html, html=True)
-                log = NotificationLog(
-                    client_id=invoice.client_id,
-                    invoice_number=invoice.invoice_number,
-                    email_to=recipient,
-                    subject=subject,
-                    body=body_html,
-                    stage=str(next_stage),
-                    mode="automatyczny",
-                    scheduled_date=datetime.combine(scheduled_date, datetime.min.time())
+                log_notification(
+                    invoice.case, invoice, str(next_stage), subject, body_html, mode="automatyczny",
+                    email_to=recipient, scheduled_date=datetime.combine(scheduled_date, datetime.min.time())
                 )
-                db.session.add(log)
+                refresh_dashboard([invoice.case_id])
                 db.session.commit()
                 print(f"Automatyczne powiadomienie etapu {next_stage}/5 wysłane dla faktury {invoice.invoice_number}")
             else:
@@ -1,199 +1,365 @@
 import sys
+import hashlib
 from datetime import datetime, date, timedelta
-from InvoiceTracker.models import db, Invoice, Case, SyncStatus
-from InvoiceTracker.src.api.api_client import InFaktAPIClient
+from sqlalchemy import select, func
+from InvoiceTracker.models import db, Invoice, Case, SyncStatus, SyncWatermark
+from InvoiceTracker.persistence import upsert_rows, update_rows, PageIndex
+from InvoiceTracker.sync_pipeline import SyncPipeline
+from InvoiceTracker.sync_metrics import SyncMetrics
+from InvoiceTracker.shipping_settings import SYNC_CONFIG
+from InvoiceTracker.case_progress import next_notification_date
+from InvoiceTracker.case_search import search_text_for
+from InvoiceTracker.dashboard_summary import refresh_dashboard
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def sync_new_invoices(start_offset=0, limit=100):
+def sync_new_invoices(start_offset=0, limit=100, max_pages=None, run=None):
     """
     Pobiera nowe faktury z inFaktu, dla których termin płatności przypada za 2 dni,
     i tworzy dla nich nowe sprawy (Invoice oraz Case).
+    Strony pobierane są przez SyncPipeline (z wyprzedzeniem), a zapisywane po kolei.
+    max_pages ogranicza przebieg do podanej liczby stron.
+    run (SyncRun) – punkt kontrolny zapisywany razem z każdą stroną (etap "new").
     Zwraca liczbę przetworzonych rekordów.
     """
-    client = InFaktAPIClient()
     processed_count = 0
     today = date.today()
     new_case_due_date = today + timedelta(days=2)
     new_case_due_date_str = new_case_due_date.strftime("%Y-%m-%d")
-    offset = start_offset
+    if run:
+        # Offset punktu kontrolnego dotyczy listy z filtrem daty z dnia, w którym go zapisano
+        resumed_offset, start_offset = start_offset, run.align_offset(f"new:{new_case_due_date_str}", start_offset)
+        if resumed_offset != start_offset:
+            print(f"[sync_new_invoices] Punkt kontrolny (offset {resumed_offset}) dotyczy innej listy – zaczynam od 0")
     start_time = datetime.utcnow()
+    metrics = SyncMetrics.start()
+    try:
+        pipeline = SyncPipeline(
+            params={
+                "fields": "id,uuid,number,invoice_date,gross_price,status,client_id,payment_date,paid_price,payment_method,client_nip,client_company_name",
+                "order": "invoice_date desc",
+                "q[payment_date_eq]": new_case_due_date_str
+            },
+            start_offset=start_offset,
+            limit=limit,
+            max_pages=max_pages,
+            # Zachowujemy tylko faktury o statusie 'sent' lub 'printed'
+            statuses=('sent', 'printed')
+        )
 
-    while True:
-        params = {
-            "offset": offset,
-            "limit": limit,
-            "fields": "id,uuid,number,invoice_date,gross_price,status,client_id,payment_date,paid_price,payment_method,client_nip,client_company_name",
-            "order": "invoice_date desc",
-            "q[payment_date_eq]": new_case_due_date_str
-        }
-        url = f"{client.base_url}/invoices.json"
+        def write_page(page):
+            nonlocal processed_count
+            batch_invoices = page.invoices
+
+            # Istniejące faktury i sprawy strony – po jednym zapytaniu IN (...) na tabelę
+            index = PageIndex.load(
+                [inv_data['id'] for inv_data in batch_invoices],
+                [inv_data.get('number', '') for inv_data in batch_invoices]
+            )
+
+            # Cała strona w jednej transakcji: nowe faktury, sprawy, powiązanie case_id
+            rows = [new_invoice_row(inv_data) for inv_data in batch_invoices if inv_data['id'] not in index.invoice_ids]
+            inserted = upsert_rows(Invoice, rows, "id")
+            new_rows = [row for row in rows if row["id"] in inserted]
+
+            # Tworzymy nową sprawę dla każdej nowej, nieopłaconej faktury (o ile sprawa jeszcze nie istnieje)
+            case_ids = {number: case_id for number, (case_id, _) in index.cases.items()}
+            case_rows = [{
+                "case_number": row["invoice_number"],
+                "client_id": row["client_id"],
+                "client_nip": row["client_nip"],
+                "client_company_name": row["client_company_name"],
+                "status": "active",
+                "max_stage": 0,
+                "next_notification_date": next_notification_date(row["payment_due_date"], 0),
+                "search_text": search_text_for(row["invoice_number"], row["client_id"], row["client_nip"],
+                                               row["client_company_name"], row.get("client_email"))
+            } for row in new_rows if row["status"].lower() != "paid" and row["invoice_number"] not in case_ids]
+            if case_rows:
+                upsert_rows(Case, case_rows, "case_number")
+                case_ids.update(db.session.execute(
+                    select(Case.case_number, Case.id).where(Case.case_number.in_([c["case_number"] for c in case_rows]))
+                ).all())
+            if new_rows:
+                update_rows(Invoice, [
+                    {"id": row["id"], "case_id": case_ids[row["invoice_number"]]}
+                    for row in new_rows if row["invoice_number"] in case_ids
+                ], "id")
+                refresh_dashboard([case_ids[row["invoice_number"]] for row in new_rows if row["invoice_number"] in case_ids])
+            if run:
+                run.checkpoint("new", page.offset + limit, new_count=run.new_count + len(new_rows))
+            db.session.commit()
+            processed_count += len(new_rows)
+
+        pipeline.run(write_page)
+        if pipeline.failure:
+            print(f"[sync_new_invoices] Błąd przy pobieraniu partii {pipeline.failure}")
+            if run:
+                run.fail(f"new, {pipeline.failure}")
+
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        # Zapisujemy wynik synchronizacji nowych faktur w tabeli SyncStatus
+        sync_record = SyncStatus(sync_type="new", processed=processed_count, duration=duration,
+                                 new_count=processed_count)
+        db.session.add(metrics.apply(sync_record))
+        db.session.commit()
+        print(f"[sync_new_invoices] Przetworzono {processed_count} nowych faktur (offset={start_offset}) w {duration:.2f}s")
+        return processed_count
+    finally:
+        metrics.stop()
+
+def remote_fingerprint(inv_data):
+    """
+    Odcisk (MD5) pól faktury z API, od których zależy stan sprawy:
+    status, paid_price, gross_price i payment_date. Ten sam odcisk = brak zmian do zapisania.
+    """
+    fields = (inv_data.get('status'), inv_data.get('paid_price'), inv_data.get('gross_price'), inv_data.get('payment_date'))
+    return hashlib.md5("|".join("" if v is None else str(v) for v in fields).encode("utf-8")).hexdigest()
+
+def remote_invoice_values(inv_data, tag="update_existing_cases"):
+    """
+    Zamienia dane faktury z API (wpis z listy invoices.json lub szczegóły invoices/<uuid>.json)
+    na wartości kolumn Invoice: daty, kwoty, status, wyliczone left_to_pay i remote_hash.
+    """
+    # Konwersja daty wystawienia
+    invoice_date = None
+    d_str = inv_data.get('invoice_date')
+    if d_str and d_str != 'N/A':
         try:
-            response = client._session.get(url, headers=client.headers, params=params)
-            response.raise_for_status()
+            invoice_date = datetime.strptime(d_str, '%Y-%m-%d').date()
         except Exception as e:
-            print(f"[sync_new_invoices] Błąd przy pobieraniu partii offset={offset}: {e}")
-            break
-
-        data = response.json()
-        batch_invoices = data.get("entities", [])
-        # Filtrujemy, aby zachować tylko faktury o statusie 'sent' lub 'printed'
-        batch_invoices = [inv for inv in batch_invoices if inv.get('status') in ('sent', 'printed')]
-        if not batch_invoices:
-            break
-
-        for inv_data in batch_invoices:
-            # Sprawdzamy, czy faktura już istnieje w bazie – jeśli tak, pomijamy
-            local_inv = Invoice.query.filter_by(id=inv_data['id']).first()
-            if local_inv:
-                continue
-
-            # Konwersja daty wystawienia
-            invoice_date = None
-            d_str = inv_data.get('invoice_date')
-            if d_str and d_str != 'N/A':
-                try:
-                    invoice_date = datetime.strptime(d_str, '%Y-%m-%d').date()
-                except Exception as e:
-                    print(f"[sync_new_invoices] Błąd konwersji invoice_date: {e}")
-
-            # Konwersja terminu płatności
-            payment_due = None
-            pd_str = inv_data.get('payment_date')
-            if pd_str and pd_str != 'N/A':
-                try:
-                    payment_due = datetime.strptime(pd_str, '%Y-%m-%d').date()
-                except Exception as e:
-                    print(f"[sync_new_invoices] Błąd konwersji payment_date: {e}")
-
-            # Tworzymy nową fakturę
-            new_inv = Invoice(id=inv_data['id'])
-            new_inv.invoice_number = inv_data.get('number', '')
-            new_inv.invoice_date = invoice_date
-            new_inv.payment_due_date = payment_due
-            new_inv.gross_price = inv_data.get('gross_price', 0)
-            new_inv.status = inv_data.get('status', '')
-            new_inv.paid_price = inv_data.get('paid_price', 0)
-            new_inv.client_id = inv_data.get('client_id', '')
-            new_inv.client_nip = inv_data.get('client_nip', '')
-            new_inv.client_company_name = inv_data.get('client_company_name', '')
-            paid = new_inv.paid_price if new_inv.paid_price is not None else 0
-            new_inv.left_to_pay = new_inv.gross_price - paid
-
-            db.session.add(new_inv)
-            db.session.commit()
+            print(f"[{tag}] Błąd konwersji invoice_date: {e}")
+
+    # Konwersja terminu płatności
+    payment_due = None
+    pd_str = inv_data.get('payment_date')
+    if pd_str and pd_str != 'N/A':
+        try:
+            payment_due = datetime.strptime(pd_str, '%Y-%m-%d').date()
+        except Exception as e:
+            print(f"[{tag}] Błąd konwersji payment_date: {e}")
 
-            # Tworzymy nową sprawę, jeśli faktura nie jest opłacona
-            if new_inv.status.lower() != "paid":
-                new_case = Case(
-                    case_number=new_inv.invoice_number,
-                    client_id=new_inv.client_id,
-                    client_nip=new_inv.client_nip,
-                    client_company_name=new_inv.client_company_name,
-                    status="active"
-                )
-                db.session.add(new_case)
-                db.session.commit()
-                new_inv.case_id = new_case.id
-                db.session.add(new_inv)
-                db.session.commit()
-
-            processed_count += 1
-        offset += limit
-
-    duration = (datetime.utcnow() - start_time).total_seconds()
-    # Zapisujemy wynik synchronizacji nowych faktur w tabeli SyncStatus
-    sync_record = SyncStatus(sync_type="new", processed=processed_count, duration=duration)
-    db.session.add(sync_record)
-    db.session.commit()
-    print(f"[sync_new_invoices] Przetworzono {processed_count} nowych faktur (offset={start_offset}) w {duration:.2f}s")
-    return processed_count
-
-def update_existing_cases(start_offset=0, limit=100):
+    gross_price = inv_data.get('gross_price', 0)
+    paid_price = inv_data.get('paid_price', 0)
+    paid = paid_price if paid_price is not None else 0
+    return {
+        "uuid": inv_data.get('uuid'),
+        "invoice_date": invoice_date,
+        "payment_due_date": payment_due,
+        "gross_price": gross_price,
+        "status": inv_data.get('status', ''),
+        "paid_price": paid_price,
+        "left_to_pay": gross_price - paid,
+        "remote_hash": remote_fingerprint(inv_data)
+    }
+
+def new_invoice_row(inv_data):
+    """
+    Wiersz nowej faktury (słownik kolumn Invoice) na podstawie wpisu z listy invoices.json.
+    """
+    row = remote_invoice_values(inv_data, tag="sync_new_invoices")
+    row.update({
+        "id": inv_data['id'],
+        "invoice_number": inv_data.get('number', ''),
+        "client_id": inv_data.get('client_id', ''),
+        "client_nip": inv_data.get('client_nip', ''),
+        "client_company_name": inv_data.get('client_company_name', '')
+    })
+    return row
+
+def apply_remote_invoice(local_inv, inv_data, tag="update_existing_cases"):
+    """
+    Przepisuje na lokalną fakturę dane z API (daty, kwoty, status) i przelicza left_to_pay.
+    Brakujące w odpowiedzi uuid i data wystawienia nie nadpisują wartości lokalnych.
+    """
+    for column, value in remote_invoice_values(inv_data, tag).items():
+        if value is None and column in ("uuid", "invoice_date"):
+            continue
+        setattr(local_inv, column, value)
+
+def case_status_from(status, paid_price, gross_price):
+    """
+    Status sprawy wynikający z faktury: opłacona (status "paid" lub wpłata >= kwota brutto) zamyka sprawę.
+    """
+    if (status or "").lower() == "paid" or (paid_price or 0) >= (gross_price or 0):
+        return "closed_oplacone"
+    return "active"
+
+def case_status_for(local_inv):
+    return case_status_from(local_inv.status, local_inv.paid_price, local_inv.gross_price)
+
+def parse_api_timestamp(value):
+    """
+    Zamienia znacznik czasu z API (ISO 8601, np. "2025-02-02T13:00:26.000+01:00") na datetime.
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+def use_incremental_sync(watermark, now=None):
+    """
+    Czy można wykonać synchronizację przyrostową – jest znacznik, a od ostatniej
+    pełnej rekoncyliacji nie minęło więcej niż SYNC_CONFIG["full_reconcile_hours"].
+    """
+    if not watermark or not watermark.last_value or not watermark.last_full_sync:
+        return False
+    now = now or datetime.utcnow()
+    return now - watermark.last_full_sync < timedelta(hours=SYNC_CONFIG["full_reconcile_hours"])
+
+def oldest_active_invoice_date():
+    """
+    Najstarsza data wystawienia faktury wśród aktywnych spraw (None, gdy brak aktywnych spraw).
+    """
+    return (db.session.query(func.min(Invoice.invoice_date))
+            .join(Case, Invoice.case_id == Case.id)
+            .filter(Case.status == "active")
+            .scalar())
+
+def remaining_pages(data, offset, limit):
+    """
+    Liczba stron, które zostały jeszcze do pobrania za bieżącą stroną (na podstawie metainfo.total_count).
+    """
+    total = (data.get("metainfo") or {}).get("total_count")
+    if total is None:
+        return 0
+    return max(0, -(-(total - offset - limit) // limit))
+
+def update_existing_cases(start_offset=0, limit=100, incremental=True, early_stop=True, max_pages=None, run=None):
     """
     Aktualizuje dane (status, kwoty) dla faktur już istniejących w bazie.
     Jeśli faktura została opłacona, odpowiadająca jej sprawa zostaje zamknięta.
+    W trybie przyrostowym pobiera tylko faktury zmienione od zapisanego znacznika
+    (SyncWatermark "update"); co SYNC_CONFIG["full_reconcile_hours"] wykonywane jest
+    pełne przejście. Znacznik jest przesuwany tylko po udanym przebiegu od offsetu 0.
+    Faktury, których odcisk (remote_hash) się nie zmienił, są pomijane bez zapisu
+    i bez ponownej oceny statusu sprawy (liczone jako "bez zmian").
+    Przy early_stop stronicowanie (invoice_date desc) kończy się, gdy strony zejdą poniżej
+    najstarszej faktury z aktywną sprawą; liczba pominiętych stron trafia do SyncStatus.
+    Strony pobierane są przez SyncPipeline (z wyprzedzeniem), a zapisywane po kolei.
+    max_pages ogranicza przebieg do podanej liczby stron (np. jeden shard /sync_db_batch).
+    run (SyncRun) – punkt kontrolny zapisywany razem z każdą stroną (etap "update").
     Zwraca liczbę zaktualizowanych rekordów.
     """
-    client = InFaktAPIClient()
     processed_count = 0
-    offset = start_offset
     start_time = datetime.utcnow()
+    metrics = SyncMetrics.start()
+    try:
+        closed_count = 0
+        unchanged_count = 0
+        pages_skipped = 0
+        oldest_active = oldest_active_invoice_date() if early_stop else None
+        watermark = db.session.get(SyncWatermark, "update")
+        incremental = incremental and use_incremental_sync(watermark, start_time)
+        newest_change = parse_api_timestamp(watermark.last_value) if watermark else None
+        print(f"[update_existing_cases] Tryb: {'przyrostowy od ' + watermark.last_value if incremental else 'pełny'}")
+        if run:
+            # Offset punktu kontrolnego dotyczy listy w tym samym trybie i od tego samego znacznika
+            list_key = f"update:incremental:{watermark.last_value}" if incremental else "update:full"
+            resumed_offset, start_offset = start_offset, run.align_offset(list_key, start_offset)
+            if resumed_offset != start_offset:
+                print(f"[update_existing_cases] Punkt kontrolny (offset {resumed_offset}) dotyczy innej listy – zaczynam od 0")
 
-    while True:
         params = {
-            "offset": offset,
-            "limit": limit,
-            "fields": "id,uuid,number,invoice_date,gross_price,status,client_id,payment_date,paid_price,payment_method,client_nip,client_company_name",
+            "fields": "id,uuid,number,invoice_date,gross_price,status,client_id,payment_date,paid_price,payment_method,client_nip,client_company_name,updated_at",
             "order": "invoice_date desc"
         }
-        url = f"{client.base_url}/invoices.json"
-        try:
-            response = client._session.get(url, headers=client.headers, params=params)
-            response.raise_for_status()
-        except Exception as e:
-            print(f"[update_existing_cases] Błąd przy pobieraniu partii offset={offset}: {e}")
-            break
-
-        data = response.json()
-        batch_invoices = data.get("entities", [])
+        if incremental:
+            params["q[updated_at_gteq]"] = watermark.last_value
         # Pobieramy faktury o statusie 'sent', 'printed' lub 'paid'
-        batch_invoices = [inv for inv in batch_invoices if inv.get('status') in ('sent', 'printed', 'paid')]
-        if not batch_invoices:
-            break
-
-        for inv_data in batch_invoices:
-            local_inv = Invoice.query.filter_by(id=inv_data['id']).first()
-            if not local_inv:
-                # Jeśli faktura jeszcze nie istnieje, pomijamy ją (może być już utworzona przez sync_new)
-                continue
-
-            # Aktualizacja daty wystawienia
-            d_str = inv_data.get('invoice_date')
-            if d_str and d_str != 'N/A':
-                try:
-                    local_inv.invoice_date = datetime.strptime(d_str, '%Y-%m-%d').date()
-                except Exception as e:
-                    print(f"[update_existing_cases] Błąd konwersji invoice_date: {e}")
-
-            # Aktualizacja terminu płatności
-            pd_str = inv_data.get('payment_date')
-            payment_due = None
-            if pd_str and pd_str != 'N/A':
-                try:
-                    payment_due = datetime.strptime(pd_str, '%Y-%m-%d').date()
-                except Exception as e:
-                    print(f"[update_existing_cases] Błąd konwersji payment_date: {e}")
-            local_inv.payment_due_date = payment_due
-
-            local_inv.gross_price = inv_data.get('gross_price', 0)
-            local_inv.status = inv_data.get('status', '')
-            local_inv.paid_price = inv_data.get('paid_price', 0)
-            paid = local_inv.paid_price if local_inv.paid_price is not None else 0
-            local_inv.left_to_pay = local_inv.gross_price - paid
-
-            db.session.add(local_inv)
+        # (strona bez takich faktur nie kończy przebiegu – znacznik musi objąć wszystkie strony)
+        pipeline = SyncPipeline(params, start_offset=start_offset, limit=limit, max_pages=max_pages,
+                                statuses=('sent', 'printed', 'paid'))
+
+        def write_page(page):
+            nonlocal processed_count, closed_count, unchanged_count, pages_skipped, newest_change
+            for inv_data in page.data.get("entities", []):
+                changed_at = parse_api_timestamp(inv_data.get('updated_at'))
+                if changed_at and (newest_change is None or changed_at > newest_change):
+                    newest_change = changed_at
+            batch_invoices = page.invoices
+
+            # Istniejące faktury i sprawy strony – po jednym zapytaniu IN (...) na tabelę
+            index = PageIndex.load(
+                [inv_data['id'] for inv_data in batch_invoices],
+                [inv_data.get('number', '') for inv_data in batch_invoices]
+            )
+            rows = []
+            case_rows = []
+            changed_cases = []
+            for inv_data in batch_invoices:
+                # Aktualizujemy tylko faktury istniejące lokalnie (nowe tworzy sync_new_invoices)
+                if inv_data['id'] not in index.invoice_ids:
+                    continue
+                row = remote_invoice_values(inv_data)
+                # Dane w API bez zmian – nie zapisujemy faktury ani nie sprawdzamy statusu sprawy
+                if index.invoice_hashes[inv_data['id']] == row["remote_hash"]:
+                    unchanged_count += 1
+                    continue
+                row["id"] = inv_data['id']
+                rows.append(row)
+                # Status sprawy zapisujemy tylko, gdy sprawa istnieje i status faktycznie się zmienia
+                case_number = inv_data.get('number', '')
+                if case_number not in index.cases:
+                    continue
+                changed_cases.append(index.cases[case_number][0])
+                new_status = case_status_from(row["status"], row["paid_price"], row["gross_price"])
+                if index.cases[case_number][1] != new_status:
+                    case_rows.append({"case_number": case_number, "status": new_status})
+                    if new_status != "active":
+                        closed_count += 1
+            # Strona zapisywana w jednej transakcji (UPDATE faktur i spraw jako executemany)
+            update_rows(Invoice, rows, "id")
+            update_rows(Case, case_rows, "case_number")
+            # Kwoty, termin i status zmienionych spraw w podsumowaniu list
+            refresh_dashboard(changed_cases)
+            if run:
+                run.checkpoint("update", page.offset + limit, updated_count=run.updated_count + len(rows))
             db.session.commit()
+            processed_count += len(rows)
+
+            # Kolejne strony zawierają już tylko starsze faktury – bez aktywnych spraw
+            if early_stop:
+                page_dates = [remote_invoice_values(inv_data)["invoice_date"] for inv_data in page.data.get("entities", [])]
+                page_dates = [d for d in page_dates if d]
+                if oldest_active is None or (page_dates and min(page_dates) < oldest_active):
+                    pages_skipped = remaining_pages(page.data, page.offset, limit)
+                    print(f"[update_existing_cases] Koniec aktywnych spraw (najstarsza: {oldest_active}), pominięto {pages_skipped} stron")
+                    return False
+            return True
 
-            # Aktualizacja statusu sprawy odpowiadającej fakturze
-            case_obj = Case.query.filter_by(case_number=local_inv.invoice_number).first()
-            if case_obj:
-                if local_inv.status.lower() == "paid" or local_inv.paid_price >= local_inv.gross_price:
-                    case_obj.status = "closed_oplacone"
-                else:
-                    case_obj.status = "active"
-                db.session.add(case_obj)
-                db.session.commit()
-            processed_count += 1
-        offset += limit
-
-    duration = (datetime.utcnow() - start_time).total_seconds()
-    sync_record = SyncStatus(sync_type="update", processed=processed_count, duration=duration)
-    db.session.add(sync_record)
-    db.session.commit()
-    print(f"[update_existing_cases] Zaktualizowano {processed_count} faktur (offset={start_offset}) w {duration:.2f}s")
-    return processed_count
+        pipeline.run(write_page)
+        failed = pipeline.failure is not None
+        if failed:
+            print(f"[update_existing_cases] Błąd przy pobieraniu partii {pipeline.failure}")
+            if run:
+                run.fail(f"update, {pipeline.failure}")
+        complete_range = start_offset == 0 and not pipeline.reached_max_pages
+
+        # Przesuwamy znacznik tylko po pełnym, udanym przebiegu całego zakresu
+        if not failed and complete_range:
+            if not watermark:
+                watermark = SyncWatermark(sync_type="update")
+            if newest_change:
+                watermark.last_value = newest_change.isoformat()
+            if not incremental:
+                watermark.last_full_sync = start_time
+            db.session.add(watermark)
+
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        sync_record = SyncStatus(sync_type="update", processed=processed_count, duration=duration,
+                                 updated_count=processed_count, pages_skipped=pages_skipped,
+                                 unchanged_count=unchanged_count, closed_count=closed_count)
+        db.session.add(metrics.apply(sync_record))
+        db.session.commit()
+        print(f"[update_existing_cases] Zaktualizowano {processed_count} faktur, bez zmian {unchanged_count}, "
+              f"zamknięto {closed_count} spraw (offset={start_offset}) w {duration:.2f}s")
+        return processed_count
+    finally:
+        metrics.stop()
 
 def run_full_sync():
     """
@@ -201,15 +367,47 @@ def run_full_sync():
     Rejestruje łączny wynik w SyncStatus (typ "full").
     """
     start_time = datetime.utcnow()
-    new_count = sync_new_invoices()
-    update_count = update_existing_cases()
-    total = new_count + update_count
-    duration = (datetime.utcnow() - start_time).total_seconds()
-    sync_record = SyncStatus(sync_type="full", processed=total, duration=duration)
-    db.session.add(sync_record)
-    db.session.commit()
-    print(f"[run_full_sync] Łącznie przetworzono {total} faktur (nowe: {new_count}, aktualizacje: {update_count}) w {duration:.2f}s")
-    return total
+    metrics = SyncMetrics.start()
+    try:
+        new_count = sync_new_invoices()
+        update_count = update_existing_cases()
+        total = new_count + update_count
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        sync_record = SyncStatus(sync_type="full", processed=total, duration=duration,
+                                 new_count=new_count, updated_count=update_count)
+        db.session.add(metrics.apply(sync_record))
+        db.session.commit()
+        print(f"[run_full_sync] Łącznie przetworzono {total} faktur (nowe: {new_count}, aktualizacje: {update_count}) w {duration:.2f}s")
+        return total
+    finally:
+        metrics.stop()
+
+def run_batch_sync(offset, limit):
+    """
+    Synchronizacja jednego shardu (zakres offset..offset+limit) wywoływana przez /sync_db_batch.
+    Shardy wykonywane są po kolei: /sync_db_batch uruchamia je pod wspólną blokadą synchronizacji
+    (job_runner.run_exclusive), więc nie biegną równolegle ze sobą ani z pełną synchronizacją
+    i odświeżaniem planowym. Każdy shard zapisuje własny wiersz SyncStatus.
+    Zakresem dzielona jest tylko aktualizacja istniejących spraw. Nowe faktury (lista z jednego dnia
+    płatności, zwykle jedna strona) pobiera w całości shard z offset 0 – w pozostałych ta lista
+    dawałaby pustą stronę, czyli tylko dodatkowe zapytanie do API.
+    Zwraca słownik z wynikiem.
+    """
+    shard = f"{offset}:{limit}"
+    start_time = datetime.utcnow()
+    metrics = SyncMetrics.start()
+    try:
+        new_count = sync_new_invoices() if offset == 0 else 0
+        update_count = update_existing_cases(start_offset=offset, limit=limit, incremental=False, max_pages=1)
+        total = new_count + update_count
+        duration = (datetime.utcnow() - start_time).total_seconds()
+        db.session.add(metrics.apply(SyncStatus(sync_type=f"batch {offset}-{offset + limit}", processed=total,
+                                                duration=duration, new_count=new_count, updated_count=update_count)))
+        db.session.commit()
+        print(f"[run_batch_sync] Shard {shard}: {total} faktur (nowe: {new_count}, aktualizacje: {update_count}) w {duration:.2f}s")
+        return {"shard": shard, "claimed": True, "processed": total, "new": new_count, "updated": update_count}
+    finally:
+        metrics.stop()
 
 if __name__ == "__main__":
     run_full_sync()
\ No newline at end of file